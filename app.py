@@ -26,7 +26,6 @@ Welcome to **OpenOMR**, a ZipGrade-like grading application built with Python.
 4. Grade them using **Scanner**.
 """)
 
-# Initialize DB if needed (though db_manager does this on import check, calling helper ensures it)
-if "db_init" not in st.session_state:
-    db_manager.init_db()
-    st.session_state["db_init"] = True
+# Schema migrations run at deploy time (python migrations.py); this only catches a database
+# that was never migrated, once per server process
+db_manager.ensure_schema()
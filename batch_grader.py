@@ -0,0 +1,514 @@
+import argparse
+import functools
+import glob
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+import db_manager
+import omr_engine
+import scan_archive
+import scan_dedup
+import scoring
+import stage_profiler
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+# Layout parameters for process_exam, set once per worker process
+_worker_layout = {}
+_worker_options = {"profile": False, "archive": None}
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+def collect_images(sources):
+    """
+    Expands directories and glob patterns into a sorted list of image paths.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    paths = []
+    for src in sources:
+        if os.path.isdir(src):
+            candidates = [os.path.join(src, f) for f in os.listdir(src)]
+        else:
+            candidates = glob.glob(src, recursive=True)
+        paths.extend(p for p in candidates if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(set(paths))
+
+def load_exam_context(exam_id):
+    """
+    Loads everything needed to grade sheets of one exam: key, versions, layout and roster.
+    Mirrors what the Grade Exam page resolves for a single scan.
+    """
+    details = db_manager.get_exam_details(exam_id)
+    if details is None:
+        raise ValueError(f"Exam {exam_id} not found")
+    # id, name, class_id, date, answer_key, mcq_choices, parent_id
+    answer_key = json.loads(details[4])
+    parent_id = None if _is_null(details[6]) else int(details[6])
+
+    versions = []
+    if "(Master)" in details[1] or parent_id is not None:
+        pid = parent_id if parent_id is not None else exam_id
+        versions = [(v[0], v[1], json.loads(v[3])) for v in db_manager.get_exam_versions(pid)]
+
+    # Determine layout question count (if master is empty, use first version's count)
+    num_questions = len(answer_key)
+    if num_questions == 0 and versions:
+        num_questions = len(versions[0][2])
+
+    students = {}
+    for sid, name, eid, oid in db_manager.get_students_by_class(details[2]):
+        if not _is_null(oid):
+            students[int(oid)] = (sid, name, eid)
+
+    return {
+        "exam_id": exam_id,
+        "master_id": parent_id if parent_id is not None else exam_id,
+        "exam_name": details[1],
+        "class_id": details[2],
+        "answer_key": answer_key,
+        "mcq_choices": int(details[5]),
+        "num_questions": num_questions,
+        "versions": versions,
+        "students": students
+    }
+
+@functools.lru_cache(maxsize=256)
+def _cached_key(exam_id):
+    details = db_manager.get_exam_details(exam_id)
+    return json.loads(details[4]) if details is not None else None
+
+def lookup_answer_key(exam_id):
+    """
+    key_resolver for process_exam: the answer key of the exam named by a sheet code.
+    Cached per process, so a pile of sheets costs one query per exam.
+    Sheets printed without a stored exam have no key to look up.
+    """
+    if exam_id is None:
+        return None
+    return _cached_key(int(exam_id))
+
+def forget_answer_keys():
+    """
+    Drops the cached keys after an answer key was edited.
+    """
+    _cached_key.cache_clear()
+
+def resolve_version_key(context, version_idx, exam_id=None):
+    """
+    Returns (exam_id, answer_key, exam_name) for the sheet.
+    A sheet code's exam_id names the exam or version directly; otherwise the detected
+    version letter is matched against the version names.
+    Falls back to the selected exam when no matching version exists.
+    Returns None when the sheet code names an exam outside this context.
+    """
+    if exam_id is not None:
+        if exam_id == context["exam_id"]:
+            return context["exam_id"], context["answer_key"], context["exam_name"]
+        for v_id, v_name, v_key in context["versions"]:
+            if v_id == exam_id:
+                return v_id, v_key, v_name
+        return None
+    if context["versions"] and version_idx is not None:
+        target_name_part = f"(Version {chr(65 + version_idx)})"
+        for v_id, v_name, v_key in context["versions"]:
+            if target_name_part in v_name:
+                return v_id, v_key, v_name
+    return context["exam_id"], context["answer_key"], context["exam_name"]
+
+def grade_answers(student_answers, answer_key, marks=None, numeric_answers=None):
+    """
+    Compares detected answers with the key.
+    Returns (score, total, graded_details); numeric questions are scored from numeric_answers
+    (the values read from their bubble grids) within the key's tolerance.
+    marks (process_exam's per-question classification) labels double marks as "Multi".
+    The key is compiled once (see scoring.compile_key) and reused across sheets.
+    """
+    return scoring.compile_key(answer_key).grade(student_answers, marks, numeric_answers)
+
+def grade_sheet(result, context):
+    """
+    Turns a process_exam result into a graded sheet record.
+    The record carries a 'row' ready for db_manager.save_results when a student was matched.
+    """
+    sheet = {
+        "path": result.get("path"),
+        "success": result["success"],
+        "error": result.get("error"),
+        "omr_id": result.get("omr_id"),
+        "version_idx": result.get("version_idx"),
+        "sheet_exam_id": result.get("exam_id"),
+        "confidence": result.get("confidence"),
+        "needs_review": result.get("needs_review", True),
+        "student": None,
+        "row": None
+    }
+    if not result["success"]:
+        return sheet
+
+    resolved = resolve_version_key(context, result.get("version_idx"), result.get("exam_id"))
+    if resolved is None:
+        sheet["error"] = f"Sheet was printed for exam {result['exam_id']}, not {context['exam_name']}."
+        return sheet
+    exam_id, answer_key, exam_name = resolved
+    score, total, graded_details = grade_answers(result["answers"], answer_key, result.get("marks"),
+                                                 result.get("numeric_answers"))
+    numeric_score = sum(d["points"] for d in graded_details.values() if d["type"] == "Numeric")
+    sheet.update({"exam_id": exam_id, "exam_name": exam_name, "score": score, "total": total})
+
+    student = context["students"].get(result.get("omr_id"))
+    if student is None:
+        sheet["error"] = "Could not read OMR ID." if result.get("omr_id") is None else \
+            f"Student with OMR ID {result['omr_id']} not found in this class!"
+        return sheet
+
+    sheet["student"] = student
+    sheet["row"] = {
+        "exam_id": exam_id,
+        "student_id": student[0],
+        "total_score": score,
+        "mcq_score": score - numeric_score,
+        "numeric_score": float(numeric_score),
+        "answers": graded_details,
+        "image_path": result.get("scan_key") or result.get("path"),
+        "intensities": result.get("intensities"),
+        "scan_hash": result.get("scan_hash"),
+        "answer_hash": result.get("answer_hash")
+    }
+    return sheet
+
+def duplicate_index(context, indexes):
+    """
+    scan_dedup.DuplicateIndex over the stored results of a context's exam and its versions,
+    loaded once per exam into indexes.
+    """
+    master_id = context["master_id"]
+    if master_id not in indexes:
+        indexes[master_id] = scan_dedup.DuplicateIndex(db_manager.get_result_hashes(master_id))
+    return indexes[master_id]
+
+def flag_duplicate(sheet, index, ref):
+    """
+    Checks a graded sheet against stored results and sheets seen earlier (double feeds,
+    re-photographed sheets): "duplicate_of" names the earlier read, a result id or the ref it
+    was added under. A repeat of the same ID and answers is kept out of the save; a sheet that
+    only has nearly the same marks is kept but flagged for review with a "warning".
+    New sheets are added to the index under ref.
+    """
+    if sheet["row"] is None:
+        return sheet
+    match = index.check(ref, dict(sheet["row"], omr_id=sheet.get("omr_id")))
+    if match is not None:
+        earlier, reason = match
+        label = f"result {earlier}" if isinstance(earlier, int) else earlier
+        sheet["duplicate_of"] = earlier
+        if reason == "answers":
+            sheet.update({"row": None, "error": f"Duplicate of {label} (same ID and answers)."})
+        else:
+            sheet.update({"needs_review": True, "warning": f"Possible duplicate of {label} (same marks)."})
+    return sheet
+
+def rescore_results(rows):
+    """
+    Re-scores stored results against their exams' current keys, from the answers saved with
+    each result. rows are db_manager.get_results_for_regrade tuples; each distinct key is
+    compiled once and its results scored as one matrix.
+    Returns (updates, changes): rows for db_manager.update_result_scores (every result whose
+    scores or details differ) and the score changes [{"result_id", "exam_id", "student",
+    "old", "new"}].
+    Results without any numeric read (sheets saved before numeric grids were read, whose
+    numeric questions were graded by hand as "Num") keep their stored numeric score.
+    """
+    by_key = {}
+    for row in rows:
+        by_key.setdefault(row[5], []).append(row)
+    updates = []
+    changes = []
+    for key_json, group in by_key.items():
+        key = scoring.compile_key(json.loads(key_json))
+        codes, values = key.encode_graded(json.loads(r[4] or "{}") for r in group)
+        earned, correct = key.score(codes, values)
+        mcq, numeric = key.split_score(earned)
+        for i, (result_id, exam_id, student, old_score, answers_json, _, old_numeric) in enumerate(group):
+            details = key.details(codes[i], values[i], earned[i], correct[i])
+            numeric_score = float(numeric[i])
+            if key.numeric.any() and np.isnan(values[i, key.numeric]).all() and not _is_null(old_numeric):
+                numeric_score = float(old_numeric)
+                old_details = json.loads(answers_json or "{}")
+                for q in np.asarray(key.questions)[key.numeric]:
+                    if old_details.get(str(q), {}).get("student") == "Num":
+                        details[int(q)] = old_details[str(q)]
+            new_score = float(mcq[i]) + numeric_score
+            score_changed = _is_null(old_score) or abs(new_score - float(old_score)) > scoring.NUMERIC_EPSILON
+            if not score_changed and json.dumps(details) == answers_json:
+                continue
+            updates.append({
+                "result_id": int(result_id),
+                "total_score": new_score,
+                "mcq_score": float(mcq[i]),
+                "numeric_score": numeric_score,
+                "answers": details
+            })
+            if score_changed:
+                changes.append({"result_id": int(result_id), "exam_id": int(exam_id), "student": student,
+                                "old": None if _is_null(old_score) else float(old_score), "new": new_score})
+    changes.sort(key=lambda c: c["result_id"])
+    return updates, changes
+
+def regrade_exam(exam_id, save=True):
+    """
+    Re-grades every result of an exam, or of a master and all its versions, after a key change:
+    one query to load, one vectorized pass per key and one bulk UPDATE to write back.
+    Returns the score changes (see rescore_results).
+    """
+    forget_answer_keys()
+    updates, changes = rescore_results(db_manager.get_results_for_regrade(exam_id))
+    if save:
+        db_manager.update_result_scores(updates)
+    return changes
+
+def redecide_results(rows, blobs, classifier=None, id_ratio=omr_engine.ID_RATIO, answer_ratio=omr_engine.ANSWER_RATIO):
+    """
+    Re-reads stored results from their sampled intensities (no images) with another classifier
+    or other ratios, and re-scores them against their exams' current keys. rows are
+    db_manager.get_results_for_regrade tuples and blobs maps result id -> intensity blob
+    (db_manager.get_result_intensities); results without a blob are left alone. Every sheet is
+    decided in one omr_engine.redecide pass. The student of each result is kept.
+    Returns (updates, changes) like rescore_results.
+    """
+    rows = [r for r in rows if int(r[0]) in blobs]
+    decisions = omr_engine.redecide([blobs[int(r[0])] for r in rows], classifier, id_ratio, answer_ratio)
+    by_key = {}
+    for row, decision in zip(rows, decisions):
+        by_key.setdefault(row[5], []).append((row, decision))
+    updates = []
+    changes = []
+    for key_json, group in by_key.items():
+        key = scoring.compile_key(json.loads(key_json))
+        codes, values = key.encode((d["answers"], d["marks"], d["numeric_answers"]) for _, d in group)
+        earned, correct = key.score(codes, values)
+        mcq, numeric = key.split_score(earned)
+        for i, ((result_id, exam_id, student, old_score, answers_json, _, _), _) in enumerate(group):
+            details = key.details(codes[i], values[i], earned[i], correct[i])
+            new_score = float(mcq[i] + numeric[i])
+            score_changed = _is_null(old_score) or abs(new_score - float(old_score)) > scoring.NUMERIC_EPSILON
+            if not score_changed and json.dumps(details) == answers_json:
+                continue
+            updates.append({
+                "result_id": int(result_id),
+                "total_score": new_score,
+                "mcq_score": float(mcq[i]),
+                "numeric_score": float(numeric[i]),
+                "answers": details
+            })
+            if score_changed:
+                changes.append({"result_id": int(result_id), "exam_id": int(exam_id), "student": student,
+                                "old": None if _is_null(old_score) else float(old_score), "new": new_score})
+    changes.sort(key=lambda c: c["result_id"])
+    return updates, changes
+
+def redecide_exam(exam_id, save=True, **options):
+    """
+    Re-reads every stored result of an exam (or a master and its versions) from its sampled
+    intensities and re-scores it, without the scans; options go to redecide_results.
+    Returns the score changes; with save=False nothing is written (a preview).
+    """
+    forget_answer_keys()
+    blobs = {rid: blob for rid, _, blob in db_manager.get_result_intensities(exam_id)}
+    updates, changes = redecide_results(db_manager.get_results_for_regrade(exam_id), blobs, **options)
+    if save:
+        db_manager.update_result_scores(updates)
+    return changes
+
+def _init_worker(layout, profile=False, archive=None):
+    # One OpenCV thread per process: the pool provides the parallelism
+    cv2.setNumThreads(1)
+    _worker_layout.update(layout)
+    _worker_options["profile"] = profile
+    _worker_options["archive"] = archive
+
+def _process_sheet(path):
+    profiler = stage_profiler.StageProfiler() if _worker_options["profile"] else None
+    archive = _worker_options["archive"]
+    if archive is None:
+        result = omr_engine.process_exam(path, key_resolver=lookup_answer_key, profiler=profiler, **_worker_layout)
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+        result = omr_engine.process_exam(data, key_resolver=lookup_answer_key, profiler=profiler, crop=True, **_worker_layout)
+        if result["success"]:
+            scan_archive.archive_result(result, data, archive)
+    # Images stay in the worker; only the decoded data crosses the process boundary
+    result.pop("preview_image", None)
+    result.pop("debug_image", None)
+    result.pop("answer_crop", None)
+    result["path"] = path
+    return result
+
+def iter_processed_sheets(paths, context=None, workers=None, profile=False, archive=None):
+    """
+    Runs process_exam over paths in a process pool, yielding results as they finish.
+    Without a context, every sheet's layout comes from its printed sheet code.
+    With profile, each result carries its per-stage timings under "profile".
+    With an archive directory, readable scans are stored in the scan archive by the workers
+    and each result carries its archive key under "scan_key".
+    """
+    layout = {
+        # No preview is shown in batch mode, so skip the full warp entirely
+        "sampling": "projected",
+        "preview": False
+    }
+    if context is not None:
+        layout.update({
+            "num_questions": context["num_questions"],
+            "mcq_choices": context["mcq_choices"],
+            "question_data": context["answer_key"]
+        })
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(layout, profile, archive)) as pool:
+        futures = {pool.submit(_process_sheet, p): p for p in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {"success": False, "error": str(e), "path": futures[future]}
+
+def _merge_booklet(pages):
+    merged = omr_engine.merge_page_results(pages)
+    merged["path"] = pages[0].get("path")
+    merged["paths"] = [r.get("path") for r in pages]
+    merged["scan_key"] = scan_archive.join_keys(r.get("scan_key") for r in pages) or None
+    return merged
+
+def group_pages(results):
+    """
+    Pairs the pages of multi-page sheets by arrival order and page index: a booklet is complete
+    at its last page, and a page index that repeats or goes back (or another exam's page) starts
+    the next one. Single-page and unreadable results pass straight through.
+    Yields one result per sheet.
+    """
+    pending = []
+    for result in results:
+        if not result["success"] or result.get("num_pages", 1) == 1:
+            yield result
+            continue
+        if pending and (result["page"] <= pending[-1]["page"] or result.get("exam_id") != pending[-1].get("exam_id")):
+            yield _merge_booklet(pending)
+            pending = []
+        pending.append(result)
+        if result["page"] == result["num_pages"] - 1:
+            yield _merge_booklet(pending)
+            pending = []
+    if pending:
+        yield _merge_booklet(pending)
+
+def context_for_sheet(result, contexts):
+    """
+    Exam context named by a sheet's code, loaded once per exam into contexts.
+    Raises ValueError when the sheet has no code or names an unknown exam.
+    """
+    exam_id = result.get("exam_id")
+    if exam_id is None:
+        raise ValueError("No sheet code found; grade this sheet with --exam-id.")
+    if exam_id not in contexts:
+        contexts[exam_id] = load_exam_context(exam_id)
+    return contexts[exam_id]
+
+def grade_batch(sources, exam_id=None, workers=None, save=True, stats=None, archive=None):
+    """
+    Grades a folder or glob of scans against one exam, or, with exam_id=None, a mixed pile
+    of sheets that each carry a printed sheet code.
+    Yields graded sheets as they complete; pages of multi-page sheets are held back and
+    paired in file-name order once all scans are read. Once exhausted, all matched sheets
+    are written with a single bulk save.
+    With a stage_profiler.ProfileStats, every scan is profiled and added to stats.
+    With an archive directory, saved rows point at the archived scans instead of the input files.
+    Sheets that repeat a stored result or an earlier sheet of the pile are not saved; sheets
+    with nearly the same marks are saved but flagged for review (see flag_duplicate).
+    """
+    context = load_exam_context(exam_id) if exam_id is not None else None
+    contexts = {}
+    indexes = {}
+    rows = []
+    paths = collect_images(sources)
+    order = {p: i for i, p in enumerate(paths)}
+    pages = []
+
+    def single_sheets():
+        for result in iter_processed_sheets(paths, context, workers, profile=stats is not None, archive=archive):
+            if stats is not None:
+                stats.add(result.get("profile"))
+            if result["success"] and result.get("num_pages", 1) > 1:
+                pages.append(result)
+            else:
+                yield result
+
+    def booklets():
+        pages.sort(key=lambda r: order[r["path"]])
+        yield from group_pages(pages)
+
+    for result in itertools.chain(single_sheets(), booklets()):
+        sheet_context = context
+        if sheet_context is None and result["success"]:
+            try:
+                sheet_context = context_for_sheet(result, contexts)
+            except ValueError as e:
+                result = dict(result, success=False, error=str(e))
+        sheet = grade_sheet(result, sheet_context)
+        if sheet["row"] is not None:
+            flag_duplicate(sheet, duplicate_index(sheet_context, indexes), sheet["path"])
+        if sheet["row"] is not None:
+            rows.append(sheet["row"])
+        yield sheet
+    if save and rows:
+        db_manager.save_results(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade a folder of scanned answer sheets.")
+    parser.add_argument("sources", nargs="+", help="Directories or glob patterns of scanned images")
+    parser.add_argument("--exam-id", type=int, default=None,
+                        help="Exam (or master exam) to grade against; omit to read it from each sheet's code")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--dry-run", action="store_true", help="Grade without saving to the database")
+    parser.add_argument("--profile", action="store_true", help="Print p50/p95 timings per pipeline stage")
+    parser.add_argument("--archive", nargs="?", const=scan_archive.ARCHIVE_DIR, default=None, metavar="DIR",
+                        help=f"Store scans in the scan archive (default: {scan_archive.ARCHIVE_DIR})")
+    args = parser.parse_args(argv)
+    stats = stage_profiler.ProfileStats() if args.profile else None
+
+    start = time.perf_counter()
+    graded = 0
+    saved = 0
+    duplicates = 0
+    for sheet in grade_batch(args.sources, args.exam_id, workers=args.workers, save=not args.dry_run, stats=stats,
+                             archive=args.archive):
+        graded += 1
+        if sheet["row"] is not None:
+            saved += 1
+            tag = "[review]" if sheet["needs_review"] else "[ok]    "
+            note = f"  {sheet['warning']}" if sheet.get("warning") else ""
+            print(f"{tag} {sheet['path']}  OMR {sheet['omr_id']:03d}  {sheet['student'][1]}  {sheet['score']:g}/{sheet['total']:g}{note}")
+        elif sheet.get("duplicate_of") is not None:
+            duplicates += 1
+            print(f"[dup]    {sheet['path']}  {sheet['error']}")
+        else:
+            print(f"[fail]   {sheet['path']}  {sheet['error']}")
+    elapsed = time.perf_counter() - start
+
+    rate = graded / elapsed * 60 if elapsed > 0 else 0.0
+    action = "Would save" if args.dry_run else "Saved"
+    print(f"Graded {graded} sheets in {elapsed:.1f}s ({rate:.0f} sheets/min). {action} {saved} results."
+          + (f" Skipped {duplicates} duplicates." if duplicates else ""))
+    if stats is not None and stats.count:
+        print(stage_profiler.format_summary(stats.summary()))
+    return 0 if graded else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
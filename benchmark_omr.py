@@ -0,0 +1,143 @@
+import argparse
+import json
+import resource
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import omr_engine
+import sheet_layout
+import sheet_renderer
+import stage_profiler
+
+# Capture conditions for sheet_renderer.photograph (seed is added per sheet)
+CONDITIONS = {
+    "flat": {},
+    "phone": {"angle": 4, "perspective": 0.03, "blur": 1.0, "shadow": 0.3, "noise": 4, "jpeg_quality": 85},
+    "harsh": {"angle": 10, "perspective": 0.05, "blur": 2.0, "shadow": 0.5, "noise": 8, "jpeg_quality": 60},
+}
+STAGES = ("decode", "markers", "header", "warp", "sampling", "total")
+
+def make_sheets(num_questions, mcq_choices, count, condition, px_per_mm=8, faint=0.0, seed=0):
+    """
+    Renders count random single-page sheets and photographs them under condition.
+    Returns [(jpeg_bytes, truth)], truth holding the omr_id and answers that were filled in.
+    A fraction faint of the answers is marked lightly.
+    """
+    rng = np.random.default_rng(seed)
+    layout = sheet_layout.get_layout(num_questions, mcq_choices)
+    sheets = []
+    for i in range(count):
+        omr_id = int(rng.integers(1000))
+        answers = {q: int(rng.integers(mcq_choices)) for q in layout.questions}
+        partial = {q: 0.6 for q in layout.questions if rng.random() < faint}
+        img = sheet_renderer.render_sheet(layout, omr_id=omr_id, version_idx=int(rng.integers(5)), answers=answers,
+                                          partial=partial, px_per_mm=px_per_mm)
+        photo = sheet_renderer.photograph(img, seed=seed * 1000 + i, **CONDITIONS[condition])
+        sheets.append((sheet_renderer.encode_jpeg(photo, 95), {"omr_id": omr_id, "answers": answers}))
+    return sheets
+
+# Pipeline stages summed into the "sampling" column
+SAMPLING_STAGES = ("id", "version", "answers", "numeric", "decide")
+
+def stage_seconds(profile):
+    """
+    Seconds per benchmark stage from a process_exam profile report; nested stages are already
+    counted in their parent.
+    """
+    ms = {name: r["ms"] for name, r in profile["stages"].items() if "." not in name}
+    times = {stage: ms[stage] / 1000 for stage in ("decode", "markers", "header", "warp") if stage in ms}
+    if any(stage in ms for stage in SAMPLING_STAGES):
+        times["sampling"] = sum(ms.get(stage, 0.0) for stage in SAMPLING_STAGES) / 1000
+    return times
+
+def run_config(num_questions, mcq_choices, count, condition, px_per_mm=8, faint=0.0, seed=0, sampling="projected"):
+    """
+    Benchmarks one question count / choice count / condition combination with process_exam's
+    sampling mode ("warp" or "projected").
+    """
+    sheets = make_sheets(num_questions, mcq_choices, count, condition, px_per_mm, faint, seed)
+    stage_times = {stage: [] for stage in STAGES}
+    correct = answered = ids = review = failed = 0
+
+    profiler = stage_profiler.StageProfiler()
+    for data, truth in sheets:
+        start = time.perf_counter()
+        result = omr_engine.process_exam(data, num_questions, mcq_choices, preview=False, sampling=sampling, profiler=profiler)
+        elapsed = time.perf_counter() - start
+        for stage, t in stage_seconds(result["profile"]).items():
+            stage_times[stage].append(t)
+        stage_times["total"].append(elapsed)
+
+        answered += len(truth["answers"])
+        if not result["success"]:
+            failed += 1
+            continue
+        correct += sum(result["answers"].get(q) == a for q, a in truth["answers"].items())
+        ids += result["omr_id"] == truth["omr_id"]
+        review += bool(result["needs_review"])
+
+    # Peak Python-side allocations (numpy buffers included) of one full read
+    tracemalloc.start()
+    omr_engine.process_exam(sheets[0][0], num_questions, mcq_choices, preview=False, sampling=sampling)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(stage_times["total"])
+    return {
+        "questions": num_questions,
+        "choices": mcq_choices,
+        "condition": condition,
+        "sampling": sampling,
+        "sheets": count,
+        "sheets_per_sec": count / total if total > 0 else 0.0,
+        "median_ms": {stage: float(np.median(t)) * 1000 if t else None for stage, t in stage_times.items()},
+        "peak_mb": peak / 2 ** 20,
+        "answer_accuracy": correct / answered if answered else 0.0,
+        "id_accuracy": ids / count,
+        "review_rate": review / count,
+        "failed": failed
+    }
+
+def format_row(r):
+    ms = " ".join(f"{r['median_ms'][s]:7.1f}" if r['median_ms'][s] is not None else "      -" for s in STAGES)
+    return (f"{r['questions']:>4} {r['choices']:>3} {r['condition']:<6} {r['sampling']:<9} {r['sheets_per_sec']:7.1f} {ms} "
+            f"{r['peak_mb']:7.1f} {r['answer_accuracy']:7.1%} {r['id_accuracy']:6.0%} {r['review_rate']:7.0%} {r['failed']:>4}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the OMR engine on synthetic sheets (runs offline).")
+    parser.add_argument("--questions", type=int, nargs="+", default=[10, 20, 45], help="Question counts (one page each)")
+    parser.add_argument("--choices", type=int, nargs="+", default=[4, 5], help="MCQ choice counts")
+    parser.add_argument("--conditions", nargs="+", default=["flat", "phone"], choices=sorted(CONDITIONS))
+    parser.add_argument("--sampling", nargs="+", default=["projected"], choices=["warp", "projected"],
+                        help="process_exam sampling modes to compare")
+    parser.add_argument("--sheets", type=int, default=10, help="Sheets per combination")
+    parser.add_argument("--px-per-mm", type=float, default=8, help="Render resolution (8 = about 4 MP)")
+    parser.add_argument("--faint", type=float, default=0.0, help="Fraction of answers marked lightly")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    cv2.setNumThreads(1) # Per-sheet latency, comparable across machines
+    header = " ".join(f"{s:>7}" for s in STAGES)
+    print(f"   Q  Ch cond   sampling  sheet/s {header} peak MB  answers    IDs  review fail")
+    results = []
+    for condition in args.conditions:
+        for num_questions in args.questions:
+            for mcq_choices in args.choices:
+                for sampling in args.sampling:
+                    r = run_config(num_questions, mcq_choices, args.sheets, condition, args.px_per_mm, args.faint, args.seed, sampling)
+                    results.append(r)
+                    print(format_row(r), flush=True)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Stage times are medians in ms. Process peak RSS: {max_rss:.0f} MB.")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "max_rss_mb": max_rss, "args": vars(args)}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
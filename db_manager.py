@@ -1,65 +1,55 @@
 import streamlit as st
-from sqlalchemy import text
+from sqlalchemy import event, text
+import itertools
 import json
+import os
+import migrations
+import query_cache
 
 def get_connection():
     # This uses the configuration in .streamlit/secrets.toml
     return st.connection("sql", type="sql")
 
 def init_db():
+    """
+    Applies pending schema migrations (see migrations.py). Deployments run
+    `python migrations.py` instead; the app only checks once per server process.
+    """
+    return migrations.migrate(get_connection())
+
+@st.cache_resource(show_spinner=False)
+def ensure_schema():
+    """
+    init_db once per server process: new sessions issue no DDL, and an up-to-date database
+    costs one version query.
+    """
+    return init_db()
+
+# --- Read cache ---
+# Classes, rosters and exams are read on every rerun but rarely change, so their reads are
+# cached per server process and dropped by the writes to the tables they read (results are
+# not cached). Set OMR_CACHE_SYNC_SECONDS when several processes share the database: each then
+# checks the cache_versions counters that every write bumps at most that often.
+def _cache_versions():
     conn = get_connection()
     with conn.session as s:
-        # Classes Table
-        s.execute(text('''CREATE TABLE IF NOT EXISTS classes (
-                        id SERIAL PRIMARY KEY,
-                        name TEXT NOT NULL UNIQUE
-                    )'''))
-        
-        # Students Table
-        s.execute(text('''CREATE TABLE IF NOT EXISTS students (
-                        id SERIAL PRIMARY KEY,
-                        name TEXT NOT NULL,
-                        educational_id TEXT, 
-                        omr_id INTEGER,
-                        class_id INTEGER REFERENCES classes(id),
-                        UNIQUE(class_id, omr_id),
-                        UNIQUE(class_id, educational_id)
-                    )'''))
-        
-        # Exams Table
-        s.execute(text('''CREATE TABLE IF NOT EXISTS exams (
-                        id SERIAL PRIMARY KEY,
-                        name TEXT NOT NULL,
-                        class_id INTEGER REFERENCES classes(id),
-                        date TEXT,
-                        answer_key TEXT,
-                        mcq_choices INTEGER DEFAULT 5,
-                        parent_id INTEGER REFERENCES exams(id)
-                    )'''))
-        
-        # Results Table
-        s.execute(text('''CREATE TABLE IF NOT EXISTS results (
-                        id SERIAL PRIMARY KEY,
-                        exam_id INTEGER REFERENCES exams(id),
-                        student_id INTEGER REFERENCES students(id),
-                        score DOUBLE PRECISION,
-                        mcq_score DOUBLE PRECISION DEFAULT 0,
-                        numeric_score DOUBLE PRECISION DEFAULT 0,
-                        answers TEXT,
-                        image_path TEXT,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )'''))
-        
-        # Migration: Add columns if they don't exist
-        try:
-            s.execute(text("ALTER TABLE exams ADD COLUMN IF NOT EXISTS mcq_choices INTEGER DEFAULT 5"))
-            s.execute(text("ALTER TABLE exams ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES exams(id)"))
-            s.execute(text("ALTER TABLE results ADD COLUMN IF NOT EXISTS mcq_score DOUBLE PRECISION DEFAULT 0"))
-            s.execute(text("ALTER TABLE results ADD COLUMN IF NOT EXISTS numeric_score DOUBLE PRECISION DEFAULT 0"))
-        except Exception:
-            pass
-            
-        s.commit()
+        return dict(s.execute(text("SELECT table_name, version FROM cache_versions")).fetchall())
+
+_sync = os.environ.get("OMR_CACHE_SYNC_SECONDS")
+_cache = query_cache.QueryCache(max_entries=int(os.environ.get("OMR_CACHE_SIZE", 256)),
+                                sync_interval=float(_sync) if _sync else None, load_versions=_cache_versions)
+
+def _touch(s, *tables):
+    """
+    Marks the cached reads of tables stale once session s commits, and bumps their
+    cache_versions counters in the same transaction for the other processes.
+    """
+    tables = sorted(tables)
+    values = ", ".join(f"(:t{j}, 1)" for j in range(len(tables)))
+    s.execute(text(f'''INSERT INTO cache_versions (table_name, version) VALUES {values}
+                       ON CONFLICT (table_name) DO UPDATE SET version = cache_versions.version + 1'''),
+              {f"t{j}": t for j, t in enumerate(tables)})
+    event.listen(s, "after_commit", lambda session: _cache.invalidate(tables), once=True)
 
 # --- Classes ---
 def add_class(name):
@@ -67,16 +57,19 @@ def add_class(name):
     try:
         with conn.session as s:
             s.execute(text("INSERT INTO classes (name) VALUES (:name)"), {"name": name})
+            _touch(s, "classes")
             s.commit()
         return True
     except Exception:
         return False
 
+@_cache.cached("classes")
 def get_all_classes():
     conn = get_connection()
     res = conn.query("SELECT id, name FROM classes", ttl=0)
     return res.values.tolist()
 
+@_cache.cached("classes")
 def get_class_name(class_id):
     conn = get_connection()
     res = conn.query("SELECT name FROM classes WHERE id=:id", params={"id": class_id}, ttl=0)
@@ -84,34 +77,139 @@ def get_class_name(class_id):
 
 # --- Students ---
 def add_student(name, educational_id, class_id, omr_id=None):
+    """
+    Adds one student (see add_students). Returns the OMR ID, or None on a conflict.
+    """
+    added, _ = add_students(class_id, [{"name": name, "educational_id": educational_id, "omr_id": omr_id}])
+    return added.get(0)
+
+def _lock_roster(s, class_id):
+    # Roster writes of one class queue up behind this row lock, so reading the current IDs
+    # and allocating new ones cannot race another import
+    s.execute(text("SELECT id FROM classes WHERE id=:cid FOR UPDATE"), {"cid": class_id})
+
+def roster_conflicts(existing, rows):
+    """
+    Rows that would break UNIQUE(class_id, educational_id) or UNIQUE(class_id, omr_id), checked
+    against the class's existing (name, educational_id, omr_id) students and earlier rows.
+    Returns [{"row", "field", "value", "reason"}], row being the index in rows.
+    """
+    taken = {"educational_id": {}, "omr_id": {}}
+    for name, eid, oid in existing:
+        if eid is not None:
+            taken["educational_id"][str(eid)] = f"already used by {name}"
+        if oid is not None:
+            taken["omr_id"][int(oid)] = f"already used by {name}"
+    conflicts = []
+    for i, r in enumerate(rows):
+        keys = {"educational_id": None if r.get("educational_id") is None else str(r["educational_id"]),
+                "omr_id": None if r.get("omr_id") is None else int(r["omr_id"])}
+        clashes = [(f, v) for f, v in keys.items() if v is not None and v in taken[f]]
+        for field, value in clashes:
+            conflicts.append({"row": i, "field": field, "value": value, "reason": taken[field][value]})
+        if not clashes:
+            for field, value in keys.items():
+                if value is not None:
+                    taken[field][value] = f"repeats row {i + 1}"
+    return conflicts
+
+def add_students(class_id, rows, chunk_size=1000):
+    """
+    Imports a roster in one transaction with multi-row INSERTs. Each row is a dict with name,
+    educational_id and an optional omr_id; rows without one are numbered by the database, in
+    row order, after the highest ID in use (or requested by any row).
+    Rows that clash with the class or an earlier row are skipped and reported.
+    Returns (added, conflicts): {row index: OMR ID} and roster_conflicts' list.
+    """
+    rows = list(rows)
+    added = {}
     conn = get_connection()
-    try:
-        with conn.session as s:
-            if omr_id is None:
-                # Find next omr_id
-                res = s.execute(text("SELECT MAX(omr_id) FROM students WHERE class_id=:class_id"), 
-                                {"class_id": class_id}).fetchone()
-                max_id = res[0]
-                next_omr_id = 0 if max_id is None else max_id + 1
-            else:
-                next_omr_id = omr_id
-            
-            s.execute(text("INSERT INTO students (name, educational_id, omr_id, class_id) VALUES (:name, :eid, :oid, :cid)"), 
-                      {"name": name, "eid": educational_id, "oid": next_omr_id, "cid": class_id})
-            s.commit()
-            return next_omr_id
-    except Exception:
-        return None
+    with conn.session as s:
+        _lock_roster(s, class_id)
+        existing = s.execute(text("SELECT name, educational_id, omr_id FROM students WHERE class_id=:cid"),
+                             {"cid": class_id}).fetchall()
+        conflicts = roster_conflicts(existing, rows)
+        rejected = {c["row"] for c in conflicts}
+        valid = [i for i in range(len(rows)) if i not in rejected]
+        explicit_max = max((int(rows[i]["omr_id"]) for i in valid if rows[i].get("omr_id") is not None), default=-1)
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            values = ", ".join(f"(CAST(:ord{j} AS INTEGER), :name{j}, :eid{j}, CAST(:oid{j} AS INTEGER))" for j in range(len(chunk)))
+            params = {"cid": class_id, "explicit_max": explicit_max}
+            for j, i in enumerate(chunk):
+                params.update({f"ord{j}": i, f"name{j}": rows[i]["name"], f"eid{j}": rows[i].get("educational_id"),
+                               f"oid{j}": rows[i].get("omr_id")})
+            res = s.execute(text(f'''INSERT INTO students (name, educational_id, omr_id, class_id)
+                                   SELECT v.name, v.eid,
+                                          COALESCE(v.oid, base.next + CAST(ROW_NUMBER() OVER (PARTITION BY v.oid IS NULL ORDER BY v.ord) AS INTEGER) - 1),
+                                          :cid
+                                   FROM (VALUES {values}) AS v(ord, name, eid, oid)
+                                   CROSS JOIN (SELECT GREATEST(COALESCE(MAX(omr_id), -1), CAST(:explicit_max AS INTEGER)) + 1 AS next
+                                               FROM students WHERE class_id = :cid) AS base
+                                   RETURNING omr_id'''), params)
+            # Requested IDs come back as given; the allocated ones ascend in row order
+            explicit = {int(rows[i]["omr_id"]): i for i in chunk if rows[i].get("omr_id") is not None}
+            allocated = sorted(oid for (oid,) in res.fetchall() if oid not in explicit)
+            added.update({i: oid for oid, i in explicit.items()})
+            added.update(zip((i for i in chunk if rows[i].get("omr_id") is None), allocated))
+        _touch(s, "students")
+        s.commit()
+    return added, conflicts
 
-def update_student_omr_id(student_id, new_omr_id):
+def omr_id_conflicts(students, assignments):
+    """
+    Assignments ({student id: OMR ID}) that would leave two students of a class with the same
+    OMR ID, given the class's (student id, name, OMR ID) students. An assignment is rejected when
+    its ID stays in use, so rejecting one can reject those relying on it being freed.
+    Returns [{"student_id", "omr_id", "reason"}].
+    """
+    current = {int(sid): (name, None if oid is None else int(oid)) for sid, name, oid in students}
+    pending = {int(sid): int(oid) for sid, oid in assignments.items()
+               if int(sid) in current and current[int(sid)][1] != int(oid)}
+    conflicts = []
+    while True:
+        holders = {}
+        for sid, (name, oid) in current.items():
+            final = pending.get(sid, oid)
+            if final is not None:
+                holders.setdefault(final, []).append(sid)
+        rejected = {sid: oid for oid, sids in holders.items() if len(sids) > 1 for sid in sids if sid in pending}
+        if not rejected:
+            return conflicts
+        for sid, oid in rejected.items():
+            others = ", ".join(current[o][0] for o in holders[oid] if o != sid)
+            conflicts.append({"student_id": sid, "omr_id": oid, "reason": f"also held by {others}"})
+            del pending[sid]
+
+def update_student_omr_ids(class_id, assignments):
+    """
+    Applies {student id: OMR ID} for one class in one transaction. Changed IDs are cleared
+    first and then set with a single UPDATE ... FROM (VALUES ...), so students can swap IDs.
+    Returns (updated, conflicts): the number of students whose ID changed and
+    omr_id_conflicts' list for the assignments left out.
+    """
     conn = get_connection()
-    try:
-        with conn.session as s:
-            s.execute(text("UPDATE students SET omr_id=:oid WHERE id=:sid"), {"oid": new_omr_id, "sid": student_id})
-            s.commit()
-        return True
-    except Exception:
-        return False
+    with conn.session as s:
+        _lock_roster(s, class_id)
+        students = s.execute(text("SELECT id, name, omr_id FROM students WHERE class_id=:cid"), {"cid": class_id}).fetchall()
+        conflicts = omr_id_conflicts(students, assignments)
+        current = {int(sid): oid for sid, _, oid in students}
+        rejected = {c["student_id"] for c in conflicts}
+        changes = {int(sid): int(oid) for sid, oid in assignments.items()
+                   if int(sid) in current and int(sid) not in rejected and current[int(sid)] != int(oid)}
+        if changes:
+            ids = ", ".join(f":id{j}" for j in range(len(changes)))
+            values = ", ".join(f"(CAST(:id{j} AS INTEGER), CAST(:oid{j} AS INTEGER))" for j in range(len(changes)))
+            params = {"cid": class_id}
+            for j, (sid, oid) in enumerate(changes.items()):
+                params.update({f"id{j}": sid, f"oid{j}": oid})
+            s.execute(text(f"UPDATE students SET omr_id = NULL WHERE class_id = :cid AND id IN ({ids})"), params)
+            s.execute(text(f'''UPDATE students AS s SET omr_id = v.oid
+                               FROM (VALUES {values}) AS v(id, oid)
+                               WHERE s.id = v.id AND s.class_id = :cid'''), params)
+        _touch(s, "students")
+        s.commit()
+    return len(changes), conflicts
 
 def clear_class_students(class_id):
     conn = get_connection()
@@ -119,17 +217,20 @@ def clear_class_students(class_id):
         with conn.session as s:
             s.execute(text("DELETE FROM results WHERE student_id IN (SELECT id FROM students WHERE class_id=:id)"), {"id": class_id})
             s.execute(text("DELETE FROM students WHERE class_id=:id"), {"id": class_id})
+            _touch(s, "students")
             s.commit()
         return True
     except Exception:
         return False
 
+@_cache.cached("students")
 def get_students_by_class(class_id):
     conn = get_connection()
     res = conn.query("SELECT id, name, educational_id, omr_id FROM students WHERE class_id=:id", 
                     params={"id": class_id}, ttl=0)
     return res.values.tolist()
 
+@_cache.cached("students")
 def get_student_by_omr(class_id, omr_id):
     conn = get_connection()
     res = conn.query("SELECT id, name, educational_id, omr_id FROM students WHERE class_id=:cid AND omr_id=:oid", 
@@ -144,9 +245,11 @@ def create_exam(name, class_id, date, answer_key, mcq_choices=5, parent_id=None)
         res = s.execute(text("INSERT INTO exams (name, class_id, date, answer_key, mcq_choices, parent_id) VALUES (:name, :cid, :date, :key, :choices, :pid) RETURNING id"),
                   {"name": name, "cid": class_id, "date": str(date), "key": key_json, "choices": mcq_choices, "pid": parent_id})
         exam_id = res.fetchone()[0]
+        _touch(s, "exams")
         s.commit()
     return exam_id
 
+@_cache.cached("exams")
 def get_exams_by_class(class_id):
     conn = get_connection()
     res = conn.query("SELECT id, name, date, parent_id FROM exams WHERE class_id=:id", params={"id": class_id}, ttl=0)
@@ -161,26 +264,70 @@ def update_exam(exam_id, name=None, date=None, answer_key=None):
             s.execute(text("UPDATE exams SET date=:date WHERE id=:id"), {"date": date, "id": exam_id})
         if answer_key:
             s.execute(text("UPDATE exams SET answer_key=:key WHERE id=:id"), {"key": json.dumps(answer_key), "id": exam_id})
+        _touch(s, "exams")
         s.commit()
 
+@_cache.cached("exams")
 def get_exam_details(exam_id):
     conn = get_connection()
     res = conn.query("SELECT id, name, class_id, date, answer_key, mcq_choices, parent_id FROM exams WHERE id=:id", params={"id": exam_id}, ttl=0)
     return res.iloc[0].tolist() if not res.empty else None
 
+@_cache.cached("exams")
 def get_exam_versions(parent_id):
     conn = get_connection()
     res = conn.query("SELECT id, name, date, answer_key, mcq_choices FROM exams WHERE parent_id=:pid ORDER BY name ASC", params={"pid": parent_id}, ttl=0)
     return res.values.tolist()
 
 # --- Results ---
-def save_result(exam_id, student_id, total_score, mcq_score, numeric_score, answers, image_path):
+def save_result(exam_id, student_id, total_score, mcq_score, numeric_score, answers, image_path, intensities=None,
+                scan_hash=None, answer_hash=None):
+    """
+    Saves one graded sheet, replacing the student's earlier result for the exam (see save_results).
+    """
+    save_results([{"exam_id": exam_id, "student_id": student_id, "total_score": total_score, "mcq_score": mcq_score,
+                   "numeric_score": numeric_score, "answers": answers, "image_path": image_path,
+                   "intensities": intensities, "scan_hash": scan_hash, "answer_hash": answer_hash}])
+
+def save_results(rows, chunk_size=500):
+    """
+    Saves graded sheets (a list or any iterable of dicts with save_result's fields) in a single
+    transaction, one multi-row INSERT per chunk. A student keeps one result per exam: a row for
+    an exam and student already saved replaces that result, so re-running a batch is safe.
+    When the input repeats an exam and student, the last row wins.
+    Returns the number of results written.
+    """
+    rows = iter(rows)
+    chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+    first = next(chunks, None)
+    if first is None:
+        return 0
+    written = 0
     conn = get_connection()
-    answers_json = json.dumps(answers)
     with conn.session as s:
-        s.execute(text("INSERT INTO results (exam_id, student_id, score, mcq_score, numeric_score, answers, image_path) VALUES (:eid, :sid, :score, :ms, :ns, :ans, :path)"),
-                  {"eid": exam_id, "sid": student_id, "score": total_score, "ms": mcq_score, "ns": numeric_score, "ans": answers_json, "path": image_path})
+        for chunk in itertools.chain([first], chunks):
+            # ON CONFLICT cannot touch the same row twice in one statement
+            chunk = list({(r["exam_id"], r["student_id"]): r for r in chunk}.values())
+            values = ", ".join(f"(:eid{j}, :sid{j}, :score{j}, :ms{j}, :ns{j}, :ans{j}, :path{j}, :ints{j}, :sh{j}, :ah{j})"
+                               for j in range(len(chunk)))
+            params = {}
+            for j, r in enumerate(chunk):
+                params.update({f"eid{j}": r["exam_id"], f"sid{j}": r["student_id"], f"score{j}": r["total_score"],
+                               f"ms{j}": r["mcq_score"], f"ns{j}": r["numeric_score"], f"ans{j}": json.dumps(r["answers"]),
+                               f"path{j}": r["image_path"], f"ints{j}": r.get("intensities"),
+                               f"sh{j}": r.get("scan_hash"), f"ah{j}": r.get("answer_hash")})
+            s.execute(text(f'''INSERT INTO results (exam_id, student_id, score, mcq_score, numeric_score, answers, image_path,
+                                                   intensities, scan_hash, answer_hash)
+                               VALUES {values}
+                               ON CONFLICT (exam_id, student_id) DO UPDATE SET
+                                   score = EXCLUDED.score, mcq_score = EXCLUDED.mcq_score,
+                                   numeric_score = EXCLUDED.numeric_score, answers = EXCLUDED.answers,
+                                   image_path = EXCLUDED.image_path, intensities = EXCLUDED.intensities,
+                                   scan_hash = EXCLUDED.scan_hash, answer_hash = EXCLUDED.answer_hash,
+                                   timestamp = CURRENT_TIMESTAMP'''), params)
+            written += len(chunk)
         s.commit()
+    return written
 
 def get_results_by_exam(exam_id):
     conn = get_connection()
@@ -198,10 +345,149 @@ def get_results_by_master_exam(master_id):
              FROM results r 
              JOIN students s ON r.student_id = s.id 
              JOIN exams e ON r.exam_id = e.id
-             WHERE r.exam_id = :mid OR e.parent_id = :mid'''
+             WHERE r.exam_id IN (SELECT id FROM exams WHERE id = :mid OR parent_id = :mid)'''
     res = conn.query(sql, params={"mid": master_id}, ttl=0)
     return res.values.tolist()
 
+def get_results_for_regrade(master_id):
+    """
+    Every result of an exam and its versions with what re-scoring needs, in one query:
+    (result id, exam id, student name, score, answers JSON, the exam's answer key JSON,
+    numeric score).
+    """
+    conn = get_connection()
+    sql = '''SELECT r.id, r.exam_id, s.name, r.score, r.answers, e.answer_key, r.numeric_score
+             FROM results r
+             JOIN exams e ON r.exam_id = e.id
+             LEFT JOIN students s ON r.student_id = s.id
+             WHERE r.exam_id IN (SELECT id FROM exams WHERE id = :mid OR parent_id = :mid)'''
+    res = conn.query(sql, params={"mid": master_id}, ttl=0)
+    return res.values.tolist()
+
+def update_result_scores(rows, chunk_size=1000):
+    """
+    Writes re-scored results back with one UPDATE ... FROM (VALUES ...) per chunk, all in a
+    single transaction. Each row is a dict with result_id, total_score, mcq_score,
+    numeric_score and answers (graded details).
+    """
+    if not rows:
+        return 0
+    conn = get_connection()
+    with conn.session as s:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            values = ", ".join(f"(:id{i}, :score{i}, :ms{i}, :ns{i}, :ans{i})" for i in range(len(chunk)))
+            params = {}
+            for i, r in enumerate(chunk):
+                params.update({f"id{i}": r["result_id"], f"score{i}": r["total_score"], f"ms{i}": r["mcq_score"],
+                               f"ns{i}": r["numeric_score"], f"ans{i}": json.dumps(r["answers"])})
+            s.execute(text(f'''UPDATE results AS r
+                               SET score = CAST(v.score AS DOUBLE PRECISION),
+                                   mcq_score = CAST(v.mcq_score AS DOUBLE PRECISION),
+                                   numeric_score = CAST(v.numeric_score AS DOUBLE PRECISION),
+                                   answers = v.answers
+                               FROM (VALUES {values}) AS v(id, score, mcq_score, numeric_score, answers)
+                               WHERE r.id = CAST(v.id AS INTEGER)'''), params)
+        s.commit()
+    return len(rows)
+
+def get_result_intensities(master_id):
+    """
+    (result id, exam id, intensity blob) of every result of an exam and its versions that
+    kept its sampled intensities, for omr_engine.redecide.
+    """
+    conn = get_connection()
+    sql = '''SELECT r.id, r.exam_id, r.intensities
+             FROM results r
+             WHERE r.exam_id IN (SELECT id FROM exams WHERE id = :mid OR parent_id = :mid) AND r.intensities IS NOT NULL'''
+    res = conn.query(sql, params={"mid": master_id}, ttl=0)
+    return [(int(rid), int(eid), bytes(blob)) for rid, eid, blob in res.values.tolist()]
+
+def get_result_hashes(master_id):
+    """
+    (result id, scan hash, answer hash, OMR ID) of every result of an exam and its versions
+    that was saved with its hashes, for scan_dedup.DuplicateIndex.
+    """
+    conn = get_connection()
+    sql = '''SELECT r.id, r.scan_hash, r.answer_hash, st.omr_id
+             FROM results r LEFT JOIN students st ON st.id = r.student_id
+             WHERE r.exam_id IN (SELECT id FROM exams WHERE id = :mid OR parent_id = :mid) AND r.scan_hash IS NOT NULL AND r.answer_hash IS NOT NULL'''
+    res = conn.query(sql, params={"mid": master_id}, ttl=0)
+    return [(int(rid), int(sh), int(ah), None if oid is None or oid != oid else int(oid))
+            for rid, sh, ah, oid in res.values.tolist()]
+
+def get_result_image_path(result_id):
+    conn = get_connection()
+    res = conn.query("SELECT image_path FROM results WHERE id=:id", params={"id": result_id}, ttl=0)
+    return res.values[0][0] if not res.empty else None
+
+def get_result_owner(result_id):
+    """
+    (exam id, student id, student name, exam name) of a saved result, or None if it is gone.
+    """
+    conn = get_connection()
+    sql = '''SELECT r.exam_id, r.student_id, s.name, e.name
+             FROM results r
+             JOIN exams e ON r.exam_id = e.id
+             LEFT JOIN students s ON r.student_id = s.id
+             WHERE r.id=:id'''
+    res = conn.query(sql, params={"id": result_id}, ttl=0)
+    return res.values[0].tolist() if not res.empty else None
+
+# --- Page loaders ---
+# What a page shows, in one or two queries instead of one per class or exam. Rows come back as
+# dicts with keys parsed and NULLs as None.
+@_cache.cached("classes", "students")
+def load_classes(with_students=False):
+    """
+    Every class as {"id", "name", "student_count"}, in one query. with_students adds
+    "students": (id, name, educational_id, omr_id) tuples like get_students_by_class, from one
+    more query for all classes.
+    """
+    conn = get_connection()
+    with conn.session as s:
+        rows = s.execute(text('''SELECT c.id, c.name, COUNT(st.id)
+                                  FROM classes c LEFT JOIN students st ON st.class_id = c.id
+                                  GROUP BY c.id, c.name ORDER BY c.id''')).fetchall()
+        classes = [{"id": cid, "name": name, "student_count": int(count)} for cid, name, count in rows]
+        if with_students:
+            by_id = {c["id"]: c for c in classes}
+            for c in classes:
+                c["students"] = []
+            for cid, sid, name, eid, oid in s.execute(text("SELECT class_id, id, name, educational_id, omr_id FROM students ORDER BY id")):
+                if cid in by_id:
+                    by_id[cid]["students"].append((sid, name, eid, oid))
+    return classes
+
+@_cache.cached("exams")
+def load_class_exams(class_id):
+    """
+    A class's exams with their versions and parsed keys, in one query.
+    Returns {"exams", "orphaned"}: "exams" are the masters and independent exams, each
+    {"id", "name", "date", "answer_key", "mcq_choices", "parent_id", "versions"} with its
+    versions (same fields, by name like get_exam_versions); "orphaned" are versions whose
+    master is missing.
+    """
+    conn = get_connection()
+    with conn.session as s:
+        rows = s.execute(text("SELECT id, name, date, answer_key, mcq_choices, parent_id FROM exams WHERE class_id=:cid ORDER BY id"),
+                         {"cid": class_id}).fetchall()
+    exams = {eid: {"id": eid, "name": name, "date": date, "answer_key": json.loads(key or "{}"),
+                   "mcq_choices": 5 if choices is None else int(choices), "parent_id": pid, "versions": []}
+             for eid, name, date, key, choices, pid in rows}
+    orphaned = []
+    for exam in exams.values():
+        if exam["parent_id"] is None:
+            continue
+        master = exams.get(exam["parent_id"])
+        if master is not None and master["parent_id"] is None:
+            master["versions"].append(exam)
+        else:
+            orphaned.append(exam)
+    for exam in exams.values():
+        exam["versions"].sort(key=lambda v: v["name"])
+    return {"exams": [e for e in exams.values() if e["parent_id"] is None], "orphaned": orphaned}
+
 # --- Deletions ---
 def delete_class(class_id):
     conn = get_connection()
@@ -214,6 +500,7 @@ def delete_class(class_id):
         s.execute(text("DELETE FROM exams WHERE class_id=:id AND parent_id IS NOT NULL"), {"id": class_id})
         s.execute(text("DELETE FROM exams WHERE class_id=:id"), {"id": class_id})
         s.execute(text("DELETE FROM classes WHERE id=:id"), {"id": class_id})
+        _touch(s, "classes", "students", "exams")
         s.commit()
 
 def delete_exam(exam_id):
@@ -230,6 +517,7 @@ def delete_exam(exam_id):
         
         # 4. Finally delete the exam itself
         s.execute(text("DELETE FROM exams WHERE id=:id"), {"id": exam_id})
+        _touch(s, "exams")
         s.commit()
 
 def delete_result(result_id):
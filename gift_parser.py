@@ -36,17 +36,20 @@ def parse_gift(text):
             # Numeric
             if a_part.startswith('#'):
                 val_str = a_part[1:].strip()
-                # Handle tolerance if present (e.g. #10:0.5)
+                # Handle tolerance if present (e.g. #10:0.5): answers within ans +/- tol score
                 if ':' in val_str:
                     target, tolerance = val_str.split(':')
                     ans = float(target)
+                    tol = abs(float(tolerance))
                 else:
                     ans = float(val_str)
+                    tol = 0.0
                 
                 questions.append({
                     "text": q_text,
                     "type": "Numeric",
-                    "ans": ans
+                    "ans": ans,
+                    "tol": tol
                 })
             # MCQ
             else:
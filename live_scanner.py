@@ -0,0 +1,115 @@
+import queue
+
+import cv2
+import numpy as np
+
+import omr_engine
+import scan_archive
+
+class LiveScanner:
+    """
+    Continuous scanning: watches a stream of frames and grades each sheet once, with no clicks.
+    Every frame gets a cheap marker check; the corners are tracked across frames and the full
+    process_exam only runs once they have been stable for `stable_frames` frames.
+    After a capture the scanner waits for the sheet to leave (or jump) before arming again.
+    With an archive directory, each captured frame is stored in the scan archive as a JPEG.
+    """
+    def __init__(self, num_questions=20, mcq_choices=5, question_data=None,
+                 stable_frames=5, max_jitter=0.01, rearm_jump=0.15, check_max_dim=480, key_resolver=None, archive=None):
+        self.exam_kwargs = {
+            "num_questions": num_questions,
+            "mcq_choices": mcq_choices,
+            "question_data": question_data,
+            "key_resolver": key_resolver,
+            "sampling": "projected",
+            "preview": False,
+            "crop": archive is not None
+        }
+        self.archive = archive
+        self.stable_frames = stable_frames
+        self.max_jitter = max_jitter # Corner drift allowed between frames, as a fraction of the frame diagonal
+        self.rearm_jump = rearm_jump # A corner jump this large means a new sheet replaced the old one
+        self.check_max_dim = check_max_dim
+        self.results = queue.Queue()
+        self.reset()
+
+    def reset(self):
+        self.last_corners = None
+        self.stable_count = 0
+        self.armed = True
+        self.frame_index = 0
+
+    def _detect(self, gray):
+        return omr_engine.find_markers_coarse_to_fine(gray, coarse_max_dim=self.check_max_dim)
+
+    def feed(self, frame):
+        """
+        Processes one frame. Returns the grading result when this frame triggered a capture, else None.
+        Captured results are also put on self.results.
+        """
+        self.frame_index += 1
+        gray = omr_engine.to_gray(frame)
+        corners = self._detect(gray)
+
+        if corners is None:
+            # Sheet left the view: ready for the next one
+            self.last_corners = None
+            self.stable_count = 0
+            self.armed = True
+            return None
+
+        diag = np.hypot(*gray.shape[:2])
+        if self.last_corners is None:
+            self.stable_count = 1
+        else:
+            drift = np.max(np.hypot(*(corners - self.last_corners).T)) / diag
+            if drift > self.rearm_jump:
+                self.armed = True
+            self.stable_count = self.stable_count + 1 if drift <= self.max_jitter else 1
+        self.last_corners = corners
+
+        if not self.armed or self.stable_count < self.stable_frames:
+            return None
+
+        self.armed = False
+        result = omr_engine.process_exam(gray, **self.exam_kwargs)
+        result["frame_index"] = self.frame_index
+        if result["success"]:
+            if self.archive is not None:
+                ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                scan_archive.archive_result(result, buf.tobytes(), self.archive)
+            self.results.put(result)
+            return result
+        # Markers looked fine but the sheet could not be read: try again on later frames
+        self.armed = True
+        self.stable_count = 0
+        return None
+
+    def run(self, source, max_results=None, max_frames=None):
+        """
+        Reads frames from a video file, stream URL or camera index and yields each captured result.
+        """
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video source {source!r}")
+        captured = 0
+        try:
+            while max_frames is None or self.frame_index < max_frames:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                result = self.feed(frame)
+                if result is not None:
+                    captured += 1
+                    yield result
+                    if max_results is not None and captured >= max_results:
+                        break
+        finally:
+            cap.release()
+
+def parse_source(text):
+    """
+    Camera indices are given as digits ("0"); anything else is a file path or stream URL.
+    """
+    text = text.strip()
+    return int(text) if text.isdigit() else text
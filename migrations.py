@@ -0,0 +1,154 @@
+import argparse
+import logging
+
+from sqlalchemy import text
+
+log = logging.getLogger(__name__)
+
+# Ordered schema changes, applied once each and recorded in schema_version.
+# Append new ones at the end; never edit or renumber a migration that has shipped.
+# The first three are idempotent, so databases created by the old init_db (which ran them on
+# every session) upgrade in place.
+MIGRATIONS = [
+    (1, "Base tables", [
+        '''CREATE TABLE IF NOT EXISTS classes (
+               id SERIAL PRIMARY KEY,
+               name TEXT NOT NULL UNIQUE
+           )''',
+        '''CREATE TABLE IF NOT EXISTS students (
+               id SERIAL PRIMARY KEY,
+               name TEXT NOT NULL,
+               educational_id TEXT,
+               omr_id INTEGER,
+               class_id INTEGER REFERENCES classes(id),
+               UNIQUE(class_id, omr_id),
+               UNIQUE(class_id, educational_id)
+           )''',
+        '''CREATE TABLE IF NOT EXISTS exams (
+               id SERIAL PRIMARY KEY,
+               name TEXT NOT NULL,
+               class_id INTEGER REFERENCES classes(id),
+               date TEXT,
+               answer_key TEXT,
+               mcq_choices INTEGER DEFAULT 5,
+               parent_id INTEGER REFERENCES exams(id)
+           )''',
+        '''CREATE TABLE IF NOT EXISTS results (
+               id SERIAL PRIMARY KEY,
+               exam_id INTEGER REFERENCES exams(id),
+               student_id INTEGER REFERENCES students(id),
+               score DOUBLE PRECISION,
+               answers TEXT,
+               image_path TEXT,
+               timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+    ]),
+    (2, "Exam versions, split scores, stored intensities and scan hashes", [
+        "ALTER TABLE exams ADD COLUMN IF NOT EXISTS mcq_choices INTEGER DEFAULT 5",
+        "ALTER TABLE exams ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES exams(id)",
+        "ALTER TABLE results ADD COLUMN IF NOT EXISTS mcq_score DOUBLE PRECISION DEFAULT 0",
+        "ALTER TABLE results ADD COLUMN IF NOT EXISTS numeric_score DOUBLE PRECISION DEFAULT 0",
+        "ALTER TABLE results ADD COLUMN IF NOT EXISTS intensities BYTEA",
+        "ALTER TABLE results ADD COLUMN IF NOT EXISTS scan_hash BIGINT",
+        "ALTER TABLE results ADD COLUMN IF NOT EXISTS answer_hash BIGINT",
+        # Duplicate checks look results up by exam and answer hash
+        "CREATE INDEX IF NOT EXISTS idx_results_exam_answer_hash ON results (exam_id, answer_hash)",
+    ]),
+    (3, "One result per student and exam", [
+        # Keep the newest of any earlier duplicates; save_results upserts on the index.
+        # The older rows are copied to results_duplicates first, so nothing is lost silently
+        '''CREATE TABLE IF NOT EXISTS results_duplicates AS
+           SELECT r.*, CURRENT_TIMESTAMP AS archived_at FROM results r
+           WHERE EXISTS (SELECT 1 FROM results newer
+                         WHERE newer.exam_id = r.exam_id AND newer.student_id = r.student_id AND r.id < newer.id)''',
+        '''DELETE FROM results r USING results newer
+           WHERE r.exam_id = newer.exam_id AND r.student_id = newer.student_id AND r.id < newer.id''',
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_results_exam_student ON results (exam_id, student_id)",
+    ]),
+    (4, "Indexes for the hot query paths", [
+        # A master's versions (results of a master exam, delete_exam)
+        "CREATE INDEX IF NOT EXISTS idx_exams_parent ON exams (parent_id)",
+        # Exams of a class (exam pickers, delete_class)
+        "CREATE INDEX IF NOT EXISTS idx_exams_class ON exams (class_id)",
+        # Results of a student (delete_class, clear_class_students); results by exam use
+        # idx_results_exam_student and students by OMR ID the UNIQUE(class_id, omr_id) index
+        "CREATE INDEX IF NOT EXISTS idx_results_student ON results (student_id)",
+    ]),
+    (5, "Write counters for the read cache", [
+        # Bumped by db_manager's writes so other processes drop their cached reads
+        '''CREATE TABLE IF NOT EXISTS cache_versions (
+               table_name TEXT PRIMARY KEY,
+               version BIGINT NOT NULL DEFAULT 0
+           )''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Any constant works; concurrent deploys wait on it instead of migrating twice
+_LOCK_KEY = 4_711_031
+
+def current_version(session):
+    """
+    Highest applied migration (0 on an empty database).
+    """
+    if session.execute(text("SELECT to_regclass('schema_version')")).scalar() is None:
+        return 0
+    return session.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+def pending(version):
+    """
+    Migrations newer than version, in order.
+    """
+    return [m for m in MIGRATIONS if m[0] > version]
+
+def migrate(conn):
+    """
+    Applies the pending migrations of a st.connection's database in one transaction.
+    Returns the (version, description) pairs applied; nothing is run when up to date.
+    Rows removed by a migration's DELETE are logged as warnings.
+    """
+    with conn.session as s:
+        if current_version(s) == LATEST_VERSION:
+            return []
+        s.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY})
+        s.execute(text('''CREATE TABLE IF NOT EXISTS schema_version (
+                              version INTEGER PRIMARY KEY,
+                              description TEXT,
+                              applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                          )'''))
+        applied = []
+        for version, description, statements in pending(current_version(s)):
+            for statement in statements:
+                result = s.execute(text(statement))
+                if statement.lstrip().startswith("DELETE") and result.rowcount > 0:
+                    log.warning("Migration %d (%s) removed %d rows", version, description, result.rowcount)
+            s.execute(text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                      {"v": version, "d": description})
+            applied.append((version, description))
+        s.commit()
+    return applied
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bring the database schema up to date.")
+    parser.add_argument("--status", action="store_true", help="Only print the current and pending versions")
+    args = parser.parse_args(argv)
+    logging.basicConfig(format="%(message)s")
+
+    import db_manager
+    conn = db_manager.get_connection()
+    if args.status:
+        with conn.session as s:
+            version = current_version(s)
+        print(f"Schema version {version} of {LATEST_VERSION}.")
+        for v, description, _ in pending(version):
+            print(f"  pending {v}: {description}")
+        return 0
+    applied = migrate(conn)
+    for v, description in applied:
+        print(f"Applied {v}: {description}")
+    print(f"Schema is at version {LATEST_VERSION}.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,62 @@
 import cv2
 import numpy as np
 import json
+import functools
+import hashlib
+import itertools
+import struct
+import threading
+import sheet_layout
+import sheet_header
+import stage_profiler
+
+# Soft binary-ish curve for apply_bw_filter: values < 110 pushed towards 0, > 145 towards 255
+_levels = np.arange(256)
+BW_LOOKUP_TABLE = np.where(_levels < 110, np.maximum(0, _levels - 40),
+                           np.where(_levels > 145, np.minimum(255, _levels + 40), _levels)).astype(np.uint8)
+
+# Mark classification: how dark the second-darkest bubble is relative to the darkest
+# (0 = as light as the paper, 1 = as dark as the mark)
+MULTI_MARK_RATIO = 0.75 # At or above: two deliberate marks
+AMBIGUOUS_RATIO = 0.40  # At or above: erasure or stray mark next to the answer
+CLEAN_RATIO = 0.25      # Below: differences come from the letters printed inside the bubbles
+SOLID_FILL = 0.60       # Darkest bubble this much darker than the paper: a confident mark
+MIN_FILL = 0.40         # Below: too faint to count as a clean mark
+CLEAN_FILL = 0.25       # Below: just the bubble's printed letter, the row is blank
+REVIEW_CONFIDENCE = 0.5 # Sheets whose weakest decision falls below this go to a human
+# classify_marks ratios: a row is marked when its darkest bubble is below row mean * ratio
+ID_RATIO = 0.90         # Student ID and version
+ANSWER_RATIO = 0.92     # Answer rows and numeric grids
+
+# Preview thumbnails: small encoded images, cheap to keep in session state and to re-send.
+# Streamlit passes JPEG/PNG bytes through untouched and re-encodes anything else.
+PREVIEW_MAX_DIM = 720
+PREVIEW_FORMAT = "jpeg" # or "webp"
+PREVIEW_QUALITY = 80
+CROP_PAD = 40 # Warped pixels kept around the outermost bubbles of the archived crop
+
+# CLAHE objects keep scratch buffers, so each thread (Streamlit session) gets its own
+_clahe_cache = threading.local()
+
+def get_clahe(clip_limit, tile_grid_size=(8, 8)):
+    """
+    Returns a cached CLAHE instance for this thread.
+    """
+    cache = getattr(_clahe_cache, "instances", None)
+    if cache is None:
+        cache = _clahe_cache.instances = {}
+    key = (clip_limit, tile_grid_size)
+    if key not in cache:
+        cache[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+    return cache[key]
+
+def to_gray(image):
+    """
+    Single-channel view of an image; grayscale input is returned as-is.
+    """
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
 def order_points(pts):
     """
@@ -54,8 +110,7 @@ def enhance_image(image):
     """
     lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
     l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    cl = clahe.apply(l)
+    cl = get_clahe(3.0).apply(l)
     limg = cv2.merge((cl, a, b))
     enhanced = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
     return enhanced
@@ -64,12 +119,12 @@ def apply_bw_filter(image):
     """
     Applies a high-contrast B&W filter. 
     Uses CLAHE + soft thresholding to make markers/bubbles pop without losing all detail.
+    Works on one channel end to end and returns a grayscale image.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = to_gray(image)
     
     # 1. CLAHE for local contrast
-    clahe = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8,8))
-    enhanced = clahe.apply(gray)
+    enhanced = get_clahe(4.0).apply(gray)
     
     # 2. Linear Contrast Stretch
     # Map [min, max] to [0, 255]
@@ -77,26 +132,16 @@ def apply_bw_filter(image):
     
     # 3. Soft Binary-ish look (Sigmoid-like curve)
     # This makes whites whiter and blacks blacker but keeps some gray for the engine
-    lookUpTable = np.empty((1,256), np.uint8)
-    for i in range(256):
-        # Push values < 100 towards 0, > 150 towards 255
-        if i < 110:
-            lookUpTable[0,i] = max(0, i - 40)
-        elif i > 145:
-            lookUpTable[0,i] = min(255, i + 40)
-        else:
-            lookUpTable[0,i] = i
-    
-    enhanced = cv2.LUT(enhanced, lookUpTable)
-    
-    return cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
+    return cv2.LUT(enhanced, BW_LOOKUP_TABLE)
 
-def find_marker_squares(image):
+def find_marker_squares(image, profiler=None):
     """
     Finds the 4 black fiducial markers.
     Tries multiple thresholding strategies for maximum robustness.
+    Accepts a BGR or grayscale image.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    profiler = profiler or stage_profiler.NULL_PROFILER
+    gray = to_gray(image)
     blurred = cv2.GaussianBlur(gray, (5, 5), 0)
     
     def get_markers_from_thresh(t_img):
@@ -127,28 +172,159 @@ def find_marker_squares(image):
 
     # Strategy 1: Adaptive (Good for camera & shadows)
     # We use a larger block size (21) for better stability
-    thresh_adaptive = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 5)
-    markers = get_markers_from_thresh(thresh_adaptive)
+    strategy = "adaptive"
+    with profiler.stage("adaptive"):
+        thresh_adaptive = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 5)
+        markers = get_markers_from_thresh(thresh_adaptive)
     
     # Strategy 2: Global Binary (Good for high-contrast/pre-processed)
     if len(markers) < 4:
-        _, thresh_global = cv2.threshold(blurred, 120, 255, cv2.THRESH_BINARY_INV)
-        markers = get_markers_from_thresh(thresh_global)
+        strategy = "global"
+        with profiler.stage("global"):
+            _, thresh_global = cv2.threshold(blurred, 120, 255, cv2.THRESH_BINARY_INV)
+            markers = get_markers_from_thresh(thresh_global)
         
     # Strategy 3: Otsu
     if len(markers) < 4:
-        _, thresh_otsu = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
-        markers = get_markers_from_thresh(thresh_otsu)
+        strategy = "otsu"
+        with profiler.stage("otsu"):
+            _, thresh_otsu = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+            markers = get_markers_from_thresh(thresh_otsu)
 
     if len(markers) < 4:
         return None
+    profiler.note("marker_strategy", "exhaustive." + strategy)
         
-    # Sort by area descending and take top 4
+    # Prefer a geometrically consistent set of 4; fall back to the 4 largest squares
+    quad = select_marker_quad(markers)
+    if quad is not None:
+        return order_points(np.array([m[1] for m in quad]))
     markers.sort(key=lambda x: x[0], reverse=True)
     top_markers = [m[1] for m in markers[:4]]
         
     return order_points(np.array(top_markers))
 
+def select_marker_quad(candidates, max_candidates=8):
+    """
+    Picks the 4 candidates (area, [x, y]) that form the largest plausible sheet outline:
+    a convex quadrilateral of similar-sized squares, well apart, with no extreme perspective.
+    Returns the 4 chosen candidates, or None if no combination qualifies.
+    """
+    candidates = sorted(candidates, key=lambda m: m[0], reverse=True)[:max_candidates]
+    best, best_area = None, 0.0
+    for combo in itertools.combinations(candidates, 4):
+        areas = [m[0] for m in combo]
+        if max(areas) > 4 * min(areas):
+            continue
+        rect = order_points(np.array([m[1] for m in combo], dtype="float32"))
+        edges = np.roll(rect, -1, axis=0) - rect
+        sides = np.hypot(edges[:, 0], edges[:, 1])
+        # Markers must be several marker-widths apart
+        if sides.min() < 3 * np.sqrt(max(areas)):
+            continue
+        # Opposite sides of a photographed rectangle stay within a sane ratio
+        if max(sides[0], sides[2]) > 3 * min(sides[0], sides[2]) or max(sides[1], sides[3]) > 3 * min(sides[1], sides[3]):
+            continue
+        # Convex, consistently wound outline
+        cross = edges[:, 0] * np.roll(edges, -1, axis=0)[:, 1] - edges[:, 1] * np.roll(edges, -1, axis=0)[:, 0]
+        if not (np.all(cross > 0) or np.all(cross < 0)):
+            continue
+        # Shoelace area: the outermost consistent set wins over inner look-alikes
+        quad_area = abs(np.sum(rect[:, 0] * np.roll(rect[:, 1], -1) - np.roll(rect[:, 0], -1) * rect[:, 1])) / 2
+        if quad_area > best_area:
+            best, best_area = list(combo), quad_area
+    return best
+
+def _square_candidates(t_img, min_area, max_area):
+    """
+    Square-looking contours in a binary image as (area, [cx, cy]) with float centroids.
+    All contours are listed, not only external ones: when the whole sheet edge is visible
+    against a darker background, its outline encloses the markers.
+    """
+    cnts = cv2.findContours(t_img, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    cnts = cnts[0] if len(cnts) == 2 else cnts[1]
+    found = []
+    for c in cnts:
+        # Cheap area test first: most contours are specks or large regions
+        area = cv2.contourArea(c)
+        if area <= min_area or area >= max_area:
+            continue
+        peri = cv2.arcLength(c, True)
+        approx = cv2.approxPolyDP(c, 0.04 * peri, True)
+        (x, y, w, h) = cv2.boundingRect(approx)
+        ar = w / float(h)
+        extent = area / float(w * h) if w * h > 0 else 0
+        if len(approx) == 4 and 0.6 <= ar <= 1.4 and extent > 0.6:
+            M = cv2.moments(c)
+            if M["m00"] != 0:
+                found.append((area, [M["m10"] / M["m00"], M["m01"] / M["m00"]]))
+    return found
+
+def _refine_marker(gray, center, side):
+    """
+    Re-locates one marker at full resolution inside a small window around its coarse position.
+    """
+    h, w = gray.shape
+    half = int(max(8, 1.5 * side))
+    cx, cy = int(center[0]), int(center[1])
+    x0, y0 = max(0, cx - half), max(0, cy - half)
+    x1, y1 = min(w, cx + half + 1), min(h, cy + half + 1)
+    roi = cv2.GaussianBlur(gray[y0:y1, x0:x1], (5, 5), 0)
+    _, thresh = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    found = _square_candidates(thresh, 0.3 * side * side, 3.0 * side * side)
+    if not found:
+        return None
+    # The square closest to the coarse estimate
+    local = np.array([m[1] for m in found]) + [x0, y0]
+    return local[np.argmin(np.hypot(local[:, 0] - center[0], local[:, 1] - center[1]))]
+
+def find_markers_coarse_to_fine(image, coarse_max_dim=640, profiler=None):
+    """
+    Fast marker search for large photos.
+    Finds candidates on a small downscaled copy, stops at the first threshold strategy that yields a
+    consistent quadrilateral, then refines each corner in a small full-resolution window.
+    Returns the ordered corners in full-resolution coordinates, or None.
+    The strategy that succeeded is noted on profiler as "marker_strategy".
+    """
+    profiler = profiler or stage_profiler.NULL_PROFILER
+    gray = to_gray(image)
+    coarse = gray
+    scale = 1.0
+    h, w = gray.shape
+    if max(h, w) > coarse_max_dim:
+        # A direct bilinear resize is much cheaper than a pyrDown chain on 12 MP photos,
+        # and the solid markers survive the aliasing
+        scale = max(h, w) / float(coarse_max_dim)
+        coarse = cv2.resize(gray, (int(round(w / scale)), int(round(h / scale))), interpolation=cv2.INTER_LINEAR)
+
+    blurred = cv2.GaussianBlur(coarse, (5, 5), 0)
+    img_area = coarse.shape[0] * coarse.shape[1]
+    min_area, max_area = img_area * 0.0003, img_area * 0.03
+    strategies = [
+        ("adaptive", lambda: cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 5)),
+        ("global", lambda: cv2.threshold(blurred, 120, 255, cv2.THRESH_BINARY_INV)[1]),
+        ("otsu", lambda: cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]),
+    ]
+    for name, make_thresh in strategies:
+        with profiler.stage(name):
+            candidates = _square_candidates(make_thresh(), min_area, max_area)
+            quad = select_marker_quad(candidates) if len(candidates) >= 4 else None
+        if quad is None:
+            continue
+        profiler.note("marker_strategy", name)
+
+        # Early exit: refine this quad only
+        corners = []
+        for area, center in quad:
+            full_pt = np.array(center) * scale
+            if scale > 1.0:
+                refined = _refine_marker(gray, full_pt, np.sqrt(area) * scale)
+                if refined is not None:
+                    full_pt = refined
+            corners.append(full_pt)
+        return order_points(np.array(corners, dtype="float32"))
+    return None
+
 def sample_bubble_hybrid(warped_gray, ideal_px, ideal_py, search_r=6, sample_r=5):
     """
     Seeks the darkest point within search_r of (ideal_px, ideal_py).
@@ -171,147 +347,690 @@ def sample_bubble_hybrid(warped_gray, ideal_px, ideal_py, search_r=6, sample_r=5
     final_avg = np.mean(warped_gray[sy_min:sy_max, sx_min:sx_max])
     return final_avg, (best_px, best_py)
 
-def process_exam(image_path, num_questions=20, mcq_choices=5, question_data=None):
+def sample_bubbles(gray, centers, search_r=6, sample_r=5, integral=None):
+    """
+    Vectorized sample_bubble_hybrid for many bubbles at once.
+    centers is an (N, 2) array (or nested list) of ideal (x, y) points.
+    Returns (intensities, refined_centers) as (N,) and (N, 2) arrays.
+    """
+    centers = np.asarray(centers, dtype=np.intp).reshape(-1, 2)
+    n = len(centers)
+    h, w = gray.shape
+    
+    # Gather every search window as an (N, S, S) stack; clipping at the borders repeats
+    # edge pixels, which leaves the first darkest pixel (row-major) unchanged.
+    offsets = np.arange(-search_r, search_r + 1)
+    ys = np.clip(centers[:, 1, None] + offsets, 0, h - 1)
+    xs = np.clip(centers[:, 0, None] + offsets, 0, w - 1)
+    windows = gray[ys[:, :, None], xs[:, None, :]].reshape(n, -1)
+    flat_idx = np.argmin(windows, axis=1)
+    rows = np.arange(n)
+    best_py = ys[rows, flat_idx // len(offsets)]
+    best_px = xs[rows, flat_idx % len(offsets)]
+    
+    # Window means from the integral image
+    if integral is None:
+        integral = cv2.integral(gray)
+    y0, y1 = np.maximum(0, best_py - sample_r), np.minimum(h, best_py + sample_r + 1)
+    x0, x1 = np.maximum(0, best_px - sample_r), np.minimum(w, best_px + sample_r + 1)
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    intensities = sums / ((y1 - y0) * (x1 - x0))
+    return intensities, np.stack([best_px, best_py], axis=1)
+
+def sample_bubbles_projected(gray, M, centers, warp_size, search_r=6, sample_r=5):
+    """
+    Same result as sample_bubbles on the warped image, without producing the warp.
+    Each bubble's neighbourhood in warped coordinates is mapped back through the inverse of the
+    perspective matrix M and read from the source image with a single cv2.remap call.
+    """
+    centers = np.asarray(centers, dtype=np.intp).reshape(-1, 2)
+    n = len(centers)
+    w_target, h_target = warp_size
+    
+    # Patch radius covers the search window plus the sampling window around any refined point
+    patch_r = search_r + sample_r
+    offsets = np.arange(-patch_r, patch_r + 1)
+    size = len(offsets)
+    # (x, y) of every patch pixel in warped coordinates, filled one coordinate at a time:
+    # numpy broadcasts slowly over a length-2 last axis
+    points = np.empty((n, size * size, 2), dtype=np.float32)
+    points[:, :, 0] = centers[:, 0, None].astype(np.float32) + np.tile(offsets, size).astype(np.float32)
+    points[:, :, 1] = centers[:, 1, None].astype(np.float32) + np.repeat(offsets, size).astype(np.float32)
+    
+    # Project them into source coordinates. cv2.perspectiveTransform is several times faster than
+    # the same arithmetic in numpy, and remap takes its (x, y) pairs as one map.
+    maps = cv2.perspectiveTransform(points.reshape(1, -1, 2), np.linalg.inv(M)).reshape(n * size, size, 2)
+    stacked = cv2.remap(gray, maps, None, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    
+    # Pixels outside the warped frame do not exist in the warp: never pick or average them
+    all_inside = (centers.min(axis=0) >= patch_r).all() and \
+        centers[:, 0].max() + patch_r < w_target and centers[:, 1].max() + patch_r < h_target
+    if all_inside:
+        search = stacked.reshape(n, size, size)
+    else:
+        xs, ys = points[:, :, 0], points[:, :, 1]
+        inside = ((xs >= 0) & (xs < w_target) & (ys >= 0) & (ys < h_target)).reshape(n * size, size)
+        stacked = stacked * inside.astype(np.uint8)
+        search = np.where(inside, stacked.astype(np.int16), 256).reshape(n, size, size)
+    
+    # Darkest pixel of the central search window
+    lo, hi = sample_r, sample_r + 2 * search_r + 1
+    flat_idx = np.argmin(search[:, lo:hi, lo:hi].reshape(n, -1), axis=1)
+    dy = flat_idx // (2 * search_r + 1)
+    dx = flat_idx % (2 * search_r + 1)
+    
+    # Mean of the sampling window around it. Patches are stacked vertically, so one integral
+    # image serves all of them as long as a window never crosses into the next patch.
+    base = np.arange(n) * size
+    y0, y1 = base + dy, base + dy + 2 * sample_r + 1
+    x0, x1 = dx, dx + 2 * sample_r + 1
+    def box(integral):
+        return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    if all_inside:
+        counts = (2 * sample_r + 1) ** 2
+    else:
+        counts = box(cv2.integral(inside.astype(np.uint8)))
+    intensities = box(cv2.integral(stacked)) / counts
+    
+    best_px = centers[:, 0] + dx - search_r
+    best_py = centers[:, 1] + dy - search_r
+    return intensities, np.stack([best_px, best_py], axis=1)
+
+def classify_marks(intensities, ratio):
+    """
+    Classifies each row of a (rows x choices) intensity matrix as
+    "single", "multiple", "blank" or "ambiguous".
+    A row is marked when its darkest bubble is below row mean * ratio (the original rule);
+    the lightest bubble of the row stands in for the paper.
+    Returns (min_idx, status, margin, confidence); margin is the gap between the darkest and
+    second-darkest bubble as a fraction of the paper level, confidence is 0..1 per row.
+    """
+    intensities = np.asarray(intensities, dtype=np.float32)
+    rows = np.arange(len(intensities))
+    order = np.argsort(intensities, axis=1, kind="stable")
+    min_idx = order[:, 0]
+    darkest = intensities[rows, min_idx]
+    second = intensities[rows, order[:, 1]] if intensities.shape[1] > 1 else np.copy(intensities.max(axis=1))
+    paper = np.maximum(intensities.max(axis=1), 1.0)
+
+    fill = (paper - darkest) / paper
+    # Printed letters alone can dip below the mean rule on an empty row
+    marked = (darkest < intensities.mean(axis=1) * ratio) & (fill >= CLEAN_FILL)
+    margin = (second - darkest) / paper
+    second_ratio = (paper - second) / np.maximum(paper - darkest, 1.0)
+
+    multiple = marked & (second_ratio >= MULTI_MARK_RATIO)
+    ambiguous = marked & ~multiple & ((second_ratio >= AMBIGUOUS_RATIO) | (fill < MIN_FILL))
+    single = marked & ~multiple & ~ambiguous
+    status = np.full(len(intensities), "blank", dtype=object)
+    status[single] = "single"
+    status[multiple] = "multiple"
+    status[ambiguous] = "ambiguous"
+
+    # Distance from the nearest decision boundary, scaled to 0..1
+    confidence = np.clip((MIN_FILL - fill) / (MIN_FILL - CLEAN_FILL), 0, 1)
+    confidence[single] = np.minimum(np.clip((fill[single] - MIN_FILL) / (SOLID_FILL - MIN_FILL), 0, 1),
+                                    np.clip((AMBIGUOUS_RATIO - second_ratio[single]) / (AMBIGUOUS_RATIO - CLEAN_RATIO), 0, 1))
+    confidence[multiple] = np.clip((second_ratio[multiple] - MULTI_MARK_RATIO) / (1 - MULTI_MARK_RATIO), 0, 1)
+    confidence[ambiguous] = 0.0
+    return min_idx, status, margin, confidence
+
+def decode_numeric(sign, decimals, digits, classifier=None, ratio=ANSWER_RATIO):
+    """
+    Reads numeric bubble grids: sign is (n,), decimals (n, places) and digits (n, rows, 10)
+    intensities. Marked digit rows are read top to bottom (blank rows are skipped), the marked
+    decimal bubble sets the number of decimal places and a filled sign bubble negates the value.
+    Returns one {"value", "status", "confidence"} dict per question; value is None for blank or
+    double-marked grids.
+    """
+    classifier = classifier or classify_marks
+    sign = np.asarray(sign, dtype=np.float32)
+    decimals = np.asarray(decimals, dtype=np.float32)
+    digits = np.asarray(digits, dtype=np.float32)
+    n, n_rows = digits.shape[:2]
+    d_idx, d_status, _, d_conf = classifier(digits.reshape(n * n_rows, 10), ratio)
+    d_idx, d_status, d_conf = d_idx.reshape(n, n_rows), d_status.reshape(n, n_rows), d_conf.reshape(n, n_rows)
+    p_idx, p_status, _, p_conf = classifier(decimals, ratio)
+
+    # The sign bubble has no neighbours to compare with: measure it against the grid's paper
+    paper = np.maximum(np.maximum(digits.max(axis=(1, 2)), decimals.max(axis=1)), 1.0)
+    s_fill = (paper - sign) / paper
+    negative = s_fill >= MIN_FILL
+    s_conf = np.where(negative, np.clip((s_fill - MIN_FILL) / (SOLID_FILL - MIN_FILL), 0, 1),
+                      np.clip((MIN_FILL - s_fill) / (MIN_FILL - CLEAN_FILL), 0, 1))
+
+    results = []
+    for i in range(n):
+        statuses = list(d_status[i]) + [p_status[i]]
+        marked_rows = [r for r in range(n_rows) if d_status[i][r] in ("single", "ambiguous")]
+        if "multiple" in statuses:
+            status, value = "multiple", None
+        elif not marked_rows:
+            # A sign or decimal mark without digits is a half-filled grid
+            blank = p_status[i] == "blank" and s_fill[i] < CLEAN_FILL
+            status, value = ("blank" if blank else "ambiguous"), None
+        else:
+            places = int(p_idx[i]) + 1 if p_status[i] != "blank" else 0
+            value = int("".join(str(d_idx[i][r]) for r in marked_rows)) / 10 ** places
+            if negative[i]:
+                value = -value
+            ambiguous = "ambiguous" in statuses or CLEAN_FILL <= s_fill[i] < MIN_FILL
+            status = "ambiguous" if ambiguous else "single"
+        confidence = 0.0 if status == "ambiguous" else float(min(d_conf[i].min(), p_conf[i], s_conf[i]))
+        results.append({"value": value, "status": status, "confidence": round(confidence, 3)})
+    return results
+
+# --- Stored intensities ---
+# The sampled intensities of a read, kept per result so sheets can be decided again (other
+# ratios, another classifier) without their images. A blob is a fixed header, the uint16
+# question numbers and float16 intensities: about 0.6 KB for 45 five-choice questions.
+INTENSITY_MAGIC = b"OMI1"
+_BLOB_HEADER = struct.Struct("<4sHHHHH") # magic, ID digits, version bubbles, MCQ rows, choices, numeric questions
+
+def pack_intensities(sheet):
+    """
+    Encodes the sampled intensities of one sheet (the dict decide_marks takes) as bytes.
+    """
+    header = _BLOB_HEADER.pack(INTENSITY_MAGIC, len(sheet["id"]), len(sheet["version"]), len(sheet["mcq_questions"]),
+                               sheet["answers"].shape[1], len(sheet["numeric_questions"]))
+    questions = np.array(list(sheet["mcq_questions"]) + list(sheet["numeric_questions"]), dtype="<u2")
+    values = np.concatenate([np.ravel(sheet[k]) for k in ("id", "version", "answers", "sign", "decimals", "digits")])
+    return header + questions.tobytes() + values.astype("<f2").tobytes()
+
+def unpack_intensities(blob):
+    """
+    Inverse of pack_intensities: {"id", "version", "mcq_questions", "answers", "numeric_questions",
+    "sign", "decimals", "digits"} with float32 arrays. Raises ValueError on anything else.
+    """
+    blob = bytes(blob)
+    if len(blob) < _BLOB_HEADER.size or not blob.startswith(INTENSITY_MAGIC):
+        raise ValueError("Not an intensity blob")
+    _, n_id, n_version, n_mcq, choices, n_num = _BLOB_HEADER.unpack_from(blob)
+    n_places = len(sheet_layout.NUMERIC_DECIMAL_COLS)
+    sizes = [n_id * 10, n_version, n_mcq * choices, n_num, n_num * n_places, n_num * sheet_layout.NUMERIC_DIGITS * 10]
+    offset = _BLOB_HEADER.size + 2 * (n_mcq + n_num)
+    if len(blob) != offset + 2 * sum(sizes):
+        raise ValueError("Truncated intensity blob")
+    questions = np.frombuffer(blob, "<u2", n_mcq + n_num, _BLOB_HEADER.size).tolist()
+    parts = np.split(np.frombuffer(blob, "<f2", offset=offset).astype(np.float32), np.cumsum(sizes)[:-1])
+    return {
+        "id": parts[0].reshape(n_id, 10),
+        "version": parts[1],
+        "mcq_questions": questions[:n_mcq],
+        "answers": parts[2].reshape(n_mcq, choices),
+        "numeric_questions": questions[n_mcq:],
+        "sign": parts[3],
+        "decimals": parts[4].reshape(n_num, n_places),
+        "digits": parts[5].reshape(n_num, sheet_layout.NUMERIC_DIGITS, 10)
+    }
+
+def merge_intensities(blobs):
+    """
+    One blob for the pages of a multi-page sheet, in page order: ID and version come from
+    the first page, answer rows and numeric grids are concatenated.
+    """
+    sheets = [unpack_intensities(b) for b in blobs if b is not None]
+    if not sheets:
+        return None
+    merged = dict(sheets[0])
+    for key in ("mcq_questions", "numeric_questions"):
+        merged[key] = [q for s in sheets for q in s[key]]
+    for key in ("answers", "sign", "decimals", "digits"):
+        merged[key] = np.concatenate([s[key] for s in sheets])
+    return pack_intensities(merged)
+
+# --- Duplicate detection ---
+# Two signed 64-bit hashes (they fit a BIGINT) let a second read of the same sheet be spotted:
+# scan_hash is a SimHash of how dark every ID, version, answer and digit bubble is, so a
+# re-photographed sheet lands within a few bits of its first read while other students' sheets
+# differ by 18 or more; answer_hash is exact over the decoded ID, version and answers.
+# A pixel hash of the answer area mostly sees the printed form and cannot tell students apart.
+SCAN_HASH_DISTANCE = 7 # Most differing bits for two reads of the same sheet
+
+@functools.lru_cache(maxsize=16)
+def _hash_planes(n):
+    # +-1 hyperplanes from a fixed byte stream, so stored hashes survive NumPy upgrades
+    stream = np.frombuffer(hashlib.shake_128(b"omr-scan-hash").digest(8 * n), np.uint8)
+    return np.unpackbits(stream).reshape(n, 64).astype(np.float64) * 2 - 1
+
+def _darkness(rows):
+    rows = np.asarray(rows, np.float64)
+    rows = rows.reshape(-1, rows.shape[-1]) if rows.size else np.empty((0, 1))
+    paper = np.maximum(rows.max(axis=1, keepdims=True), 1.0)
+    return (1.0 - rows / paper).ravel()
+
+def scan_hash(sheet):
+    """
+    SimHash of a sheet's sampled intensities (the dict decide_marks takes): each bubble's
+    darkness relative to the paper of its row, projected on 64 fixed hyperplanes.
+    """
+    v = np.concatenate([_darkness(sheet["id"]), _darkness(np.reshape(sheet["version"], (1, -1))),
+                        _darkness(sheet["answers"]), _darkness(sheet["digits"])])
+    bits = (v - v.mean()) @ _hash_planes(len(v)) > 0
+    return int.from_bytes(np.packbits(bits).tobytes(), "big", signed=True)
+
+def answer_hash(result):
+    """
+    Hash of what was read off a sheet: OMR ID, version, answers and numeric answers.
+    """
+    payload = json.dumps([result.get("omr_id"), result.get("version_idx"), sorted(result["answers"].items()),
+                          sorted((q, float(v)) for q, v in (result.get("numeric_answers") or {}).items())])
+    return int.from_bytes(hashlib.blake2b(payload.encode(), digest_size=8).digest(), "big", signed=True)
+
+def hash_distance(a, b):
+    """
+    Number of differing bits between two scan hashes.
+    """
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+def _classify_blocks(blocks, ratio, classifier):
+    # One classifier call per row width over the stacked blocks, split back per block
+    out = [None] * len(blocks)
+    by_width = {}
+    for i, block in enumerate(blocks):
+        by_width.setdefault(block.shape[1], []).append(i)
+    for members in by_width.values():
+        stacked = np.concatenate([blocks[i] for i in members])
+        bounds = np.cumsum([len(blocks[i]) for i in members])[:-1]
+        parts = [np.split(np.asarray(a), bounds) for a in classifier(stacked, ratio)]
+        for j, i in enumerate(members):
+            out[i] = tuple(p[j] for p in parts)
+    return out
+
+def decide_marks(sheets, classifier=None, id_ratio=ID_RATIO, answer_ratio=ANSWER_RATIO):
+    """
+    Turns sampled intensities into decisions for any number of sheets at once: every bubble
+    group of all sheets is stacked and classified in a single call, so re-deciding thousands of
+    stored results is one vectorized pass. sheets are dicts as built by process_exam or
+    unpack_intensities; classifier defaults to classify_marks.
+    Returns per sheet {"omr_id", "id_digits", "version_idx", "answers", "numeric_answers",
+    "marks", "confidence", "needs_review"}.
+    """
+    sheets = list(sheets)
+    classifier = classifier or classify_marks
+    if not sheets:
+        return []
+    ids = _classify_blocks([s["id"] for s in sheets], id_ratio, classifier)
+    versions = _classify_blocks([np.reshape(s["version"], (1, -1)) for s in sheets], id_ratio, classifier)
+    answers = _classify_blocks([s["answers"] for s in sheets], answer_ratio, classifier)
+    reads = iter(decode_numeric(np.concatenate([s["sign"] for s in sheets]), np.concatenate([s["decimals"] for s in sheets]),
+                           np.concatenate([s["digits"] for s in sheets]), classifier, answer_ratio))
+
+    decisions = []
+    for s, (id_idx, id_status, _, id_conf), (v_idx, v_status, _, v_conf), (a_idx, a_status, a_margin, a_conf) in \
+            zip(sheets, ids, versions, answers):
+        id_marked = (id_status == "single") | (id_status == "ambiguous")
+        id_digits = "".join(str(idx) if marked else "?" for idx, marked in zip(id_idx, id_marked))
+        omr_id = int(id_digits) if "?" not in id_digits else None
+        version_idx = int(v_idx[0]) if v_status[0] in ("single", "ambiguous") else None
+        confidences = [id_conf, v_conf]
+        review = omr_id is None or "ambiguous" in id_status or v_status[0] == "ambiguous"
+
+        # An ambiguous row still yields its best guess; a double mark yields no answer
+        final_answers = {}
+        marks = {}
+        marked = (a_status == "single") | (a_status == "ambiguous")
+        for r, q in enumerate(s["mcq_questions"]):
+            if marked[r]:
+                final_answers[q] = int(a_idx[r])
+            marks[q] = {
+                "intensities": s["answers"][r].round(1).tolist(),
+                "margin": round(float(a_margin[r]), 3),
+                "status": a_status[r],
+                "confidence": round(float(a_conf[r]), 3)
+            }
+        if len(a_status):
+            confidences.append(a_conf)
+            review = review or "ambiguous" in a_status
+
+        numeric_answers = {}
+        for i, q in enumerate(s["numeric_questions"]):
+            read = next(reads)
+            if read["value"] is not None:
+                numeric_answers[q] = read["value"]
+            marks[q] = dict(read, intensities={
+                "sign": round(float(s["sign"][i]), 1),
+                "decimals": s["decimals"][i].round(1).tolist(),
+                "digits": s["digits"][i].round(1).tolist()
+            })
+            confidences.append(np.array([read["confidence"]]))
+            review = review or read["status"] == "ambiguous"
+
+        confidence = float(min(c.min() for c in confidences))
+        decisions.append({
+            "omr_id": omr_id,
+            "id_digits": id_digits,
+            "version_idx": version_idx,
+            "answers": final_answers,
+            "numeric_answers": numeric_answers,
+            "marks": marks,
+            "confidence": round(confidence, 3),
+            "needs_review": bool(review or confidence < REVIEW_CONFIDENCE)
+        })
+    return decisions
+
+def redecide(blobs, classifier=None, id_ratio=ID_RATIO, answer_ratio=ANSWER_RATIO):
+    """
+    decide_marks over stored intensity blobs (results.intensities), with no image I/O.
+    """
+    return decide_marks([unpack_intensities(b) for b in blobs], classifier, id_ratio, answer_ratio)
+
+def load_image(source, grayscale=False):
+    """
+    Returns an ndarray from a file path, raw encoded bytes or an already-decoded image.
+    BGR by default; with grayscale=True, files and bytes are decoded straight to one channel.
+    Returns None if the source cannot be decoded.
+    """
+    if isinstance(source, np.ndarray):
+        if grayscale:
+            return to_gray(source)
+        if source.ndim == 2:
+            return cv2.cvtColor(source, cv2.COLOR_GRAY2BGR)
+        return source
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buf = np.frombuffer(source, dtype=np.uint8)
+        return cv2.imdecode(buf, flags) if buf.size else None
+    return cv2.imread(source, flags)
+
+def encode_preview(image, fmt=PREVIEW_FORMAT, quality=PREVIEW_QUALITY):
+    """
+    Encodes a preview thumbnail as JPEG or WebP bytes.
+    """
+    if fmt == "webp":
+        ok, buf = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    else:
+        ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buf.tobytes() if ok else None
+
+def render_preview(image, M, warp_size, centers, warped=None, max_dim=PREVIEW_MAX_DIM, fmt=PREVIEW_FORMAT):
+    """
+    Encoded thumbnail of the rectified sheet with the decoded bubbles circled.
+    The overlay is drawn at thumbnail scale from the bubble centers; without an existing full
+    warp, the source is warped straight to thumbnail size.
+    """
+    w, h = warp_size
+    scale = min(1.0, max_dim / float(max(w, h)))
+    size = (int(round(w * scale)), int(round(h * scale)))
+    if warped is not None:
+        thumb = cv2.resize(warped, size, interpolation=cv2.INTER_AREA)
+    else:
+        S = np.diag([scale, scale, 1.0])
+        thumb = cv2.warpPerspective(image, S @ M, size)
+    thumb = cv2.cvtColor(thumb, cv2.COLOR_GRAY2BGR)
+    for (cx, cy) in centers:
+        center = (int(round(cx * scale)), int(round(cy * scale)))
+        cv2.circle(thumb, center, max(2, int(round(14 * scale))), (0, 255, 0), max(1, int(round(2 * scale))))
+        cv2.circle(thumb, center, max(1, int(round(4 * scale))), (0, 255, 0), -1)
+    return encode_preview(thumb, fmt)
+
+def crop_answer_area(image, M, layout, warped=None):
+    """
+    Grayscale crop of the rectified sheet spanning every bubble (ID, version, answers and
+    numeric grids) at full width, for archiving. Without an existing full warp only the crop's
+    rows are warped.
+    """
+    w, h = layout.warp_size
+    centers = np.concatenate([c.reshape(-1, 2) for c in (layout.id_centers, layout.version_centers, layout.answer_centers,
+                                                         layout.numeric_sign_centers, layout.numeric_digit_centers) if c.size])
+    top = max(0, int(centers[:, 1].min()) - CROP_PAD)
+    bottom = min(h, int(centers[:, 1].max()) + CROP_PAD)
+    if warped is not None:
+        return warped[top:bottom].copy()
+    T = np.array([[1, 0, 0], [0, 1, -top], [0, 0, 1]], dtype=np.float64)
+    return cv2.warpPerspective(image, T @ M, (w, bottom - top))
+
+def process_exam(image_source, num_questions=20, mcq_choices=5, question_data=None, sampling="warp", preview=False,
+                 key_resolver=None, page=0, profiler=None, crop=False):
     """
     Full pipeline: Marker detection -> Warping -> Student ID -> Answers.
+    Besides the decoded answers, "marks" holds per question the raw intensities, the margin
+    and a single/multiple/blank/ambiguous status; "confidence" is the weakest decision on the
+    sheet and "needs_review" flags sheets that should be checked by a human.
+    Double-marked questions and digits are left out of the decoded values.
+    Numeric questions are read from their bubble grids into "numeric_answers".
+    "intensities" keeps every sampled intensity as a compact blob (see pack_intensities) so the
+    sheet can be re-decided later without its image; "scan_hash" and "answer_hash" identify
+    the sheet for duplicate detection (see scan_hash and answer_hash).
+    When the sheet carries a printed sheet code, its exam id, question count, choices and
+    page index override the arguments, and key_resolver(exam_id) (if given) supplies the
+    answer key used to place numeric questions.
+    One image is one page; see merge_page_results for multi-page sheets.
+    image_source may be a file path, encoded image bytes or a decoded ndarray;
+    in-memory sources never touch the disk.
+    The whole pipeline runs on a single grayscale buffer.
+    sampling="projected" reads bubbles straight from the source image through the inverse
+    homography and never builds the full warp.
+    Only with preview does the result carry images: "preview_image" (or, when the markers are
+    not found, "debug_image") as encoded thumbnail bytes, never full-size arrays. preview may
+    name the format ("jpeg" or "webp"); True uses PREVIEW_FORMAT.
+    With crop, "answer_crop" holds the grayscale answer area for scan_archive; callers archive
+    and drop it rather than keeping it around.
+    With a stage_profiler.StageProfiler, per-stage timings are returned under "profile".
     """
-    image = cv2.imread(image_path)
+    profiler = profiler or stage_profiler.NULL_PROFILER
+    profiler.reset()
+    preview_format = preview if isinstance(preview, str) else PREVIEW_FORMAT
+    with profiler.stage("decode"):
+        image = load_image(image_source, grayscale=True)
     if image is None:
-        return {"success": False, "error": "Could not read image"}
+        return {"success": False, "error": "Could not read image", "profile": profiler.report()}
         
-    h, w = image.shape[:2]
-    max_dim = 1200
-    scale = 1.0
-    if h > max_dim or w > max_dim:
-        scale = max_dim / float(max(h, w))
-        small_img = cv2.resize(image, (int(w * scale), int(h * scale)))
-    else:
-        small_img = image
+    with profiler.stage("markers"):
+        corners = find_markers_coarse_to_fine(image, profiler=profiler)
+        if corners is None:
+            # Fall back to the exhaustive search on a 1200 px copy
+            h, w = image.shape[:2]
+            max_dim = 1200
+            scale = 1.0
+            if h > max_dim or w > max_dim:
+                scale = max_dim / float(max(h, w))
+                small_img = cv2.resize(image, (int(w * scale), int(h * scale)))
+            else:
+                small_img = image
 
-    small_corners = find_marker_squares(small_img)
-    if small_corners is None:
+            with profiler.stage("exhaustive"):
+                small_corners = find_marker_squares(small_img, profiler=profiler)
+            if small_corners is not None:
+                corners = small_corners / scale
+    if corners is None:
         # Debug image: Show edges
-        debug = cv2.Canny(cv2.cvtColor(small_img, cv2.COLOR_BGR2GRAY), 50, 150)
+        debug = None
+        if preview:
+            h, w = small_img.shape[:2]
+            scale = min(1.0, PREVIEW_MAX_DIM / float(max(h, w)))
+            edges = cv2.Canny(cv2.resize(small_img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA), 50, 150)
+            debug = encode_preview(edges, preview_format)
         return {
             "success": False, 
             "error": "Could not find corner squares. Try better lighting or hold the camera closer.",
-            "debug_image": debug
+            "debug_image": debug,
+            "profile": profiler.report()
         }
-        
-    corners = small_corners / scale
-        
-    if num_questions <= 12: num_cols = 1
-    elif num_questions <= 24: num_cols = 2
-    else: num_cols = 3
-    
-    questions_per_col = (num_questions + num_cols - 1) // num_cols
-    max_y_content = 115 + (questions_per_col * 10)
-    bottom_y_mm = max_y_content + 10
-    
-    active_w_mm = 170 
-    active_h_mm = (bottom_y_mm + 5) - 20
-    
-    w_target = 1000
-    h_target = int(w_target * (active_h_mm / active_w_mm))
     
-    dst = np.array([
-        [0, 0],
-        [w_target - 1, 0],
-        [w_target - 1, h_target - 1],
-        [0, h_target - 1]], dtype="float32")
+    # --- 0. Sheet code: exam and layout straight from the paper ---
+    with profiler.stage("header"):
+        header = sheet_header.detect_header(image, corners)
+    if header is not None and "error" in header:
+        # Reading the sheet with the default layout could mix up pages or numeric grids
+        return {"success": False, "error": header["error"], "profile": profiler.report()}
+    if header is not None:
+        num_questions = header["num_questions"]
+        mcq_choices = header["mcq_choices"]
+        page = header["page"]
+        if key_resolver is not None:
+            with profiler.stage("key_lookup"):
+                resolved = key_resolver(header["exam_id"])
+            if resolved is not None:
+                question_data = resolved
         
-    M = cv2.getPerspectiveTransform(corners.astype("float32"), dst)
-    warped = cv2.warpPerspective(image, M, (w_target, h_target))
-    warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY) 
-            
-    def to_px(mm_x, mm_y):
-        return int(((mm_x - 20) / active_w_mm) * w_target), int(((mm_y - 20) / active_h_mm) * h_target)
+    with profiler.stage("warp"):
+        try:
+            layout = sheet_layout.layout_for(num_questions, mcq_choices, question_data, page)
+        except ValueError:
+            if header is None:
+                raise
+            return {"success": False, "profile": profiler.report(),
+                    "error": f"The sheet code names page {page + 1}, which this exam's layout does not have. "
+                             "Check that the sheet belongs to the selected exam."}
+        w_target, h_target = layout.warp_size
         
-    all_bubble_centers = []
-    
-    # --- 1. Process Student ID ---
-    id_start_x = 140
-    id_start_y = 30 
-    id_digits = []
-    for c in range(3):
-        col_x = id_start_x + (c * 10) + 12
-        intensities = []
-        found_centers = []
-        for r in range(10):
-            bubble_y = id_start_y + (r * 8)
-            px, py = to_px(col_x + 2.75, bubble_y + 2.75)
-            intensity, center = sample_bubble_hybrid(warped_gray, px, py, search_r=5, sample_r=5)
-            intensities.append(intensity)
-            found_centers.append(center)
-        min_idx = np.argmin(intensities)
-        if intensities[min_idx] < (np.mean(intensities) * 0.90):
-            id_digits.append(str(min_idx))
-            all_bubble_centers.append(found_centers[min_idx])
+        M = cv2.getPerspectiveTransform(corners.astype("float32"), layout.dst_corners)
+        if sampling == "projected":
+            warped_gray = None
+            def sample(centers, search_r, sample_r):
+                return sample_bubbles_projected(image, M, centers, layout.warp_size, search_r=search_r, sample_r=sample_r)
         else:
-            id_digits.append("?")
-            
-    student_id_str = "".join(id_digits)
-    omr_id = int(student_id_str) if "?" not in student_id_str else None
-    
-    # --- 1b. Process Version ---
-    v_start_x = 110
-    v_start_y = 40 
-    v_intensities = []
-    v_centers = []
-    for r in range(5):
-        bubble_y = v_start_y + (r * 8)
-        px, py = to_px(v_start_x + 7 + 2.75, bubble_y + 2.75)
-        intensity, center = sample_bubble_hybrid(warped_gray, px, py, search_r=5, sample_r=5)
-        v_intensities.append(intensity)
-        v_centers.append(center)
-    v_min_idx = np.argmin(v_intensities)
-    version_idx = v_min_idx if v_intensities[v_min_idx] < (np.mean(v_intensities) * 0.90) else None
-    if version_idx is not None:
-        all_bubble_centers.append(v_centers[version_idx])
-    
-    # --- 2. Process Answer Grid ---
-    grid_width_mm = num_cols * (80 if num_cols==1 else (75 if num_cols==2 else 60))
-    x_base_start_mm = (210 - grid_width_mm) / 2
-    start_y_mm = 115 
-    row_height_mm = 10
-    bubble_spacing_mm = 9
-    final_answers = {}
+            warped_gray = cv2.warpPerspective(image, M, (w_target, h_target))
+            integral = cv2.integral(warped_gray)
+            def sample(centers, search_r, sample_r):
+                return sample_bubbles(warped_gray, centers, search_r=search_r, sample_r=sample_r, integral=integral)
+        
+    # --- 1. Sample Student ID and Version ---
+    with profiler.stage("id"):
+        n_id = len(layout.id_centers)
+        id_intensities, id_found = sample(layout.id_centers, search_r=5, sample_r=5)
+        id_found = id_found.reshape(n_id, 10, 2)
+    with profiler.stage("version"):
+        v_intensities, v_found = sample(layout.version_centers, search_r=5, sample_r=5)
     
-    for c in range(num_cols):
-        col_x_start = x_base_start_mm + (c * (80 if num_cols==1 else (75 if num_cols==2 else 60)))
-        qs_in_this_col = min(questions_per_col, num_questions - (c * questions_per_col))
-        for q_idx in range(qs_in_this_col):
-            abs_q_num = (c * questions_per_col) + q_idx + 1
-            if question_data and str(abs_q_num) in question_data:
-                q_info = question_data[str(abs_q_num)]
-                if isinstance(q_info, dict) and q_info.get("type") == "Numeric":
-                    continue
-            
-            row_y_mm = start_y_mm + (q_idx * row_height_mm)
-            by_mm = row_y_mm + (10 - 6.5) / 2
-            row_intensities = []
-            found_centers = []
-            for j in range(mcq_choices):
-                bx_mm = col_x_start + 15 + (j * bubble_spacing_mm)
-                px, py = to_px(bx_mm + 3.25, by_mm + 3.25)
-                intensity, center = sample_bubble_hybrid(warped_gray, px, py, search_r=5, sample_r=6)
-                row_intensities.append(intensity)
-                found_centers.append(center)
-            min_idx = np.argmin(row_intensities)
-            if row_intensities[min_idx] < (np.mean(row_intensities) * 0.92):
-                final_answers[abs_q_num] = min_idx
-                all_bubble_centers.append(found_centers[min_idx])
+    # --- 2. Sample Answer Grid ---
+    # (rows x choices) matrix over the MCQ questions; numeric grids are read below
+    q_nums = layout.mcq_questions
+    intensities = np.empty((0, mcq_choices), dtype=np.float32)
+    found = np.empty((0, mcq_choices, 2), dtype=np.float32)
+    if q_nums:
+        with profiler.stage("answers"):
+            intensities, found = sample(layout.answer_centers, search_r=5, sample_r=6)
+            found = found.reshape(len(q_nums), mcq_choices, 2)
+
+    # --- 2b. Sample Numeric Grids ---
+    # Sign, decimal and digit bubbles of every numeric question in one sampling pass. The small
+    # bubbles are averaged over most of their inside with hardly any search, so the darkest-point
+    # search cannot settle on a printed digit.
+    num_q = layout.numeric_page_questions
+    n = len(num_q)
+    n_places = len(sheet_layout.NUMERIC_DECIMAL_COLS)
+    numeric = np.empty(0, dtype=np.float32)
+    if num_q:
+        with profiler.stage("numeric"):
+            centers = np.concatenate([layout.numeric_sign_centers.reshape(-1, 2),
+                                      layout.numeric_decimal_centers.reshape(-1, 2),
+                                      layout.numeric_digit_centers.reshape(-1, 2)])
+            numeric, _ = sample(centers, search_r=1, sample_r=7)
+
+    # --- 3. Decide ---
+    sheet = {
+        "id": id_intensities.reshape(n_id, 10),
+        "version": v_intensities.ravel(),
+        "mcq_questions": list(q_nums),
+        "answers": intensities.reshape(len(q_nums), mcq_choices),
+        "numeric_questions": list(num_q),
+        "sign": numeric[:n],
+        "decimals": numeric[n:n + n * n_places].reshape(n, n_places),
+        "digits": numeric[n + n * n_places:].reshape(n, sheet_layout.NUMERIC_DIGITS, 10)
+    }
+    with profiler.stage("decide"):
+        decision = decide_marks([sheet])[0]
             
-    # Draw results
-    for (cx, cy) in all_bubble_centers:
-        cv2.circle(warped, (cx, cy), 14, (0, 255, 0), 2)
-        cv2.circle(warped, (cx, cy), 4, (0, 255, 0), -1)
+    # Draw results (only when a preview is wanted)
+    preview_image = None
+    if preview:
+        with profiler.stage("preview"):
+            rows = {q: r for r, q in enumerate(q_nums)}
+            all_bubble_centers = [id_found[d, int(c)] for d, c in enumerate(decision["id_digits"]) if c != "?"]
+            if decision["version_idx"] is not None:
+                all_bubble_centers.append(v_found[decision["version_idx"]])
+            all_bubble_centers.extend(found[rows[q], a] for q, a in decision["answers"].items())
+            preview_image = render_preview(image, M, layout.warp_size, all_bubble_centers, warped_gray,
+                                           fmt=preview_format)
+    answer_crop = None
+    if crop:
+        with profiler.stage("crop"):
+            answer_crop = crop_answer_area(image, M, layout, warped_gray)
             
     return {
         "success": True,
-        "warped_image": warped,
+        "preview_image": preview_image,
+        "answer_crop": answer_crop,
+        "debug_image": None,
+        "omr_id": decision["omr_id"],
+        "version_idx": decision["version_idx"],
+        "exam_id": header["exam_id"] if header is not None else None,
+        "header": header,
+        "page": layout.page,
+        "num_pages": layout.num_pages,
+        "answers": decision["answers"],
+        "numeric_answers": decision["numeric_answers"],
+        "marks": decision["marks"],
+        "intensities": pack_intensities(sheet),
+        "scan_hash": scan_hash(sheet),
+        "answer_hash": answer_hash(decision),
+        "confidence": decision["confidence"],
+        "needs_review": decision["needs_review"],
+        "profile": profiler.report()
+    }
+
+def merge_page_results(page_results):
+    """
+    Stitches the per-page results of one multi-page sheet into a single result.
+    Answers are keyed by exam-wide question number, so pages simply union; the first page's
+    preview is kept. Missing or repeated pages and disagreeing IDs flag the sheet for review.
+    """
+    page_results = list(page_results)
+    pages = sorted((r for r in page_results if r["success"]), key=lambda r: r["page"])
+    if not pages:
+        return page_results[0] if page_results else {"success": False, "error": "No pages to merge"}
+
+    def agreed(key):
+        values = {r[key] for r in pages if r[key] is not None}
+        return (values.pop() if len(values) == 1 else None), len(values) > 1
+
+    omr_id, id_conflict = agreed("omr_id")
+    version_idx, version_conflict = agreed("version_idx")
+    exam_id, exam_conflict = agreed("exam_id")
+    answers, numeric_answers, marks = {}, {}, {}
+    for r in pages:
+        answers.update(r["answers"])
+        numeric_answers.update(r.get("numeric_answers", {}))
+        marks.update(r["marks"])
+
+    num_pages = pages[0]["num_pages"]
+    found = [r["page"] for r in pages]
+    missing = sorted(set(range(num_pages)) - set(found))
+    confidence = min(r["confidence"] for r in pages)
+    intensities = merge_intensities(r.get("intensities") for r in pages)
+    review = (any(r["needs_review"] for r in pages) or bool(missing) or len(found) != len(set(found))
+              or len(page_results) != len(pages) or id_conflict or version_conflict or exam_conflict)
+    return {
+        "success": True,
+        "preview_image": pages[0].get("preview_image"),
         "debug_image": None,
         "omr_id": omr_id,
         "version_idx": version_idx,
-        "answers": final_answers
+        "exam_id": exam_id,
+        "header": pages[0]["header"],
+        "page": None,
+        "num_pages": num_pages,
+        "pages": found,
+        "missing_pages": missing,
+        "answers": answers,
+        "numeric_answers": numeric_answers,
+        "marks": marks,
+        "intensities": intensities,
+        "scan_hash": scan_hash(unpack_intensities(intensities)) if intensities is not None else None,
+        "answer_hash": answer_hash({"omr_id": omr_id, "version_idx": version_idx, "answers": answers,
+                                    "numeric_answers": numeric_answers}),
+        "confidence": confidence,
+        "needs_review": review
     }
+
+def process_pages(image_sources, **kwargs):
+    """
+    Reads the pages of one student's sheet (in page order) and merges them.
+    Pages without a sheet code take their position in image_sources as the page index.
+    """
+    results = [process_exam(source, page=i, **kwargs) for i, source in enumerate(image_sources)]
+    if len(results) == 1:
+        return results[0]
+    return merge_page_results(results)
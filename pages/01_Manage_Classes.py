@@ -24,10 +24,13 @@ with tab1:
             
     st.divider()
     st.subheader("Existing Classes")
-    classes = db_manager.get_all_classes()
-    if classes:
-        for cls_id, cls_name in classes:
-            with st.expander(f"🏫 {cls_name}", expanded=False):
+    # Every class with its students in two queries; the other tabs reuse the list
+    overview = db_manager.load_classes(with_students=True)
+    classes = [(c["id"], c["name"]) for c in overview]
+    if overview:
+        for cls in overview:
+            cls_id, cls_name = cls["id"], cls["name"]
+            with st.expander(f"🏫 {cls_name} ({cls['student_count']} students)", expanded=False):
                 col_c1, col_c2 = st.columns([4, 1])
                 with col_c1:
                     st.write(f"Class ID: `{cls_id}`")
@@ -37,7 +40,7 @@ with tab1:
                 
                 # Student List for this class
                 st.subheader("Students")
-                students = db_manager.get_students_by_class(cls_id)
+                students = cls["students"]
                 if students:
                     df_students = pd.DataFrame(students, columns=["DB_ID", "Name", "Edu ID", "OMR ID"])
                     df_students.insert(0, "No.", range(len(df_students)))
@@ -66,7 +69,6 @@ with tab1:
 with tab2:
     st.header("Add Single Student")
     
-    classes = db_manager.get_all_classes()
     if not classes:
         st.warning("Please create a class first.")
     else:
@@ -85,7 +87,7 @@ with tab2:
             if submitted:
                 if student_name and educational_id:
                     omr_id = db_manager.add_student(student_name, educational_id, selected_class_id)
-                    if omr_id:
+                    if omr_id is not None:
                         st.success(f"Added {student_name}. OMR ID assigned: **{omr_id}**")
                     else:
                         st.error("Error adding student. ID might be duplicate.")
@@ -133,7 +135,6 @@ with tab2:
 with tab3:
     st.header("Bulk Import from CSV")
     
-    classes = db_manager.get_all_classes()
     if not classes:
         st.warning("Please create a class first.")
     else:
@@ -170,19 +171,15 @@ with tab3:
                     st.error("CSV must contain columns: 'ID', 'COGNOME', 'NOME' (or 'ID', 'Name')")
                 else:
                     if st.button("Import Students"):
-                        count = 0
-                        errors = 0
-                        progress = st.progress(0)
-                        
-                        total = len(df)
-                        for i, row in df.iterrows():
+                        rows = []
+                        for _, row in df.iterrows():
                             eid = str(row[id_col])
                             
                             oid = None
                             if omr_id_col:
                                 try:
                                     oid = int(row[omr_id_col])
-                                except:
+                                except (TypeError, ValueError):
                                     oid = None
                             
                             if cognome_col and nome_col:
@@ -191,15 +188,15 @@ with tab3:
                                 nm = f"{c} {n}"
                             else:
                                 nm = str(row[name_col])
-                            
-                            res = db_manager.add_student(nm, eid, selected_class_id_csv, omr_id=oid)
-                            if res:
-                                count += 1
-                            else:
-                                errors += 1
-                            progress.progress((i + 1) / total)
-                            
-                        st.success(f"Imported {count} students. {errors} duplicates/errors.")
+                            rows.append({"name": nm, "educational_id": eid, "omr_id": oid})
+                        
+                        # One transaction for the whole file; clashing rows are listed instead of imported
+                        added, conflicts = db_manager.add_students(selected_class_id_csv, rows)
+                        st.success(f"Imported {len(added)} students.")
+                        if conflicts:
+                            st.warning(f"{len(conflicts)} rows were not imported:")
+                            st.dataframe([{"CSV Row": c["row"] + 1, "Name": rows[c["row"]]["name"], "Column": c["field"],
+                                           "Value": str(c["value"]), "Problem": c["reason"]} for c in conflicts], hide_index=True)
                         # Show updated list
                         students = db_manager.get_students_by_class(selected_class_id_csv)
                         if students:
@@ -213,7 +210,6 @@ with tab4:
     st.header("📇 Quick OMR ID Assignment")
     st.info("Use this to quickly assign OMR IDs to students (e.g., when handing out booklets).")
     
-    classes = db_manager.get_all_classes()
     if not classes:
         st.warning("Please create a class first.")
     else:
@@ -239,12 +235,13 @@ with tab4:
                         new_ids[sid] = st.number_input(f"ID", min_value=0, max_value=999, value=current_val, key=f"quick_id_{sid}", label_visibility="collapsed")
                 
                 if st.form_submit_button("💾 Save All Assignments"):
-                    success_count = 0
-                    for sid, val in new_ids.items():
-                        if db_manager.update_student_omr_id(sid, val):
-                            success_count += 1
-                    
-                    st.success(f"Successfully updated {success_count} student IDs!")
-                    st.rerun()
+                    updated, conflicts = db_manager.update_student_omr_ids(selected_class_id_quick, new_ids)
+                    if not conflicts:
+                        st.success(f"Successfully updated {updated} student IDs!")
+                        st.rerun()
+                    names = {sid: name for sid, name, _, _ in students}
+                    st.warning(f"Updated {updated} student IDs. These were left unchanged because the ID would be shared:")
+                    st.dataframe([{"Student": names[c["student_id"]], "OMR ID": c["omr_id"], "Problem": c["reason"]}
+                                  for c in conflicts], hide_index=True)
         else:
             st.info("No students in this class.")
@@ -1,10 +1,10 @@
 import streamlit as st
 import db_manager
+import batch_grader
 import datetime
 import json
 import gift_parser
-import io
-import numpy as np
+import sheet_header
 
 st.set_page_config(page_title="Manage Exams", page_icon="📝")
 
@@ -26,7 +26,7 @@ with st.expander("Create New Exam", expanded=True):
         st.subheader("Answer Key")
         col_key1, col_key2 = st.columns(2)
         with col_key1:
-            num_questions = st.number_input("Number of Questions", min_value=1, max_value=100, value=10)
+            num_questions = st.number_input("Number of Questions", min_value=1, max_value=500, value=10)
         with col_key2:
             mcq_choices = st.number_input("MCQ Choices (2-5)", min_value=2, max_value=5, value=5)
         
@@ -59,8 +59,12 @@ with st.expander("Import GIFT File", expanded=False):
         elif gift_file is not None:
             content = gift_file.getvalue().decode("utf-8")
             raw_questions = gift_parser.parse_gift(content)
+            # Shuffling keeps the question types, so every version takes as many pages
+            page_error = sheet_header.sheet_code_error(len(raw_questions), dict(enumerate(raw_questions, 1)))
             if not raw_questions:
                 st.error("No questions found in file. Please check GIFT format.")
+            elif page_error:
+                st.error(page_error)
             else:
                 if num_versions == 1:
                     shuffled_exam = gift_parser.shuffle_exam(raw_questions)
@@ -108,10 +112,15 @@ if 'draft_exam' in st.session_state:
                    key_data[q] = {"ans": ans, "type": "Numeric"}
 
         if st.form_submit_button("Save Exam"):
-            db_manager.create_exam(draft['name'], draft['class_id'], draft['date'], key_data, draft['mcq_choices'])
-            st.success("Exam Saved!")
-            del st.session_state['draft_exam']
-            st.rerun()
+            # The key decides how many pages its answer sheet takes
+            page_error = sheet_header.sheet_code_error(draft['num_questions'], key_data)
+            if page_error:
+                st.error(page_error)
+            else:
+                db_manager.create_exam(draft['name'], draft['class_id'], draft['date'], key_data, draft['mcq_choices'])
+                st.success("Exam Saved!")
+                del st.session_state['draft_exam']
+                st.rerun()
 
 st.divider()
 st.subheader("Existing Exams")
@@ -125,54 +134,47 @@ if selected_view_class == "All":
     # Let's just prompt user to select class.
     st.info("Select a class to view exams")
 else:
-    exams = db_manager.get_exams_by_class(class_options[selected_view_class])
-    if exams:
-        # Separate master exams (or independent ones) from versions
-        # Use a more robust check for None/NaN
-        masters = [e for e in exams if e[3] is None or (isinstance(e[3], (float, int)) and np.isnan(float(e[3])))]
-        versions = [e for e in exams if e[3] is not None and not (isinstance(e[3], (float, int)) and np.isnan(float(e[3])))]
-        
-        for ex in masters:
-            with st.expander(f"📁 {ex[1]} ({ex[2]})"):
-                details = db_manager.get_exam_details(ex[0])
-                
-                # Check for versions
-                sub_versions = [v for v in versions if v[3] == ex[0]]
+    # Masters, versions and keys of the whole class in one query
+    class_exams = db_manager.load_class_exams(class_options[selected_view_class])
+    if class_exams["exams"] or class_exams["orphaned"]:
+        for ex in class_exams["exams"]:
+            with st.expander(f"📁 {ex['name']} ({ex['date']})"):
+                sub_versions = ex["versions"]
                 
                 if sub_versions:
                     st.write("**This is a Master Exam with following versions:**")
                     for v in sub_versions:
                         col_v1, col_v2 = st.columns([3, 1])
                         with col_v1:
-                            st.write(f"- {v[1]}")
+                            st.write(f"- {v['name']}")
                         with col_v2:
-                            if st.button("🗑️", key=f"del_v_{v[0]}", help="Delete this version only"):
-                                db_manager.delete_exam(v[0])
+                            if st.button("🗑️", key=f"del_v_{v['id']}", help="Delete this version only"):
+                                db_manager.delete_exam(v['id'])
                                 st.rerun()
                         # Allow seeing version structure
-                        with st.expander(f"Details for {v[1]}"):
-                            v_details = db_manager.get_exam_details(v[0])
-                            v_key = json.loads(v_details[4])
+                        with st.expander(f"Details for {v['name']}"):
+                            v_key = v["answer_key"]
                             st.json(v_key)
                             
                             # --- Version Parameter Editor ---
                             numeric_qs = {k: q for k, q in v_key.items() if q.get("type") == "Numeric"}
                             if numeric_qs:
-                                with st.form(key=f"edit_v_form_{v[0]}"):
-                                    st.subheader(f"✏️ Customize Numeric values for {v[1]}")
+                                with st.form(key=f"edit_v_form_{v['id']}"):
+                                    st.subheader(f"✏️ Customize Numeric values for {v['name']}")
                                     new_data = {}
                                     
                                     for q_num, q_data in numeric_qs.items():
                                         st.write(f"**Question {q_num}**")
                                         # Use stable keys for widgets
-                                        new_text = st.text_area(f"Question Text", value=q_data.get("text", ""), key=f"edit_text_{v[0]}_{q_num}")
-                                        new_ans = st.number_input(f"Correct Answer", value=float(q_data.get("ans", 0)), key=f"edit_ans_{v[0]}_{q_num}")
-                                        new_data[q_num] = {"text": new_text, "ans": new_ans}
+                                        new_text = st.text_area(f"Question Text", value=q_data.get("text", ""), key=f"edit_text_{v['id']}_{q_num}")
+                                        new_ans = st.number_input(f"Correct Answer", value=float(q_data.get("ans", 0)), key=f"edit_ans_{v['id']}_{q_num}")
+                                        new_tol = st.number_input(f"Tolerance (±)", min_value=0.0, value=float(q_data.get("tol", 0)), key=f"edit_tol_{v['id']}_{q_num}")
+                                        new_data[q_num] = {"text": new_text, "ans": new_ans, "tol": new_tol}
                                     
                                     if st.form_submit_button("💾 Save Changes to this Version"):
                                         try:
                                             # 1. Re-fetch current version state to ensure we have the most recent data
-                                            latest_details = db_manager.get_exam_details(v[0])
+                                            latest_details = db_manager.get_exam_details(v['id'])
                                             updated_key = json.loads(latest_details[4])
                                             
                                             # 2. Update with new values from form
@@ -185,36 +187,77 @@ else:
                                                 if target_key in updated_key:
                                                     updated_key[target_key]["text"] = data["text"]
                                                     updated_key[target_key]["ans"] = data["ans"]
+                                                    updated_key[target_key]["tol"] = data["tol"]
                                             
                                             # 3. Save back to DB
-                                            db_manager.update_exam(v[0], answer_key=updated_key)
-                                            st.success(f"✅ Updated parameters for {v[1]}!")
+                                            db_manager.update_exam(v['id'], answer_key=updated_key)
+                                            # 4. Stored results were scored against the old key: preview, apply on confirmation
+                                            st.session_state[f"regrade_{ex['id']}"] = batch_grader.regrade_exam(ex['id'], save=False)
+                                            st.session_state[f"regrade_kind_{ex['id']}"] = "regrade"
+                                            st.success(f"✅ Updated parameters for {v['name']}!")
                                             st.rerun()
                                         except Exception as e:
                                             st.error(f"❌ Failed to save changes: {str(e)}")
 
                     st.divider()
                 else:
-                    st.json(json.loads(details[4]))
+                    st.json(ex["answer_key"])
                 
                 # --- Actions ---
-                col_ex1, col_ex2 = st.columns(2)
+                col_ex1, col_ex2, col_ex3 = st.columns(3)
                 with col_ex1:
-                    if st.button("🖨️ Generate Sheets/Booklets", key=f"gen_{ex[0]}"):
-                        st.session_state['selected_exam_id'] = ex[0]
+                    if st.button("🖨️ Generate Sheets/Booklets", key=f"gen_{ex['id']}"):
+                        st.session_state['selected_exam_id'] = ex['id']
                         st.session_state['selected_exam_class_id'] = class_options[selected_view_class]
-                        answer_key = json.loads(details[4])
-                        st.session_state['gen_exam_name'] = ex[1]
-                        st.session_state['gen_num_q'] = len(answer_key)
+                        st.session_state['gen_exam_name'] = ex['name']
+                        st.session_state['gen_exam_id'] = ex['id']
+                        st.session_state['gen_num_q'] = max(1, len(ex["answer_key"]))
+                        st.session_state['gen_mcq_choices'] = ex["mcq_choices"]
+                        st.session_state['gen_question_data'] = ex["answer_key"]
+                        st.session_state['gen_versions'] = ex["versions"]
                         st.switch_page("pages/05_Sheet_Generator.py")
                 
                 with col_ex2:
+                    if st.button("🔁 Re-grade Results", key=f"regrade_btn_{ex['id']}", help="Preview re-scoring all stored results against the current keys"):
+                        st.session_state[f"regrade_{ex['id']}"] = batch_grader.regrade_exam(ex['id'], save=False)
+                        st.session_state[f"regrade_kind_{ex['id']}"] = "regrade"
+                    if st.button("🔍 Re-read Stored Marks", key=f"redecide_btn_{ex['id']}",
+                                 help="Preview deciding the marks again from the intensities stored with each result, without the scans"):
+                        st.session_state[f"regrade_{ex['id']}"] = batch_grader.redecide_exam(ex['id'], save=False)
+                        st.session_state[f"regrade_kind_{ex['id']}"] = "redecide"
+                
+                with col_ex3:
                     del_label = "🗑️ Delete Master & Versions" if sub_versions else "🗑️ Delete Exam"
-                    if st.button(del_label, key=f"del_ex_{ex[0]}"):
-                        st.session_state[f"confirm_delete_ex_{ex[0]}"] = True
+                    if st.button(del_label, key=f"del_ex_{ex['id']}"):
+                        st.session_state[f"confirm_delete_ex_{ex['id']}"] = True
+                
+                regrade_changes = st.session_state.get(f"regrade_{ex['id']}")
+                if regrade_changes is not None:
+                    if regrade_changes:
+                        st.write(f"**Re-grading against the current keys would change {len(regrade_changes)} scores:**")
+                        st.dataframe([{
+                            "Result ID": c["result_id"],
+                            "Student": c["student"],
+                            "Old": c["old"],
+                            "New": c["new"],
+                            "Change": c["new"] - (c["old"] or 0)
+                        } for c in regrade_changes], hide_index=True)
+                        c1, c2 = st.columns(2)
+                        with c1:
+                            if st.button("Apply Re-grade", key=f"apply_regrade_{ex['id']}", type="primary"):
+                                redecide = st.session_state.get(f"regrade_kind_{ex['id']}") == "redecide"
+                                applied = (batch_grader.redecide_exam if redecide else batch_grader.regrade_exam)(ex['id'])
+                                del st.session_state[f"regrade_{ex['id']}"]
+                                st.success(f"Re-graded: {len(applied)} scores changed.")
+                        with c2:
+                            if st.button("Keep Current Scores", key=f"cancel_regrade_{ex['id']}"):
+                                del st.session_state[f"regrade_{ex['id']}"]
+                                st.rerun()
+                    else:
+                        st.info("Re-grading would not change any scores.")
                 
-                if st.session_state.get(f"confirm_delete_ex_{ex[0]}"):
-                    warning_msg = f"Are you sure you want to delete '{ex[1]}'? "
+                if st.session_state.get(f"confirm_delete_ex_{ex['id']}"):
+                    warning_msg = f"Are you sure you want to delete '{ex['name']}'? "
                     if sub_versions:
                         warning_msg += "This will also delete ALL versions and their results!"
                     else:
@@ -223,24 +266,24 @@ else:
                     st.warning(warning_msg)
                     c1, c2 = st.columns(2)
                     with c1:
-                        if st.button("Yes, Delete Everything", key=f"force_del_ex_{ex[0]}"):
-                            db_manager.delete_exam(ex[0])
-                            del st.session_state[f"confirm_delete_ex_{ex[0]}"]
-                            st.success(f"Exam '{ex[1]}' and all versions deleted.")
+                        if st.button("Yes, Delete Everything", key=f"force_del_ex_{ex['id']}"):
+                            db_manager.delete_exam(ex['id'])
+                            del st.session_state[f"confirm_delete_ex_{ex['id']}"]
+                            st.success(f"Exam '{ex['name']}' and all versions deleted.")
                             st.rerun()
                     with c2:
-                        if st.button("Cancel", key=f"cancel_del_ex_{ex[0]}"):
-                            del st.session_state[f"confirm_delete_ex_{ex[0]}"]
+                        if st.button("Cancel", key=f"cancel_del_ex_{ex['id']}"):
+                            del st.session_state[f"confirm_delete_ex_{ex['id']}"]
                             st.rerun()
                             
         # If there are orphaned versions (shouldn't happen with current logic but good for robustness)
-        orphaned = [v for v in versions if v[3] not in [m[0] for m in masters]]
+        orphaned = class_exams["orphaned"]
         if orphaned:
             st.divider()
             st.subheader("Independent Versions")
             for ex in orphaned:
-                with st.expander(f"{ex[1]} ({ex[2]})"):
+                with st.expander(f"{ex['name']} ({ex['date']})"):
                     # (Standard deletion logic here if needed, but keeping it brief)
-                    if st.button("🗑️ Delete Orphaned Version", key=f"del_orph_{ex[0]}"):
-                        db_manager.delete_exam(ex[0])
+                    if st.button("🗑️ Delete Orphaned Version", key=f"del_orph_{ex['id']}"):
+                        db_manager.delete_exam(ex['id'])
                         st.rerun()
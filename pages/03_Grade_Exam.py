@@ -1,20 +1,18 @@
 import streamlit as st
 import db_manager
 import omr_engine
-import cv2
-import numpy as np
-import json
-from PIL import Image
+import batch_grader
+import live_scanner
+import scan_archive
+import scan_dedup
+import scoring
+import stage_profiler
 
 st.set_page_config(page_title="Grade Exam", page_icon="📸")
 
 st.title("📸 Grade Exam")
 
 # 1. Select Exam
-exams = db_manager.get_all_classes() 
-# We need to select class first? Or just list all recent exams?
-# Let's list all exams with their class names.
-# Need a better DB query for that, but let's iterate.
 all_classes = db_manager.get_all_classes()
 if not all_classes:
     st.warning("No classes/exams found.")
@@ -24,43 +22,37 @@ class_map = {c[1]: c[0] for c in all_classes}
 selected_class_name = st.selectbox("Select Class", list(class_map.keys()))
 selected_class_id = class_map[selected_class_name]
 
-exams = db_manager.get_exams_by_class(selected_class_id)
-if not exams:
+# Exams, versions and keys of the class in one query
+class_exams = db_manager.load_class_exams(selected_class_id)
+if not class_exams["exams"] and not class_exams["orphaned"]:
     st.warning("No exams for this class.")
     st.stop()
     
 # Filter: Hide individual versions from the main grading dropdown.
 # Users should pick the "Master" or an independent exam.
-# ex[3] is the parent_id
-top_level_exams = [e for e in exams if e[3] is None or (isinstance(e[3], (float, int)) and np.isnan(float(e[3])))]
+top_level_exams = class_exams["exams"]
 
 if not top_level_exams:
     st.warning("No masters or independent exams found.")
     st.stop()
 
-exam_opts = {f"{e[1]} ({e[2]})": e[0] for e in top_level_exams}
+exam_opts = {f"{e['name']} ({e['date']})": e for e in top_level_exams}
 selected_exam_label = st.selectbox("Select Exam to Grade", list(exam_opts.keys()))
-selected_exam_id = exam_opts[selected_exam_label]
-
-# Load Exam Details (Key)
-exam_details = db_manager.get_exam_details(selected_exam_id)
-# id, name, class_id, date, answer_key, mcq_choices, parent_id
-master_id = exam_details[6]
+selected_exam = exam_opts[selected_exam_label]
+selected_exam_id = selected_exam["id"]
+master_id = selected_exam["parent_id"]
 is_version = master_id is not None
 
-# If this is a master or a version, we might need to swap the key based on the scan
-available_versions = []
-if "(Master)" in exam_details[1] or is_version:
-    pid = master_id if is_version else selected_exam_id
-    available_versions = db_manager.get_exam_versions(pid)
+# If this is a master, we might need to swap the key based on the scan
+available_versions = selected_exam["versions"]
 
-answer_key = json.loads(exam_details[4]) 
-mcq_choices = exam_details[5]
+answer_key = selected_exam["answer_key"]
+mcq_choices = selected_exam["mcq_choices"]
 
 # 2. Privacy & Tips
 with st.expander("ℹ️ Privacy & Mobile Scanning Tips"):
     st.info("""
-    **Privacy Info**: Images are processed in real-time. They are temporarily stored only for the duration of the scan and are **not** saved permanently unless you click 'Save Grade' below.
+    **Privacy Info**: Uploaded images wait in a temporary folder on the server while you review the grade. They are moved to the scan archive, together with the grade, when you click 'Save Grade' below, and deleted otherwise (after a day at the latest). Live scanning archives every sheet it captures.
     
     **Tips for Phone Scanning**:
     - **Align the Squares**: Ensure all 4 black squares in the corners are visible and not Cut off.
@@ -70,52 +62,156 @@ with st.expander("ℹ️ Privacy & Mobile Scanning Tips"):
     """)
 
 # 3. Input Method
-input_method = st.radio("Input Method", ["Upload Image", "Camera"])
+input_method = st.radio("Input Method", ["Upload Image", "Camera", "Live Scanner"])
 
-image_file = None
+image_files = []
 if input_method == "Upload Image":
-    image_file = st.file_uploader("Upload Scanned Sheet", type=['jpg', 'png', 'jpeg'])
-else:
+    image_files = st.file_uploader("Upload Scanned Sheet (all pages of one student)", type=['jpg', 'png', 'jpeg'], accept_multiple_files=True)
+elif input_method == "Camera":
     image_file = st.camera_input("Take a picture of the sheet")
+    if image_file:
+        image_files = [image_file]
+else:
+    # --- Live Scanner: grade a stack of sheets from a video source, no clicks ---
+    st.info("Hold each sheet still under the camera. It is graded automatically once the 4 squares are stable; then swap in the next sheet.")
+    col_src, col_stable, col_max = st.columns([2, 1, 1])
+    with col_src:
+        video_source = st.text_input("Video source", value="0", help="Camera index (0, 1, ...), stream URL or video file path")
+    with col_stable:
+        stable_frames = st.number_input("Stable frames", min_value=2, max_value=30, value=5)
+    with col_max:
+        max_sheets = st.number_input("Stop after sheets", min_value=1, max_value=1000, value=50)
+    
+    if st.button("🎥 Start Live Scanning", use_container_width=True):
+        context = batch_grader.load_exam_context(selected_exam_id)
+        scanner = live_scanner.LiveScanner(context["num_questions"], mcq_choices, answer_key, stable_frames=stable_frames,
+                                           key_resolver=batch_grader.lookup_answer_key, archive=scan_archive.ARCHIVE_DIR)
+        st.session_state['live_sheets'] = []
+        status = st.empty()
+        # Sheets left under the camera or scanned again are flagged instead of saved twice
+        dedup = batch_grader.duplicate_index(context, {})
+        try:
+            # Pages of multi-page sheets are captured one after another and stitched here
+            for result in batch_grader.group_pages(scanner.run(live_scanner.parse_source(video_source), max_results=max_sheets)):
+                sheet = batch_grader.grade_sheet(result, context)
+                batch_grader.flag_duplicate(sheet, dedup, f"sheet {len(st.session_state['live_sheets']) + 1}")
+                st.session_state['live_sheets'].append(sheet)
+                name = sheet["student"][1] if sheet["student"] else sheet["error"]
+                status.write(f"Sheet {len(st.session_state['live_sheets'])}: OMR {sheet['omr_id']} - {name} - {sheet.get('score')}/{sheet.get('total')}")
+        except IOError as e:
+            st.error(str(e))
+    
+    live_sheets = st.session_state.get('live_sheets')
+    if live_sheets:
+        st.dataframe([{
+            "OMR ID": s["omr_id"],
+            "Student": s["student"][1] if s["student"] else None,
+            "Score": f"{s.get('score')}/{s.get('total')}",
+            "Confidence": s["confidence"],
+            "Review": "⚠️" if s["needs_review"] else "",
+            "Status": (s.get("warning") or "Ready") if s["row"] else s["error"]
+        } for s in live_sheets], hide_index=True)
+        
+        rows = [s["row"] for s in live_sheets if s["row"]]
+        if st.button(f"Save {len(rows)} Grades", use_container_width=True, disabled=not rows):
+            db_manager.save_results(rows)
+            st.success("Saved to Database!")
+            st.session_state['live_sheets'] = []
+            st.rerun()
 
 # --- Enhancement Settings ---
 st.sidebar.header("Scanning Settings")
 enable_bw = st.sidebar.toggle("B&W Enhancement", value=True, help="Applies a high-contrast filter to make paper whiter and ink blacker. Highly recommended for phone scans.")
+enable_profile = st.sidebar.toggle("Record timings", value=False, help="Times every stage of the scan pipeline and keeps p50/p95 for this session.")
+if enable_profile:
+    profile_stats = st.session_state.setdefault('profile_stats', stage_profiler.ProfileStats())
+    if profile_stats.count:
+        with st.sidebar.expander(f"Timings ({profile_stats.count} scans)"):
+            summary = profile_stats.summary()
+            st.dataframe([{"Stage": name, **s} for name, s in summary["stages"].items()], hide_index=True)
+            for key, counts in summary["notes"].items():
+                st.caption(f"{key}: " + ", ".join(f"{v} x{n}" for v, n in counts.items()))
 
 # --- Main Processing ---
-if image_file:
-    # Convert to CV2
-    file_bytes = np.asarray(bytearray(image_file.read()), dtype=np.uint8)
-    image = cv2.imdecode(file_bytes, 1)
-    
-    # Apply B&W enhancement if requested
-    if enable_bw:
-        image = omr_engine.apply_bw_filter(image)
+pending_pages = st.session_state.get('pending_pages', {})
+if pending_pages:
+    st.info(f"Pages read so far: {', '.join(str(p + 1) for p in sorted(pending_pages))}. Scan the remaining pages of this sheet.")
+    if st.button("Discard scanned pages"):
+        for page_result in pending_pages.values():
+            scan_archive.discard_staged(page_result["staged"])
+        st.session_state['pending_pages'] = {}
+        st.rerun()
+
+if image_files:
+    images = []
+    for image_file in image_files:
+        # Convert to CV2
+        image = omr_engine.load_image(image_file.getvalue(), grayscale=True)
+        
+        # Apply B&W enhancement if requested
+        if enable_bw:
+            image = omr_engine.apply_bw_filter(image)
+        images.append(image)
     
     # st.image(image, caption="Original Image", channels="BGR", use_container_width=True)
     
     if st.button("🚀 Process & Grade", use_container_width=True):
         with st.spinner("Analyzing..."):
-            temp_path = "temp_scan.jpg"
-            cv2.imwrite(temp_path, image)
-            
+            # A previous unsaved result is replaced, so its staged scans go
+            previous = st.session_state.get('scan_result')
+            if previous and previous.get("success"):
+                for page_result in previous.get("page_results", [previous]):
+                    if "staged" in page_result:
+                        scan_archive.discard_staged(page_result["staged"])
             # Determine layout question count (if master is empty, use first version's count)
             num_qs_layout = len(answer_key)
             if num_qs_layout == 0 and available_versions:
-                v1_key = json.loads(available_versions[0][3])
+                v1_key = available_versions[0]["answer_key"]
                 num_qs_layout = len(v1_key)
                 
-            result = omr_engine.process_exam(temp_path, num_questions=num_qs_layout, mcq_choices=mcq_choices, question_data=answer_key)
+            results = [omr_engine.process_exam(image, num_questions=num_qs_layout, mcq_choices=mcq_choices, question_data=answer_key,
+                                               key_resolver=batch_grader.lookup_answer_key, page=i, preview=True, crop=True,
+                                               profiler=stage_profiler.StageProfiler() if enable_profile else None)
+                       for i, image in enumerate(images)]
+            # Uploads and their encoded answer crops are staged on disk, not kept in the
+            # session, and archived only if the grade is saved
+            for image_file, r in zip(image_files, results):
+                if r["success"]:
+                    scan_archive.stage_result(r, image_file.getvalue())
+            if enable_profile:
+                for r in results:
+                    profile_stats.add(r.get("profile"))
+            result = next((r for r in results if not r["success"]), results[0])
+            
+            # Multi-page sheets: collect pages (also across separate camera shots) until all are in
+            pages = dict(pending_pages)
+            pages.update({r["page"]: r for r in results if r["success"] and r["num_pages"] > 1})
+            if result["success"] and pages:
+                result = omr_engine.merge_page_results(pages.values())
+                result["page_results"] = [pages[p] for p in sorted(pages)]
+                if result["missing_pages"]:
+                    st.session_state['pending_pages'] = pages
+                    result = None
+                else:
+                    st.session_state['pending_pages'] = {}
+            
+            if result is not None and result["success"]:
+                # Was this sheet saved before? (double upload, second photo of the same sheet)
+                family_id = master_id if is_version else selected_exam_id
+                dedup = scan_dedup.DuplicateIndex(db_manager.get_result_hashes(family_id))
+                result["duplicate_of"] = dedup.find(result.get("scan_hash"), result.get("answer_hash"), result.get("omr_id"))
             
             st.session_state['scan_result'] = result
             st.session_state['manual_student_id'] = None # Reset manual override
             
-            if result["success"]:
+            if result is None:
+                st.rerun()
+            elif result["success"]:
                 st.success("Processing Complete!")
             else:
                 st.error(f"Failed: {result['error']}")
                 # Show debug image to help alignment
-                if "debug_image" in result:
+                if result.get("debug_image"):
                     st.image(result["debug_image"], caption="Scanner View (Align the 4 corners)", use_container_width=True)
 
 # --- Results Display (Persists after reruns) ---
@@ -125,7 +221,8 @@ if 'scan_result' in st.session_state and st.session_state['scan_result']:
     
     col1, col2 = st.columns(2)
     with col1:
-        st.image(result["warped_image"], caption="Warped View", channels="BGR")
+        if result.get("preview_image"):
+            st.image(result["preview_image"], caption="Warped View", use_container_width=True)
     
     with col2:
         omr_id = result.get("omr_id")
@@ -135,33 +232,57 @@ if 'scan_result' in st.session_state and st.session_state['scan_result']:
         st.write(f"**Detected OMR ID:** {omr_id}")
         st.write(f"**Detected Version:** {version_letter}")
         
+        # --- Read Confidence ---
+        marks = result.get("marks", {})
+        flagged = {q: m["status"] for q, m in marks.items() if m["status"] in ("multiple", "ambiguous")}
+        if result.get("needs_review"):
+            st.warning(f"Low read confidence ({result.get('confidence', 0):.0%}). Please check the warped view.")
+        else:
+            st.caption(f"Read confidence: {result.get('confidence', 0):.0%}")
+        if flagged:
+            st.write("**Check these questions:** " + ", ".join(f"Q{q} ({status})" for q, status in sorted(flagged.items())))
+        
         # --- Version Switching Logic ---
         current_answer_key = answer_key
         current_exam_id = selected_exam_id
+        sheet_exam_id = result.get("exam_id")
         
-        if available_versions and version_idx is not None:
+        if sheet_exam_id is not None:
+            # The printed sheet code names the exact exam or version
+            matched_version = next((v for v in available_versions if v["id"] == sheet_exam_id), None)
+            if matched_version:
+                st.info(f"Sheet code: **{matched_version['name']}**")
+                current_answer_key = matched_version["answer_key"]
+                current_exam_id = matched_version["id"]
+            elif sheet_exam_id == selected_exam_id:
+                st.info(f"Sheet code: **{selected_exam['name']}**")
+            else:
+                st.error(f"This sheet was printed for another exam (sheet code {sheet_exam_id}). Select that exam to grade it.")
+        elif available_versions and version_idx is not None:
             # Try to find the version matching the detected letter
             target_name_part = f"(Version {version_letter})"
             matched_version = None
             for v in available_versions:
-                if target_name_part in v[1]:
+                if target_name_part in v["name"]:
                     matched_version = v
                     break
             
             if matched_version:
-                st.info(f"Using key for: **{matched_version[1]}**")
-                current_answer_key = json.loads(matched_version[3])
-                current_exam_id = matched_version[0]
+                st.info(f"Using key for: **{matched_version['name']}**")
+                current_answer_key = matched_version["answer_key"]
+                current_exam_id = matched_version["id"]
             else:
                 st.warning(f"Could not find a specific exam record for Version {version_letter}. Using the currently selected exam.")
         elif available_versions and version_idx is None:
             st.warning("No version detected on sheet. Using the currently selected exam record.")
         
         student_id = None
+        # One roster query serves the auto-match and the manual override
+        student_list = db_manager.get_students_by_class(selected_class_id)
         
         # 1. Try Auto-Match
         if omr_id is not None:
-            student = db_manager.get_student_by_omr(selected_class_id, omr_id)
+            student = next((s for s in student_list if s[3] == omr_id), None)
             if student:
                 st.success(f"Matched Student:\n**{student[1]}**\n({student[2]})")
                 student_id = student[0]
@@ -171,7 +292,6 @@ if 'scan_result' in st.session_state and st.session_state['scan_result']:
             st.error("Could not read OMR ID.")
 
         # 2. Manual Override (If match failed or user wants to change)
-        student_list = db_manager.get_students_by_class(selected_class_id)
         stu_opts = {f"{s[1]} (OMR: {s[3]})": s[0] for s in student_list}
         
         # Find index of current match if any
@@ -186,65 +306,56 @@ if 'scan_result' in st.session_state and st.session_state['scan_result']:
         sel_stu_label = st.selectbox("Assign to Student", list(stu_opts.keys()), index=current_idx)
         student_id = stu_opts[sel_stu_label]
             
-        # 3. Grading Logic
-        student_answers = result["answers"]
-        score = 0
-        total = 0
-        graded_details = {}
-        idx_to_char = {0: "A", 1: "B", 2: "C", 3: "D", 4: "E"}
-        
-        for q_str, key_val in current_answer_key.items():
-            q_idx = int(q_str)
-            
-            # Handle new format {"ans": "...", "type": "..."} vs old format "..."
-            if isinstance(key_val, dict):
-                proper_ans = key_val.get("ans")
-                q_type = key_val.get("type", "MCQ")
-            else:
-                proper_ans = key_val
-                q_type = "MCQ"
-            
-            stu_ans_idx = student_answers.get(q_idx)
-            stu_ans_char = idx_to_char.get(stu_ans_idx, "?") if stu_ans_idx is not None else "N/A"
-            
-            if q_type == "Numeric":
-                is_correct = False # Manual grading needed
-                stu_ans_char = "Num"
-            else:
-                is_correct = (stu_ans_char == proper_ans)
-                if is_correct:
-                    score += 1
+        # 3. Grading Logic (numeric grids are scored against the key's tolerance)
+        compiled_key = scoring.compile_key(current_answer_key)
+        score, total, graded_details = compiled_key.grade(result["answers"], marks, result.get("numeric_answers"))
+        numeric_pts = sum(d["points"] for d in graded_details.values() if d["type"] == "Numeric")
             
-            graded_details[q_idx] = {
-                "student": stu_ans_char,
-                "correct": proper_ans,
-                "is_correct": is_correct,
-                "type": q_type
-            }
-            if q_type != "Numeric":
-                total += 1
-            
-        st.metric("Score", f"{score} / {total}")
+        st.metric("Score", f"{score:g} / {total:g}")
         
-        # 4. Numeric Scoring (Manual)
-        has_numeric = any(v.get("type") == "Numeric" if isinstance(v, dict) else False for v in current_answer_key.values())
-        numeric_pts = 0.0
-        if has_numeric:
+        # 4. Numeric Scoring (read from the bubble grids)
+        numeric_details = {q: d for q, d in graded_details.items() if d["type"] == "Numeric"}
+        if numeric_details:
             st.divider()
-            numeric_pts = st.number_input("Total Points for Numeric Questions", min_value=0.0, step=0.5, value=0.0)
-            st.write(f"**Final Total Score:** {score + numeric_pts}")
+            st.write(f"**Numeric questions:** {numeric_pts:g} / {sum(compiled_key.points[compiled_key.numeric]):g}")
+            st.caption(", ".join(f"Q{q}: {d['student']} ({'ok' if d['is_correct'] else 'key ' + str(d['correct'])})"
+                                 for q, d in sorted(numeric_details.items())))
+
+        # A student keeps one result per exam: saving replaces this student's earlier result
+        duplicate = result.get("duplicate_of")
+        owner = db_manager.get_result_owner(duplicate[0]) if duplicate else None
+        remove_other = False
+        if owner:
+            reason = "the same ID and answers" if duplicate[1] == "answers" else "nearly identical marks"
+            student_name = next((s[1] for s in student_list if s[0] == student_id), "this student")
+            if (owner[0], owner[1]) == (current_exam_id, student_id):
+                st.warning(f"This sheet looks like one already saved for {student_name} ({reason}). Saving replaces that result.")
+            else:
+                st.warning(f"This sheet looks like the result saved for {owner[2] or 'a deleted student'} in {owner[3]} ({reason}). "
+                           f"Saving records this grade for {student_name} and keeps that result.")
+                # Only on request: the matched result belongs to another student or exam
+                remove_other = st.checkbox(f"Also delete the result saved for {owner[2] or 'a deleted student'} in {owner[3]} "
+                                           "(it was this sheet, graded under the wrong student or exam)")
 
         if st.button("Save Grade", use_container_width=True):
+            # Keep the scan (one archive key per page) now that the grade is kept
+            scan_key = scan_archive.join_keys(scan_archive.commit_staged(page_result.pop("staged"))
+                                              for page_result in result.get("page_results", [result]) if "staged" in page_result)
             # Use original student_id (either matched or selected from dropdown)
             db_manager.save_result(
                 current_exam_id, 
                 student_id, 
-                score + numeric_pts, # Total
-                score,               # MCQ
+                score,               # Total
+                score - numeric_pts, # MCQ
                 numeric_pts,         # Numeric
                 graded_details, 
-                "scan.jpg"
+                scan_key,
+                result.get("intensities"),
+                result.get("scan_hash"),
+                result.get("answer_hash")
             )
+            if remove_other:
+                db_manager.delete_result(duplicate[0])
             st.success("Saved to Database!")
             # Clear result after saving to prevent double submission
             st.session_state['scan_result'] = None
@@ -1,5 +1,7 @@
 import streamlit as st
 import db_manager
+import scan_archive
+import os
 import pandas as pd
 
 st.set_page_config(page_title="Results", page_icon="📊")
@@ -63,6 +65,27 @@ if results:
             st.success(f"Result {res_id} deleted.")
             st.rerun()
             
+    # --- Archived scans (disputes, re-reads) ---
+    st.divider()
+    with st.expander("🔎 Archived scan"):
+        scan_res_id = st.selectbox("Result ID", df["Result ID"].tolist())
+        keys = scan_archive.split_keys(db_manager.get_result_image_path(scan_res_id))
+        if not keys:
+            st.info("No archived scan for this result.")
+        for page, key in enumerate(keys):
+            if not scan_archive.is_archive_key(key):
+                st.info(f"The scan ({key}) was not archived.")
+                continue
+            if not os.path.exists(scan_archive.scan_path(key)):
+                st.warning(f"Archived scan {key} is missing.")
+                continue
+            st.image(scan_archive.load_scan(key), caption=f"Page {page + 1}" if len(keys) > 1 else None, use_container_width=True)
+            original = scan_archive.original_key(key)
+            if original is not None:
+                st.download_button(f"Download original upload{f' (page {page + 1})' if len(keys) > 1 else ''}",
+                                   data=scan_archive.load_scan(original), file_name=original.rsplit("/", 1)[-1],
+                                   key=f"orig_{scan_res_id}_{page}")
+
     st.divider()
     csv = df.drop(columns=["Result ID"]).to_csv(index=False).encode('utf-8')
     st.download_button(
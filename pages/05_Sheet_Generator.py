@@ -2,7 +2,8 @@ import streamlit as st
 from fpdf import FPDF
 import base64
 import db_manager
-import json
+import sheet_layout
+import sheet_header
 import re
 import zipfile
 import io
@@ -33,37 +34,39 @@ with st.sidebar:
         sel_class_name = st.selectbox("Select Class", list(class_options.keys()), index=default_class_idx)
         class_id = class_options[sel_class_name]
         
-        exams = db_manager.get_exams_by_class(class_id)
+        # Exams, versions and keys of the class in one query; loading an exam needs no more
+        class_exams = db_manager.load_class_exams(class_id)
+        exams = [x for e in class_exams["exams"] for x in [e] + e["versions"]] + class_exams["orphaned"]
         if exams:
-            exam_options = {e[1]: e[0] for e in exams}
+            exam_options = {e["name"]: e for e in exams}
             
             default_exam_idx = 0
             if selected_exam_id:
-                for i, (name, id) in enumerate(exam_options.items()):
-                    if id == selected_exam_id:
+                for i, (name, exam) in enumerate(exam_options.items()):
+                    if exam["id"] == selected_exam_id:
                         default_exam_idx = i
                         break
             
             sel_exam_name = st.selectbox("Select Exam", list(exam_options.keys()), index=default_exam_idx)
             
             if st.button("Load Exam Details"):
-                exam_details = db_manager.get_exam_details(exam_options[sel_exam_name])
-                if exam_details:
-                    answer_key = json.loads(exam_details[4])
-                    st.session_state['gen_exam_name'] = exam_details[1]
+                exam = exam_options[sel_exam_name]
+                if exam:
+                    answer_key = exam["answer_key"]
+                    st.session_state['gen_exam_name'] = exam["name"]
+                    st.session_state['gen_exam_id'] = exam["id"]
                     st.session_state['gen_num_q'] = max(1, len(answer_key))
-                    st.session_state['gen_mcq_choices'] = exam_details[5]
+                    st.session_state['gen_mcq_choices'] = exam["mcq_choices"]
                     st.session_state['gen_question_data'] = answer_key # Store types
                     
                     # If this is a master, also load its versions
-                    if "(Master)" in exam_details[1]:
-                        versions_list = db_manager.get_exam_versions(exam_options[sel_exam_name])
+                    if "(Master)" in exam["name"]:
+                        versions_list = exam["versions"]
                         st.session_state['gen_versions'] = versions_list
                         # If the master is empty, try to set defaults from the first version
                         if len(answer_key) == 0 and versions_list:
-                            v1_key = json.loads(versions_list[0][3])
-                            st.session_state['gen_num_q'] = len(v1_key)
-                            st.session_state['gen_mcq_choices'] = versions_list[0][4]
+                            st.session_state['gen_num_q'] = len(versions_list[0]["answer_key"])
+                            st.session_state['gen_mcq_choices'] = versions_list[0]["mcq_choices"]
                     else:
                         st.session_state['gen_versions'] = []
                     # Clear redirect state once handled
@@ -98,15 +101,54 @@ def clean_text(text):
     # Final pass: encode to latin-1 with replace and decode back
     return text.encode('latin-1', 'replace').decode('latin-1')
 
-def create_sheet(num_questions=20, exam_name="Exam", mcq_choices=5, question_data=None):
+def draw_sheet_code(pdf, exam_id, num_questions, mcq_choices, page=0):
+    """
+    Prints the machine-readable sheet code (see sheet_header.py) in the free area left of the version column.
+    """
+    cell = sheet_header.CELL_SIZE
+    pdf.set_fill_color(0, 0, 0)
+    for slot, marker_id in enumerate(sheet_header.encode_header(exam_id, num_questions, mcq_choices, page)):
+        mx, my = sheet_header.marker_origin(slot)
+        cells = sheet_header.marker_cells(marker_id)
+        for r in range(sheet_header.MARKER_CELLS):
+            # One rectangle per horizontal run of black cells avoids hairline seams in print
+            c = 0
+            while c < sheet_header.MARKER_CELLS:
+                if not cells[r, c]:
+                    c += 1
+                    continue
+                start = c
+                while c < sheet_header.MARKER_CELLS and cells[r, c]:
+                    c += 1
+                pdf.rect(mx + start * cell, my + r * cell, (c - start) * cell, cell, 'F')
+    
+    rows = (sheet_header.HEADER_MARKERS + sheet_header.HEADER_COLS - 1) // sheet_header.HEADER_COLS
+    pdf.set_font("Helvetica", 'I', 7)
+    pdf.set_xy(sheet_header.HEADER_START_X, sheet_header.HEADER_START_Y + rows * sheet_header.HEADER_GAP)
+    label = f"Sheet code {exam_id}" if exam_id is not None else "Sheet code"
+    pdf.cell(sheet_header.HEADER_COLS * sheet_header.HEADER_GAP, 4, f"{label} - do not write here")
+
+def create_sheet(num_questions=20, exam_name="Exam", mcq_choices=5, question_data=None, exam_id=None):
+    """
+    Answer sheet PDF; exams longer than one page (sheet_layout.paginate) continue on further pages.
+    """
     pdf = FPDF()
+    # Fixed layout: a full page's footer must not spill onto an extra blank page
+    pdf.set_auto_page_break(False)
+    numeric = sheet_layout.numeric_questions_from(question_data, num_questions)
+    for page in range(sheet_layout.page_count(num_questions, numeric)):
+        # Same geometry the scanner reads back (see sheet_layout.py)
+        layout = sheet_layout.layout_for(num_questions, mcq_choices, question_data, page)
+        draw_sheet_page(pdf, layout, exam_name, exam_id)
+    return pdf
+
+def draw_sheet_page(pdf, layout, exam_name, exam_id=None):
     pdf.add_page()
     pdf.set_font("Helvetica", size=12)
     
-    width = 210
-    height = 297
-    margin = 15
-    marker_size = 10
+    width = sheet_layout.PAGE_WIDTH
+    margin = sheet_layout.MARGIN
+    marker_size = sheet_layout.MARKER_SIZE
     
     # 1. Header (Compact)
     pdf.set_fill_color(0, 0, 0)
@@ -121,38 +163,32 @@ def create_sheet(num_questions=20, exam_name="Exam", mcq_choices=5, question_dat
     pdf.set_xy(header_x, margin + 8)
     pdf.cell(100, 8, f"NAME: {'_'*35}  DATE: {'_'*12}", ln=1)
     
+    # 1b. Sheet code (exam id + layout + page) so scans can be graded without picking the exam
+    draw_sheet_code(pdf, exam_id, layout.num_questions, layout.mcq_choices, layout.page)
+    
     # 2. Student ID Grid (Y=30)
-    id_start_x = 140
-    id_start_y = 30
     pdf.set_font("Helvetica", 'B', 9)
-    pdf.set_xy(id_start_x, id_start_y - 6)
+    pdf.set_xy(sheet_layout.ID_START_X, sheet_layout.ID_START_Y - 6)
     pdf.cell(55, 5, "STUDENT ID", ln=1, align='C')
     
-    bubble_r = 5.5
-    bubble_gap_x = 10
-    bubble_gap_y = 8
+    bubble_r = sheet_layout.ID_BUBBLE_SIZE
     
-    for col in range(3):
-        col_x = id_start_x + (col * bubble_gap_x) + 12
+    for col in range(sheet_layout.ID_DIGITS):
         for row in range(10):
-            bx = col_x
-            by = id_start_y + (row * bubble_gap_y)
+            bx, by = layout.id_bubble(col, row)
             pdf.ellipse(bx, by, bubble_r, bubble_r)
             pdf.set_font("Helvetica", size=8)
             pdf.set_xy(bx, by)
             pdf.cell(bubble_r, bubble_r, str(row), align='C')
             
     # 2b. Version Selection (Y=40, moved down as requested)
-    v_start_x = 110
-    v_start_y = 40
     pdf.set_font("Helvetica", 'B', 9)
-    pdf.set_xy(v_start_x, v_start_y - 6)
+    pdf.set_xy(sheet_layout.VERSION_START_X, sheet_layout.VERSION_START_Y - 6)
     pdf.cell(20, 5, "VERSION", ln=1, align='C')
     
-    version_letters = ['A', 'B', 'C', 'D', 'E']
-    for row in range(5):
-        bx = v_start_x + 7
-        by = v_start_y + (row * bubble_gap_y)
+    version_letters = sheet_layout.VERSION_LETTERS
+    for row in range(len(version_letters)):
+        bx, by = layout.version_bubble(row)
         pdf.ellipse(bx, by, bubble_r, bubble_r)
         pdf.set_font("Helvetica", size=8)
         pdf.set_xy(bx, by)
@@ -165,71 +201,74 @@ def create_sheet(num_questions=20, exam_name="Exam", mcq_choices=5, question_dat
             pdf.set_fill_color(0, 0, 0) # Reset just in case
             
     # 3. Answers Grid (Y=115) - Tighter thresholds for compactness
-    start_y = 115
-    if num_questions <= 12:
-        num_cols = 1
-        col_width = 80
-    elif num_questions <= 24:
-        num_cols = 2
-        col_width = 75
-    else:
-        num_cols = 3
-        col_width = 60
-    
-    questions_per_col = (num_questions + num_cols - 1) // num_cols
-    bubble_size = 6.5
-    bubble_spacing = 9
-    row_height = 10 # Reduced from 11 for better density
+    bubble_size = sheet_layout.BUBBLE_SIZE
+    row_height = sheet_layout.ROW_HEIGHT
     
-    max_y_reached = start_y
-    for q in range(1, num_questions + 1):
-        col_idx = (q - 1) // questions_per_col
-        q_idx = (q - 1) % questions_per_col
-        
-        grid_width = num_cols * col_width
-        x_base = (width - grid_width) / 2 + (col_idx * col_width)
-        y = start_y + (q_idx * row_height)
-        max_y_reached = max(max_y_reached, y + row_height)
+    for q in layout.questions:
+        x_base, y = layout.question_origin(q)
         
         pdf.set_font("Helvetica", 'B', 11)
         pdf.set_xy(x_base, y)
-        pdf.cell(12, row_height, f"{q}.", align='R')
-        
-        # Check Type (Default to MCQ)
-        q_data = question_data.get(str(q), {}) if question_data else {}
-        q_type = q_data.get("type", "MCQ") if isinstance(q_data, dict) else "MCQ"
+        if q in layout.numeric_questions:
+            # Label on the control row, above the digit rows
+            pdf.cell(12, sheet_layout.NUMERIC_ROW_HEIGHT, f"{q}.", align='R')
+        else:
+            pdf.cell(12, row_height, f"{q}.", align='R')
         
-        if q_type == "Numeric":
-            # Draw a box for writing the number
-            box_w = 40
-            box_h = row_height - 3
-            pdf.rect(x_base + 15, y + 1.5, box_w, box_h)
-            pdf.set_font("Helvetica", 'I', 7)
-            pdf.set_xy(x_base + 15 + box_w + 2, y)
-            # pdf.cell(10, row_height, "(Write Number)")
+        if q in layout.numeric_questions:
+            draw_numeric_grid(pdf, layout, q)
         else:
             # Draw Bubbles (MCQ)
-            options = ['A', 'B', 'C', 'D', 'E'][:mcq_choices]
+            options = ['A', 'B', 'C', 'D', 'E'][:layout.mcq_choices]
             pdf.set_font("Helvetica", size=8)
             for i, opt in enumerate(options):
-                bx = x_base + 15 + (i * bubble_spacing)
-                by = y + (row_height - bubble_size) / 2
+                bx, by = layout.answer_bubble(q, i)
                 pdf.ellipse(bx, by, bubble_size, bubble_size)
                 pdf.set_xy(bx, by)
                 pdf.cell(bubble_size, bubble_size, opt, align='C')
 
     # 4. Bottom Markers (At the end of the active area)
     # This creates a smaller box for the camera to focus on
-    bottom_y = max_y_reached + 10
+    bottom_y = layout.bottom_y
     pdf.set_fill_color(0, 0, 0)
     pdf.rect(margin, bottom_y, marker_size, marker_size, 'F') # Bottom-Left
     pdf.rect(width - margin - marker_size, bottom_y, marker_size, marker_size, 'F') # Bottom-Right
     
     pdf.set_xy(margin, bottom_y + 12)
     pdf.set_font("Helvetica", 'I', 8)
-    pdf.cell(width - 2*margin, 5, "Scan standard: Focus the 4 squares in your camera view.", align='C')
-            
-    return pdf
+    footer = "Scan standard: Focus the 4 squares in your camera view."
+    if layout.num_pages > 1:
+        footer = f"Page {layout.page + 1} of {layout.num_pages} - fill in your Student ID on every page. " + footer
+    pdf.cell(width - 2*margin, 5, footer, align='C')
+
+def draw_numeric_grid(pdf, layout, q):
+    """
+    Bubble grid of a numeric question: sign and decimal places next to the number, one 0-9 row
+    per digit below. The bubble labels are printed light so they do not read as marks.
+    """
+    size = sheet_layout.NUMERIC_BUBBLE_SIZE
+    def bubble(row, col, label):
+        bx, by = layout.numeric_bubble(q, row, col)
+        pdf.ellipse(bx, by, size, size)
+        pdf.set_xy(bx, by)
+        pdf.cell(size, size, label, align='C')
+    
+    pdf.set_text_color(140, 140, 140)
+    pdf.set_font("Helvetica", size=6)
+    bubble(0, sheet_layout.NUMERIC_SIGN_COL, "-")
+    for places, col in enumerate(sheet_layout.NUMERIC_DECIMAL_COLS, start=1):
+        bubble(0, col, str(places))
+    for row in range(1, sheet_layout.NUMERIC_DIGITS + 1):
+        for digit in range(10):
+            bubble(row, digit, str(digit))
+    pdf.set_text_color(0, 0, 0)
+    
+    # Caption in the gap between the sign and the decimal places
+    first_x, y = layout.numeric_bubble(q, 0, sheet_layout.NUMERIC_SIGN_COL + 1)
+    last_x, _ = layout.numeric_bubble(q, 0, sheet_layout.NUMERIC_DECIMAL_COLS[0])
+    pdf.set_font("Helvetica", 'I', 6)
+    pdf.set_xy(first_x, y)
+    pdf.cell(last_x - first_x, size, "decimals", align='C')
 
 def create_booklet(question_data, exam_name="Exam"):
     pdf = FPDF()
@@ -262,7 +301,7 @@ def create_booklet(question_data, exam_name="Exam"):
                 letter = chr(65 + i)
                 pdf.multi_cell(0, 5, clean_text(f"  {letter}) {opt}"))
         elif q["type"] == "Numeric":
-            pdf.multi_cell(0, 5, "(Scrivi la risposta numerica nel box sul foglio delle risposte)")
+            pdf.multi_cell(0, 5, "(Annerisci la risposta numerica nella griglia sul foglio delle risposte: una cifra per riga, segno e decimali in alto)")
             
         pdf.ln(3) # Reduced space between questions
         
@@ -294,9 +333,12 @@ def create_answer_key_pdf(question_data, exam_name="Exam"):
         if q_type == "Numeric":
             text = f"{q_num}. [Num] {ans}"
             
-        # Basic manual column wrapping
-        x = 20 + ((i // 25) * col_width)
-        y = 30 + ((i % 25) * 8)
+        # Basic manual column wrapping, 4 columns of 25 per page
+        page_i = i % 100
+        if i > 0 and page_i == 0:
+            pdf.add_page()
+        x = 20 + ((page_i // 25) * col_width)
+        y = 30 + ((page_i % 25) * 8)
         
         pdf.set_xy(x, y)
         pdf.cell(col_width, 8, clean_text(text))
@@ -309,20 +351,32 @@ default_num_q = st.session_state.get('gen_num_q', 20)
 default_choices = st.session_state.get('gen_mcq_choices', 5)
 
 exam_title = st.text_input("Exam Name for Header", value=default_name)
-num_q = st.number_input("Number of Questions", 1, 100, value=max(1, int(default_num_q)))
+num_q = st.number_input("Number of Questions", 1, 500, value=max(1, int(default_num_q)))
+# The sheet code printed on the sheet names the loaded exam; once the header or question count
+# is edited, the sheet no longer matches that exam and is printed without one
+if exam_title != default_name or num_q != max(1, int(default_num_q)):
+    st.session_state.pop('gen_exam_id', None)
+sheet_pages = sheet_layout.page_count(num_q, sheet_layout.numeric_questions_from(st.session_state.get('gen_question_data'), num_q))
+# The sheet code numbers at most sheet_header.MAX_PAGES pages
+page_error = sheet_header.sheet_code_error(num_q, st.session_state.get('gen_question_data'))
+if page_error:
+    st.error(page_error)
+elif sheet_pages > 1:
+    st.caption(f"{num_q} questions: the answer sheet will have {sheet_pages} pages (up to {sheet_layout.QUESTIONS_PER_PAGE} multiple-choice questions each; a numeric grid takes {sheet_layout.NUMERIC_SLOTS} rows).")
 mcq_choices = st.number_input("MCQ Choices (2-5)", 2, 5, value=default_choices)
 
 # If versions are available, show them
 if st.session_state.get('gen_versions'):
     st.info("💡 Tip: This is a Master exam. You can select a specific version below to pre-fill its key and title.")
-    version_opts = {v[1]: v for v in st.session_state['gen_versions']}
+    version_opts = {v['name']: v for v in st.session_state['gen_versions']}
     sel_v_name = st.selectbox("Switch to Version", ["-- Select Version --"] + list(version_opts.keys()))
     if sel_v_name != "-- Select Version --":
         v = version_opts[sel_v_name]
-        v_key = json.loads(v[3])
-        st.session_state['gen_exam_name'] = v[1]
+        v_key = v["answer_key"]
+        st.session_state['gen_exam_name'] = v['name']
+        st.session_state['gen_exam_id'] = v['id']
         st.session_state['gen_num_q'] = len(v_key)
-        st.session_state['gen_mcq_choices'] = v[4]
+        st.session_state['gen_mcq_choices'] = v['mcq_choices']
         st.session_state['gen_question_data'] = v_key
         # Clear versions to prevent loop or keep them? Clear just once.
         del st.session_state['gen_versions']
@@ -331,16 +385,25 @@ if st.session_state.get('gen_versions'):
 if st.button("Generate Answer Sheet"):
     versions = st.session_state.get('gen_versions', [])
     
+    # Keys too long for the sheet code are refused instead of failing halfway through
     if versions:
+        errors = [(v['name'], sheet_header.sheet_code_error(len(v['answer_key']), v['answer_key'])) for v in versions]
+        errors = [f"{name}: {error}" for name, error in errors if error]
+    else:
+        errors = [page_error] if page_error else []
+    if errors:
+        for error in errors:
+            st.error(error)
+    elif versions:
         # Batch Generation for Master
         zip_buffer = io.BytesIO()
         with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
             for v in versions:
-                v_key = json.loads(v[3])
+                v_key = v["answer_key"]
                 # Use the 'mcq_choices' from the UI widget to allow overriding the stored value
-                pdf = create_sheet(len(v_key), v[1], mcq_choices, question_data=v_key)
+                pdf = create_sheet(len(v_key), v['name'], mcq_choices, question_data=v_key, exam_id=v['id'])
                 pdf_bytes = pdf.output(dest='S').encode('latin-1', errors='replace')
-                zip_file.writestr(f"{v[1]}_answer_sheet.pdf", pdf_bytes)
+                zip_file.writestr(f"{v['name']}_answer_sheet.pdf", pdf_bytes)
         
         b64 = base64.b64encode(zip_buffer.getvalue()).decode()
         href = f'<a href="data:application/zip;base64,{b64}" download="shuffled_sheets.zip">Download All Sheets (ZIP)</a>'
@@ -349,7 +412,7 @@ if st.button("Generate Answer Sheet"):
     else:
         # Single Generation
         q_data = st.session_state.get('gen_question_data')
-        pdf = create_sheet(num_q, exam_title, mcq_choices, question_data=q_data)
+        pdf = create_sheet(num_q, exam_title, mcq_choices, question_data=q_data, exam_id=st.session_state.get('gen_exam_id'))
         try:
             pdf_output = pdf.output(dest='S').encode('latin-1')
         except UnicodeEncodeError:
@@ -368,11 +431,11 @@ if st.button("Generate Question Booklet"):
         zip_buffer = io.BytesIO()
         with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
             for v in versions:
-                v_key = json.loads(v[3])
+                v_key = v["answer_key"]
                 if v_key and isinstance(next(iter(v_key.values())), dict) and "text" in next(iter(v_key.values())):
-                    pdf = create_booklet(v_key, v[1])
+                    pdf = create_booklet(v_key, v['name'])
                     pdf_bytes = pdf.output(dest='S').encode('latin-1', errors='replace')
-                    zip_file.writestr(f"{v[1]}_booklet.pdf", pdf_bytes)
+                    zip_file.writestr(f"{v['name']}_booklet.pdf", pdf_bytes)
         
         b64 = base64.b64encode(zip_buffer.getvalue()).decode()
         href = f'<a href="data:application/zip;base64,{b64}" download="shuffled_booklets.zip">Download All Booklets (ZIP)</a>'
@@ -403,10 +466,10 @@ if st.button("Generate Answer Key PDF"):
         zip_buffer = io.BytesIO()
         with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
             for v in versions:
-                v_key = json.loads(v[3])
-                pdf = create_answer_key_pdf(v_key, v[1])
+                v_key = v["answer_key"]
+                pdf = create_answer_key_pdf(v_key, v['name'])
                 pdf_bytes = pdf.output(dest='S').encode('latin-1', errors='replace')
-                zip_file.writestr(f"{v[1]}_answer_key.pdf", pdf_bytes)
+                zip_file.writestr(f"{v['name']}_answer_key.pdf", pdf_bytes)
         
         b64 = base64.b64encode(zip_buffer.getvalue()).decode()
         href = f'<a href="data:application/zip;base64,{b64}" download="answer_keys.zip">Download All Answer Keys (ZIP)</a>'
@@ -0,0 +1,133 @@
+import copy
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+class QueryCache:
+    """
+    Bounded LRU cache of read results, keyed by function and arguments and tagged with the
+    tables each read depends on. Writers call invalidate(tables) so only the reads of the tables
+    they changed are dropped.
+    With sync_interval (seconds) and load_versions (a callable returning {table: version} from
+    a shared counter table), writes made by other processes are noticed at most sync_interval
+    seconds late, at the cost of one version query per interval instead of one per read.
+    """
+    def __init__(self, max_entries=256, sync_interval=None, load_versions=None):
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval if load_versions is not None else None
+        self._load_versions = load_versions
+        self._entries = OrderedDict() # key -> (tables, value)
+        self._by_table = {}
+        self._versions = {}
+        self._synced_at = None
+        # Bumped by every invalidation; a read that raced a write is not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        (True, copy of the value) for a cached key, else (False, None).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, copy.deepcopy(entry[1])
+
+    def put(self, key, tables, value, generation=None):
+        """
+        Stores value under key, evicting the least recently used entries past max_entries.
+        Skipped when an invalidation happened since generation (taken before the read).
+        """
+        value = copy.deepcopy(value)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._drop(key)
+            self._entries[key] = (tables, value)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+            return True
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for table in entry[0]:
+                self._by_table[table].discard(key)
+
+    def invalidate(self, tables):
+        """
+        Drops every cached read of any of tables.
+        """
+        with self._lock:
+            self._generation += 1
+            for table in tables:
+                for key in list(self._by_table.get(table, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_table.clear()
+
+    def sync(self, versions):
+        """
+        Invalidates the tables whose shared version counter moved since the last sync.
+        """
+        changed = [t for t, v in versions.items() if self._versions.get(t) != v]
+        self._versions = dict(versions)
+        if changed:
+            self.invalidate(changed)
+        return changed
+
+    def _maybe_sync(self):
+        if self.sync_interval is None:
+            return
+        now = time.monotonic()
+        if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        self.sync(self._load_versions())
+
+    def fetch(self, key, tables, load):
+        """
+        Cached value of key, calling load() on a miss.
+        """
+        self._maybe_sync()
+        hit, value = self.get(key)
+        if hit:
+            return value
+        generation = self._generation
+        value = load()
+        self.put(key, tables, value, generation)
+        return value
+
+    def cached(self, *tables):
+        """
+        Decorator caching a read function by its arguments under tables.
+        The undecorated function stays available as .uncached.
+        """
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = (fn, args, tuple(sorted(kwargs.items())))
+                try:
+                    hash(key)
+                except TypeError:
+                    return fn(*args, **kwargs)
+                return self.fetch(key, tables, lambda: fn(*args, **kwargs))
+            wrapper.uncached = fn
+            return wrapper
+        return decorate
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import cv2
+
+# Every upload is stored once under the sha256 of its bytes, next to a small grayscale crop of
+# its warped answer area. Keys are paths relative to the archive root, sharded two levels deep
+# so no directory grows past a few hundred entries:
+#   originals/3f/a2/3fa2...e1.jpg    the upload, byte for byte
+#   crops/3f/a2/3fa2...e1.webp       the answer area, as read
+# results.image_path holds the crop key; a multi-page sheet lists its pages' keys joined by KEY_SEPARATOR.
+ARCHIVE_DIR = os.environ.get("OMR_ARCHIVE_DIR", "scan_archive")
+KEY_SEPARATOR = ";"
+CROP_SCALE = 0.75  # Warped pixels are 0.17 mm; at 0.75 an answer bubble is still ~28 px wide
+CROP_QUALITY = 60  # WebP quality; PNG (lossless) is the fallback when WebP is unavailable
+# Scans graded on the Grade page but not saved yet wait here, outside the session, until the
+# grade is saved (archived) or discarded; leftovers are removed after STAGING_MAX_AGE seconds.
+STAGING_DIR = os.environ.get("OMR_STAGING_DIR") or os.path.join(tempfile.gettempdir(), "omr_staging")
+STAGING_MAX_AGE = 24 * 3600
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG", ".png"),
+    (b"II*\x00", ".tif"),
+    (b"MM\x00*", ".tif"),
+    (b"BM", ".bmp"),
+)
+
+def _extension(data):
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return next((ext for magic, ext in _SIGNATURES if data.startswith(magic)), ".bin")
+
+def _shard(kind, digest, ext):
+    return f"{kind}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+def scan_path(key, root=None):
+    """
+    Absolute path of an archived file.
+    """
+    return os.path.join(os.path.abspath(root or ARCHIVE_DIR), *key.split("/"))
+
+def _write_once(key, data, root):
+    path = scan_path(key, root)
+    if os.path.exists(path):
+        return False
+    _write_file(path, data)
+    return True
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write next to the target and rename, so readers never see half a file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def encode_crop(crop):
+    """
+    Downscaled grayscale WebP (or PNG) bytes of an answer-area crop.
+    """
+    h, w = crop.shape[:2]
+    small = cv2.resize(crop, (int(w * CROP_SCALE), int(h * CROP_SCALE)), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    if cv2.haveImageWriter(".webp"):
+        ok, buf = cv2.imencode(".webp", small, [cv2.IMWRITE_WEBP_QUALITY, CROP_QUALITY])
+        if ok:
+            return buf.tobytes(), ".webp"
+    ok, buf = cv2.imencode(".png", small, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+    return buf.tobytes(), ".png"
+
+def archive_scan(data, crop=None, root=None):
+    """
+    Stores the encoded upload (and, if given, its answer-area crop) unless already archived.
+    Returns {"sha256", "original", "crop"} with the archive keys (crop is None without one).
+    """
+    return _archive(data, None if crop is None else lambda: encode_crop(crop), root)
+
+def _archive(data, encode_crop_fn, root):
+    digest = hashlib.sha256(data).hexdigest()
+    original = _shard("originals", digest, _extension(data))
+    _write_once(original, data, root)
+    crop_key = None
+    if encode_crop_fn is not None:
+        existing = find_key("crops", digest, root)
+        if existing is not None:
+            crop_key = existing
+        else:
+            encoded, ext = encode_crop_fn()
+            crop_key = _shard("crops", digest, ext)
+            _write_once(crop_key, encoded, root)
+    return {"sha256": digest, "original": original, "crop": crop_key}
+
+def archive_result(result, data, root=None):
+    """
+    Archives the scan behind a process_exam(..., crop=True) result and records its key under
+    "scan_key", dropping the crop array from the result.
+    """
+    crop = result.pop("answer_crop", None)
+    keys = archive_scan(data, crop, root)
+    result["scan_key"] = keys["crop"] or keys["original"]
+    return result
+
+def stage_result(result, data, staging=None):
+    """
+    Holds the scan behind an unsaved process_exam(..., crop=True) result on disk rather than in
+    the session: writes the upload and its encoded crop to the staging folder, drops the crop
+    array and records the staged file names under "staged". commit_staged archives them once
+    the grade is saved; discard_staged removes them.
+    """
+    staging = staging or STAGING_DIR
+    purge_staged(staging)
+    digest = hashlib.sha256(data).hexdigest()
+    staged = {"original": digest + _extension(data), "crop": None}
+    _write_file(os.path.join(staging, staged["original"]), data)
+    crop = result.pop("answer_crop", None)
+    if crop is not None:
+        encoded, ext = encode_crop(crop)
+        staged["crop"] = digest + ".crop" + ext
+        _write_file(os.path.join(staging, staged["crop"]), encoded)
+    result["staged"] = staged
+    return result
+
+def commit_staged(staged, root=None, staging=None):
+    """
+    Moves a staged scan into the archive. Returns its key like archive_result's "scan_key",
+    or None when the staged files are gone (purged or already committed).
+    """
+    staging = staging or STAGING_DIR
+    try:
+        with open(os.path.join(staging, staged["original"]), "rb") as f:
+            data = f.read()
+        encoded = None
+        if staged["crop"]:
+            with open(os.path.join(staging, staged["crop"]), "rb") as f:
+                encoded = f.read(), os.path.splitext(staged["crop"])[1]
+    except FileNotFoundError:
+        return None
+    keys = _archive(data, None if encoded is None else lambda: encoded, root)
+    discard_staged(staged, staging)
+    return keys["crop"] or keys["original"]
+
+def discard_staged(staged, staging=None):
+    """
+    Removes a staged scan that will not be saved.
+    """
+    staging = staging or STAGING_DIR
+    for name in (staged["original"], staged["crop"]):
+        if name:
+            try:
+                os.remove(os.path.join(staging, name))
+            except FileNotFoundError:
+                pass
+
+def purge_staged(staging=None, max_age=None):
+    """
+    Removes staged files older than max_age seconds (STAGING_MAX_AGE), left by scans that were
+    never saved or discarded.
+    """
+    staging = staging or STAGING_DIR
+    cutoff = time.time() - (STAGING_MAX_AGE if max_age is None else max_age)
+    if not os.path.isdir(staging):
+        return
+    for name in os.listdir(staging):
+        path = os.path.join(staging, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def find_key(kind, digest, root=None):
+    """
+    Key of the archived "originals" or "crops" file for a digest, whatever its extension.
+    """
+    key = _shard(kind, digest, "")
+    folder = os.path.dirname(scan_path(key, root))
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.startswith(digest) and not name.endswith(".part"):
+                return f"{os.path.dirname(key)}/{name}"
+    return None
+
+def original_key(key, root=None):
+    """
+    The original upload behind a crop (or original) key.
+    """
+    digest = os.path.splitext(key.rsplit("/", 1)[-1])[0]
+    return find_key("originals", digest, root)
+
+def load_scan(key, root=None):
+    """
+    Bytes of an archived file, ready for process_exam or st.image.
+    """
+    with open(scan_path(key, root), "rb") as f:
+        return f.read()
+
+def join_keys(keys):
+    return KEY_SEPARATOR.join(k for k in keys if k)
+
+def is_archive_key(key):
+    """
+    Whether a results.image_path entry is an archive key, not a file name saved before the
+    archive existed (such as "scan.jpg") or the input path of an unarchived batch run.
+    """
+    return key.split("/", 1)[0] in ("originals", "crops")
+
+def split_keys(image_path):
+    """
+    Archive keys stored in a results.image_path (one per page).
+    """
+    return [k for k in (image_path or "").split(KEY_SEPARATOR) if k]
@@ -0,0 +1,69 @@
+import omr_engine
+
+# A scan hash is split into BANDS bands of 8 bits. Two hashes at most SCAN_HASH_DISTANCE (7)
+# bits apart cannot differ in all 8 bands, so looking up each band of a new hash finds every
+# near match without comparing against all stored results.
+BANDS = 8
+BAND_BITS = 64 // BANDS
+
+def _bands(scan_hash):
+    value = scan_hash & 0xFFFFFFFFFFFFFFFF
+    return [(b, (value >> (b * BAND_BITS)) & ((1 << BAND_BITS) - 1)) for b in range(BANDS)]
+
+class DuplicateIndex:
+    """
+    Earlier reads of one exam's sheets (stored results and sheets graded in this run), looked
+    up by answer_hash (exact) and scan_hash (within omr_engine.SCAN_HASH_DISTANCE bits) in
+    constant time per scan. refs are whatever the caller uses to name a read (a result id, a path).
+    entries are (ref, scan_hash, answer_hash) or (ref, scan_hash, answer_hash, omr_id).
+    """
+    def __init__(self, entries=(), max_distance=omr_engine.SCAN_HASH_DISTANCE):
+        self.max_distance = max_distance
+        self._answers = {}
+        self._bands = {}
+        self._scans = {}
+        for entry in entries:
+            self.add(*entry)
+
+    def __len__(self):
+        return len(self._scans)
+
+    def add(self, ref, scan_hash, answer_hash, omr_id=None):
+        if answer_hash is not None:
+            self._answers.setdefault(answer_hash, ref)
+        if scan_hash is not None:
+            self._scans[ref] = (scan_hash, omr_id)
+            for band in _bands(scan_hash):
+                self._bands.setdefault(band, []).append(ref)
+
+    def find(self, scan_hash, answer_hash, omr_id=None):
+        """
+        (ref, reason) of the first earlier read matching a sheet, reason being "answers" (same
+        ID and answers) or "scan" (nearly identical marks); None when the sheet is new.
+        Sheets of different students with the same answers hash only a few bits apart, so a
+        scan match also needs the same OMR ID (or one of the two unread).
+        """
+        if answer_hash is not None and answer_hash in self._answers:
+            return self._answers[answer_hash], "answers"
+        if scan_hash is None:
+            return None
+        best = None
+        for band in _bands(scan_hash):
+            for ref in self._bands.get(band, ()):
+                stored, stored_id = self._scans[ref]
+                if omr_id is not None and stored_id is not None and int(omr_id) != int(stored_id):
+                    continue
+                distance = omr_engine.hash_distance(scan_hash, stored)
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (ref, distance)
+        return (best[0], "scan") if best is not None else None
+
+    def check(self, ref, result):
+        """
+        Looks a process_exam result up and, when it is new, adds it under ref.
+        Returns find's (ref, reason) for duplicates, else None.
+        """
+        match = self.find(result.get("scan_hash"), result.get("answer_hash"), result.get("omr_id"))
+        if match is None:
+            self.add(ref, result.get("scan_hash"), result.get("answer_hash"), result.get("omr_id"))
+        return match
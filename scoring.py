@@ -0,0 +1,189 @@
+import functools
+import json
+
+import numpy as np
+
+# Slack for binary floating point when comparing numeric answers (3.14 vs 3.1400000000000001)
+NUMERIC_EPSILON = 1e-9
+
+# Answer codes of the (students x questions) matrix: 0..4 are the choices A..E
+CHOICE_LETTERS = "ABCDE"
+BLANK = len(CHOICE_LETTERS)
+MULTIPLE = BLANK + 1
+UNKNOWN = BLANK + 2 # A choice index the key has no letter for
+ANSWER_LABELS = list(CHOICE_LETTERS) + ["N/A", "Multi", "?"]
+_LABEL_CODES = {label: code for code, label in enumerate(ANSWER_LABELS)}
+
+def numeric_correct(value, key_val):
+    """
+    True when a numeric answer lies within the key's ans +/- tol (GIFT {#ans:tol}).
+    """
+    if value is None:
+        return False
+    tol = abs(float(key_val.get("tol") or 0.0))
+    return abs(float(value) - float(key_val["ans"])) <= tol + NUMERIC_EPSILON
+
+def format_numeric(value):
+    return f"{value:g}"
+
+class CompiledKey:
+    """
+    An answer key as arrays, one column per question in key order:
+    - correct: choice index of MCQ questions (-1 when the key has no valid letter)
+    - numeric: True for numeric questions; numeric_ans / numeric_tol hold their ans and tol
+    - points: what a right answer is worth; penalty: fraction of points lost on a wrong one
+    - credit: (questions x codes) fraction of points each answer code earns on MCQ questions,
+      so an MCQ column scores with a single gather
+    Key entries are "A" (old format) or {"ans", "type"} dicts, optionally with "tol" (numeric),
+    "points", "penalty" and "credit" ({"B": 0.5} partial credit for other choices).
+    Blank and double-marked answers earn nothing and lose nothing.
+    """
+    def __init__(self, answer_key, penalty=0.0):
+        self.questions = [int(q) for q in answer_key]
+        self.column = {q: i for i, q in enumerate(self.questions)}
+        n = len(self.questions)
+        self.answers = []
+        self.types = []
+        self.correct = np.full(n, -1, dtype=np.int8)
+        self.numeric = np.zeros(n, dtype=bool)
+        self.numeric_ans = np.full(n, np.nan)
+        self.numeric_tol = np.zeros(n)
+        self.points = np.ones(n)
+        self.penalty = np.full(n, float(penalty))
+        self.credit = np.zeros((n, len(ANSWER_LABELS)))
+
+        for i, key_val in enumerate(answer_key.values()):
+            # Handle new format {"ans": "...", "type": "..."} vs old format "..."
+            entry = key_val if isinstance(key_val, dict) else {"ans": key_val}
+            self.answers.append(entry.get("ans"))
+            self.types.append(entry.get("type", "MCQ"))
+            self.points[i] = float(entry.get("points", 1.0))
+            self.penalty[i] = float(entry.get("penalty", penalty))
+            if self.types[i] == "Numeric":
+                self.numeric[i] = True
+                self.numeric_ans[i] = float(entry["ans"]) if entry.get("ans") is not None else np.nan
+                self.numeric_tol[i] = abs(float(entry.get("tol") or 0.0))
+                continue
+            self.credit[i, :BLANK] = -self.penalty[i]
+            for letter, fraction in (entry.get("credit") or {}).items():
+                self.credit[i, CHOICE_LETTERS.index(letter)] = float(fraction)
+            ans = entry.get("ans")
+            if isinstance(ans, str) and len(ans) == 1 and ans in CHOICE_LETTERS:
+                self.correct[i] = CHOICE_LETTERS.index(ans)
+                self.credit[i, self.correct[i]] = 1.0
+        self.total = float(self.points.sum())
+        for array in (self.correct, self.numeric, self.numeric_ans, self.numeric_tol, self.points, self.penalty, self.credit):
+            array.flags.writeable = False
+
+    def encode(self, sheets):
+        """
+        Answer matrices for sheets given as (answers, marks, numeric_answers) as process_exam
+        returns them: codes (students x questions) and numeric values (NaN when not read).
+        Questions outside the key are ignored.
+        """
+        sheets = list(sheets)
+        codes = np.full((len(sheets), len(self.questions)), BLANK, dtype=np.int8)
+        values = np.full(codes.shape, np.nan)
+        for s, (answers, marks, numeric_answers) in enumerate(sheets):
+            for q, a in answers.items():
+                col = self.column.get(q)
+                if col is not None:
+                    codes[s, col] = a if 0 <= a < BLANK else UNKNOWN
+            for q, mark in (marks or {}).items():
+                col = self.column.get(q)
+                if col is not None and mark.get("status") == "multiple":
+                    codes[s, col] = MULTIPLE
+            for q, value in (numeric_answers or {}).items():
+                col = self.column.get(q)
+                if col is not None:
+                    values[s, col] = value
+        return codes, values
+
+    def encode_graded(self, graded):
+        """
+        Answer matrices rebuilt from stored graded_details (results.answers): what each student
+        marked survives in the "student" labels, so results can be re-scored against a new key.
+        """
+        graded = list(graded)
+        codes = np.full((len(graded), len(self.questions)), BLANK, dtype=np.int8)
+        values = np.full(codes.shape, np.nan)
+        for s, details in enumerate(graded):
+            for q, detail in details.items():
+                col = self.column.get(int(q))
+                if col is None:
+                    continue
+                label = str(detail.get("student"))
+                code = _LABEL_CODES.get(label)
+                if code is None:
+                    # Anything that is not a choice label is a numeric read
+                    try:
+                        values[s, col] = float(label)
+                    except ValueError:
+                        code = UNKNOWN
+                if code is not None:
+                    codes[s, col] = code
+        return codes, values
+
+    def score(self, codes, values=None):
+        """
+        Scores a whole answer matrix at once.
+        Returns (earned, correct): points earned per student and question, and a right-answer mask.
+        """
+        codes = np.atleast_2d(codes)
+        earned = self.credit[np.arange(len(self.questions)), codes] * self.points
+        correct = codes == self.correct
+        if self.numeric.any():
+            values = np.atleast_2d(values)[:, self.numeric]
+            answered = ~np.isnan(values)
+            ok = answered & (np.abs(values - self.numeric_ans[self.numeric]) <= self.numeric_tol[self.numeric] + NUMERIC_EPSILON)
+            earned[:, self.numeric] = np.where(ok, 1.0, np.where(answered, -self.penalty[self.numeric], 0.0)) * self.points[self.numeric]
+            correct[:, self.numeric] = ok
+        return earned, correct
+
+    def grade(self, answers, marks=None, numeric_answers=None):
+        """
+        Scores one sheet. Returns (score, total, graded_details) like batch_grader.grade_answers,
+        each detail also carrying the points it earned.
+        """
+        codes, values = self.encode([(answers, marks, numeric_answers)])
+        earned, correct = self.score(codes, values)
+        return float(earned.sum()), self.total, self.details(codes[0], values[0], earned[0], correct[0])
+
+    def details(self, codes, values, earned, correct):
+        """
+        graded_details of one student's row of the answer and score matrices.
+        """
+        details = {}
+        for i, q in enumerate(self.questions):
+            if self.numeric[i] and not np.isnan(values[i]):
+                student = format_numeric(values[i])
+            elif self.numeric[i]:
+                student = "Multi" if codes[i] == MULTIPLE else "N/A"
+            else:
+                student = ANSWER_LABELS[codes[i]]
+            details[q] = {
+                "student": student,
+                "correct": self.answers[i],
+                "is_correct": bool(correct[i]),
+                "type": self.types[i],
+                "points": float(earned[i])
+            }
+        return details
+
+    def split_score(self, earned):
+        """
+        (mcq, numeric) points per student of an earned matrix.
+        """
+        earned = np.atleast_2d(earned)
+        return earned[:, ~self.numeric].sum(axis=1), earned[:, self.numeric].sum(axis=1)
+
+@functools.lru_cache(maxsize=256)
+def _compile(key_json, penalty):
+    return CompiledKey(json.loads(key_json), penalty)
+
+def compile_key(answer_key, penalty=0.0):
+    """
+    Compiled answer key, cached on the key's content: recompiling on every rerun or sheet
+    costs one json.dumps.
+    """
+    return _compile(json.dumps(answer_key), float(penalty))
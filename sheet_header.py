@@ -0,0 +1,214 @@
+import threading
+import zlib
+
+import cv2
+import numpy as np
+
+import sheet_layout
+
+# --- Machine-readable sheet code ---
+# A row of small ArUco markers (DICT_4X4_1000) printed in the free area left of the version column.
+# Each marker carries its slot as well as a digit (id = slot * SLOT_RANGE + digit), so the payload
+# can be read back in any order, from any perspective, before the sheet layout is known.
+HEADER_MARKERS = 6
+SLOT_RANGE = 166 # 6 slots x 166 ids fit the 1000-id dictionary; 166^6 > 2^44
+MARKER_CELLS = 6 # 4x4 payload + 1-cell black border
+CELL_SIZE = 1.2  # mm; keeps the code well below the 10 mm corner markers
+HEADER_START_X = 25
+HEADER_START_Y = 38
+HEADER_COLS = 3
+HEADER_GAP = 12  # mm between marker origins
+
+# Payload bit widths (most significant first), followed by an 8-bit CRC
+EXAM_ID_BITS = 20 # 0 = sheet not tied to a stored exam
+NUM_Q_BITS = 9    # Questions in the whole exam
+CHOICES_BITS = 2  # mcq_choices - 2
+PAGE_BITS = 4     # Page index of multi-page sheets
+CHECKSUM_BITS = 8
+MAX_PAGES = 1 << PAGE_BITS # Pages one sheet code can number
+
+# Fraction of dark pixels above which the code area holds a code (blank paper has none)
+INK_FRACTION = 0.02
+
+_detector_cache = threading.local()
+
+def _dictionary():
+    return cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_1000)
+
+def get_detector(thorough=False):
+    """
+    Returns a cached ArUco detector for this thread.
+    The default one is tuned for the small code area: Aruco3 candidate search and two adaptive
+    threshold windows (7 and 17 px) instead of three, about half the time of OpenCV's defaults.
+    thorough keeps those defaults, which still read some small, noisy codes the fast one misses.
+    """
+    name = "thorough" if thorough else "fast"
+    detector = getattr(_detector_cache, name, None)
+    if detector is None:
+        params = cv2.aruco.DetectorParameters()
+        if not thorough:
+            params.useAruco3Detection = True
+            params.adaptiveThreshWinSizeMin = 7
+            params.adaptiveThreshWinSizeMax = 17
+            params.adaptiveThreshWinSizeStep = 10
+        detector = cv2.aruco.ArucoDetector(_dictionary(), params)
+        setattr(_detector_cache, name, detector)
+    return detector
+
+def _checksum(data):
+    return zlib.crc32(data.to_bytes(8, "big")) & ((1 << CHECKSUM_BITS) - 1)
+
+def encode_header(exam_id, num_questions, mcq_choices, page=0):
+    """
+    Packs the sheet parameters into HEADER_MARKERS ArUco ids, in slot order.
+    exam_id may be None for sheets printed without a stored exam.
+    """
+    exam_id = 0 if exam_id is None else int(exam_id)
+    num_questions, mcq_choices, page = int(num_questions), int(mcq_choices), int(page)
+    if not 0 <= exam_id < (1 << EXAM_ID_BITS):
+        raise ValueError(f"exam_id {exam_id} does not fit the sheet code")
+    if not 1 <= num_questions < (1 << NUM_Q_BITS):
+        raise ValueError(f"num_questions {num_questions} does not fit the sheet code")
+    if not 2 <= mcq_choices <= 5:
+        raise ValueError(f"mcq_choices {mcq_choices} does not fit the sheet code")
+    if not 0 <= page < (1 << PAGE_BITS):
+        raise ValueError(f"page {page} does not fit the sheet code")
+
+    data = exam_id
+    data = (data << NUM_Q_BITS) | num_questions
+    data = (data << CHOICES_BITS) | (mcq_choices - 2)
+    data = (data << PAGE_BITS) | page
+    value = (data << CHECKSUM_BITS) | _checksum(data)
+
+    ids = []
+    for slot in range(HEADER_MARKERS):
+        value, digit = divmod(value, SLOT_RANGE)
+        ids.append(slot * SLOT_RANGE + digit)
+    return ids
+
+def sheet_code_error(num_questions, question_data=None):
+    """
+    Why an exam's answer sheet cannot carry the sheet code, or None when it can: the question
+    count must fit NUM_Q_BITS and its pages, numeric grids included, MAX_PAGES.
+    """
+    if num_questions >= 1 << NUM_Q_BITS:
+        return f"An answer sheet holds at most {(1 << NUM_Q_BITS) - 1} questions."
+    question_data = {str(q): info for q, info in (question_data or {}).items()}
+    pages = sheet_layout.page_count(num_questions, sheet_layout.numeric_questions_from(question_data, num_questions))
+    if pages > MAX_PAGES:
+        return (f"{num_questions} questions need {pages} answer sheet pages, but a sheet can have at most {MAX_PAGES}. "
+                "Use fewer questions or fewer numeric ones, or split the exam.")
+    return None
+
+def decode_header(marker_ids):
+    """
+    Rebuilds the payload from detected marker ids (any order, unrelated ids ignored).
+    Returns {"exam_id", "num_questions", "mcq_choices", "page"} or None when incomplete or corrupt.
+    The page is not checked here: how many pages an exam has depends on its numeric questions.
+    """
+    digits = {}
+    for marker_id in marker_ids:
+        slot, digit = divmod(int(marker_id), SLOT_RANGE)
+        if slot >= HEADER_MARKERS:
+            continue
+        if digits.get(slot, digit) != digit:
+            return None # Two different codes in view
+        digits[slot] = digit
+    if len(digits) != HEADER_MARKERS:
+        return None
+
+    value = 0
+    for slot in reversed(range(HEADER_MARKERS)):
+        value = value * SLOT_RANGE + digits[slot]
+    data, checksum = value >> CHECKSUM_BITS, value & ((1 << CHECKSUM_BITS) - 1)
+    if checksum != _checksum(data):
+        return None
+
+    page = data & ((1 << PAGE_BITS) - 1)
+    data >>= PAGE_BITS
+    mcq_choices = (data & ((1 << CHOICES_BITS) - 1)) + 2
+    data >>= CHOICES_BITS
+    num_questions = data & ((1 << NUM_Q_BITS) - 1)
+    exam_id = data >> NUM_Q_BITS
+    if num_questions == 0:
+        return None
+    return {"exam_id": exam_id or None, "num_questions": num_questions, "mcq_choices": mcq_choices, "page": page}
+
+def header_region(corners, pad=8):
+    """
+    Bounding box (x0, y0, x1, y1) in image pixels of the sheet code, estimated from the ordered
+    marker centers (tl, tr, br, bl), with pad mm of slack for perspective.
+    Only the top edge's length is used for scale: the left edge depends on the question count.
+    """
+    top_left, top_right, _, bottom_left = np.asarray(corners, dtype=np.float64)
+    across = top_right - top_left
+    down = bottom_left - top_left
+    px_per_mm = np.hypot(*across) / (sheet_layout.PAGE_WIDTH - 2 * sheet_layout.MARGIN - sheet_layout.MARKER_SIZE)
+    u = across / np.hypot(*across)
+    v = down / np.hypot(*down)
+
+    # Code area relative to the top-left marker center, in mm
+    origin = sheet_layout.MARGIN + sheet_layout.MARKER_SIZE / 2
+    rows = (HEADER_MARKERS + HEADER_COLS - 1) // HEADER_COLS
+    size = MARKER_CELLS * CELL_SIZE
+    x_mm = (HEADER_START_X - origin - pad, HEADER_START_X + (HEADER_COLS - 1) * HEADER_GAP + size - origin + pad)
+    y_mm = (HEADER_START_Y - origin - pad, HEADER_START_Y + (rows - 1) * HEADER_GAP + size - origin + pad)
+    pts = np.array([top_left + (x * u + y * v) * px_per_mm for x in x_mm for y in y_mm])
+    x0, y0 = np.floor(pts.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(pts.max(axis=0)).astype(int)
+    return x0, y0, x1, y1
+
+def detect_header(gray, corners=None, max_dim=1600, region_max_dim=400):
+    """
+    Finds and decodes the sheet code in a grayscale image; returns decode_header's dict, None
+    when there is no code in view, or {"error"} when code markers are seen but do not decode.
+    With the ordered sheet corners only the code area is searched, which is much cheaper than
+    the whole frame. Large images are searched on a downscaled copy: the code cells stay several
+    pixels wide. A code the fast detector cannot read is searched again with the thorough one.
+    """
+    if corners is not None:
+        h, w = gray.shape[:2]
+        x0, y0, x1, y1 = header_region(corners)
+        gray = gray[max(0, y0):min(h, y1), max(0, x0):min(w, x1)]
+        if gray.size == 0:
+            return None
+        max_dim = region_max_dim
+    h, w = gray.shape[:2]
+    if max(h, w) > max_dim:
+        scale = max_dim / float(max(h, w))
+        gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    header = _read_header(gray, get_detector())
+    # Markers seen but not decoded, or none seen in a code area that is not blank paper
+    # (sheets printed before the code existed leave it empty)
+    if header is not None and "error" in header or header is None and corners is not None and _has_ink(gray):
+        header = _read_header(gray, get_detector(thorough=True))
+    return header
+
+def _read_header(gray, detector):
+    _, ids, _ = detector.detectMarkers(gray)
+    if ids is None:
+        return None
+    ids = [int(i) for i in ids.ravel() if int(i) < HEADER_MARKERS * SLOT_RANGE]
+    if not ids:
+        return None
+    header = decode_header(ids)
+    if header is None:
+        return {"error": "The sheet code could not be read. Rescan the sheet with the code in view."}
+    return header
+
+def _has_ink(gray):
+    return np.mean(gray < np.median(gray) * 0.6) > INK_FRACTION
+
+def marker_origin(slot):
+    """
+    Top-left corner (mm) of the marker in the given slot.
+    """
+    row, col = divmod(slot, HEADER_COLS)
+    return HEADER_START_X + col * HEADER_GAP, HEADER_START_Y + row * HEADER_GAP
+
+def marker_cells(marker_id):
+    """
+    MARKER_CELLS x MARKER_CELLS boolean grid of the marker, True where the cell is black.
+    """
+    img = cv2.aruco.generateImageMarker(_dictionary(), marker_id, MARKER_CELLS)
+    return img == 0
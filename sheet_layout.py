@@ -0,0 +1,231 @@
+import functools
+
+import numpy as np
+
+# --- Sheet geometry (millimetres on an A4 page) ---
+PAGE_WIDTH = 210
+PAGE_HEIGHT = 297
+MARGIN = 15
+MARKER_SIZE = 10
+
+# Student ID grid: 3 digit columns x 10 rows
+ID_START_X = 140
+ID_START_Y = 30
+ID_COL_OFFSET = 12
+ID_DIGITS = 3
+ID_BUBBLE_SIZE = 5.5
+ID_GAP_X = 10
+ID_GAP_Y = 8
+
+# Version column
+VERSION_START_X = 110
+VERSION_START_Y = 40
+VERSION_COL_OFFSET = 7
+VERSION_LETTERS = ['A', 'B', 'C', 'D', 'E']
+
+# Answer grid
+ANSWER_START_Y = 115
+ROW_HEIGHT = 10
+BUBBLE_SIZE = 6.5
+BUBBLE_SPACING = 9
+LABEL_WIDTH = 15
+COLUMN_WIDTHS = {1: 80, 2: 75, 3: 60}
+
+# Numeric questions: a control row (number label, minus sign, number of decimal places) above
+# one row of 0-9 bubbles per digit. The block spans NUMERIC_SLOTS answer rows of its column;
+# the digit rows start left of the label column so they fit the narrow 3-column layout.
+NUMERIC_DIGITS = 4
+NUMERIC_ROW_HEIGHT = 6
+NUMERIC_BUBBLE_SIZE = 4
+NUMERIC_SPACING = 4.5
+NUMERIC_INDENT = 6
+NUMERIC_SIGN_COL = 3
+NUMERIC_DECIMAL_COLS = (7, 8, 9) # 1, 2 or 3 decimal places; none marked = whole number
+NUMERIC_SLOTS = (NUMERIC_DIGITS + 1) * NUMERIC_ROW_HEIGHT // ROW_HEIGHT
+
+# Longer exams continue on further pages, each with its own markers, ID grid and sheet code.
+# 3 columns x 15 rows is the largest grid whose bottom markers still fit on A4.
+MAX_COLS = 3
+MAX_ROWS = 15
+QUESTIONS_PER_PAGE = MAX_COLS * MAX_ROWS # MCQ-only pages
+
+# Warped image width in pixels; height follows the active area's aspect ratio
+WARP_WIDTH = 1000
+
+def _slots(questions, numeric_questions):
+    return [NUMERIC_SLOTS if q in numeric_questions else 1 for q in questions]
+
+def pack_columns(slots, num_cols):
+    """
+    Shortest column height that fits blocks of the given row counts, in order, into num_cols
+    columns without splitting a block. Returns (rows_per_col, [(col, row) per block]).
+    """
+    rows_per_col = max(max(slots, default=1), -(-sum(slots) // num_cols))
+    while True:
+        positions = []
+        col = row = 0
+        for size in slots:
+            if row + size > rows_per_col:
+                col, row = col + 1, 0
+            positions.append((col, row))
+            row += size
+        if col < num_cols:
+            return rows_per_col, positions
+        rows_per_col += 1
+
+@functools.lru_cache(maxsize=64)
+def paginate(num_questions, numeric_questions=()):
+    """
+    (first_question, last_question) of every page: each page takes as many questions as fit
+    into MAX_COLS columns of MAX_ROWS rows.
+    """
+    numeric_questions = frozenset(numeric_questions)
+    pages = []
+    first = 1
+    while first <= num_questions or not pages:
+        last = first
+        while last < num_questions and \
+                pack_columns(_slots(range(first, last + 2), numeric_questions), MAX_COLS)[0] <= MAX_ROWS:
+            last += 1
+        pages.append((first, min(last, num_questions)))
+        first = last + 1
+    return tuple(pages)
+
+def page_count(num_questions, numeric_questions=()):
+    return len(paginate(num_questions, tuple(sorted(numeric_questions))))
+
+class SheetLayout:
+    """
+    Geometry of one page of an answer sheet, shared by the PDF generator and the scanner.
+    num_questions is the whole exam; the page holds questions first_question..last_question.
+    Positions in millimetres are top-left corners (as drawn by FPDF);
+    the *_centers arrays are bubble centers in warped-image pixels.
+    """
+    def __init__(self, num_questions, mcq_choices=5, numeric_questions=(), page=0):
+        self.num_questions = num_questions
+        self.mcq_choices = mcq_choices
+        self.numeric_questions = frozenset(numeric_questions)
+        self.page = page
+        pages = paginate(num_questions, tuple(sorted(self.numeric_questions)))
+        self.num_pages = len(pages)
+        if not 0 <= page < self.num_pages:
+            raise ValueError(f"page {page} out of range for {num_questions} questions")
+        self.first_question, self.last_question = pages[page]
+        self.questions = range(self.first_question, self.last_question + 1)
+
+        # Columns are chosen by answer rows: a numeric block counts NUMERIC_SLOTS rows
+        slots = _slots(self.questions, self.numeric_questions)
+        page_rows = sum(slots)
+        if page_rows <= 12:
+            self.num_cols = 1
+        elif page_rows <= 24:
+            self.num_cols = 2
+        else:
+            self.num_cols = 3
+        self.col_width = COLUMN_WIDTHS[self.num_cols]
+        self.rows_per_col, positions = pack_columns(slots, self.num_cols)
+        self._positions = dict(zip(self.questions, positions))
+
+        # Bottom markers sit one row below the last answer row
+        self.bottom_y = ANSWER_START_Y + (self.rows_per_col * ROW_HEIGHT) + 10
+
+        # Active area spans the marker centers
+        self.active_left = MARGIN + MARKER_SIZE / 2
+        self.active_top = MARGIN + MARKER_SIZE / 2
+        self.active_w = (PAGE_WIDTH - MARGIN - MARKER_SIZE / 2) - self.active_left
+        self.active_h = (self.bottom_y + MARKER_SIZE / 2) - self.active_top
+        self.warp_size = (WARP_WIDTH, int(WARP_WIDTH * (self.active_h / self.active_w)))
+
+        w_target, h_target = self.warp_size
+        self.dst_corners = np.array([
+            [0, 0],
+            [w_target - 1, 0],
+            [w_target - 1, h_target - 1],
+            [0, h_target - 1]], dtype="float32")
+
+        self.id_centers = self._centers([[self._center(self.id_bubble(c, r), ID_BUBBLE_SIZE) for r in range(10)]
+                                         for c in range(ID_DIGITS)])
+        self.version_centers = self._centers([self._center(self.version_bubble(r), ID_BUBBLE_SIZE)
+                                              for r in range(len(VERSION_LETTERS))])
+
+        self.mcq_questions = tuple(q for q in self.questions if q not in self.numeric_questions)
+        self.answer_centers = self._centers([[self._center(self.answer_bubble(q, j), BUBBLE_SIZE) for j in range(mcq_choices)]
+                                             for q in self.mcq_questions]).reshape(len(self.mcq_questions), mcq_choices, 2)
+
+        self.numeric_page_questions = tuple(q for q in self.questions if q in self.numeric_questions)
+        n_num = len(self.numeric_page_questions)
+        self.numeric_sign_centers = self._centers([self._center(self.numeric_bubble(q, 0, NUMERIC_SIGN_COL), NUMERIC_BUBBLE_SIZE)
+                                                   for q in self.numeric_page_questions]).reshape(n_num, 2)
+        self.numeric_decimal_centers = self._centers([[self._center(self.numeric_bubble(q, 0, c), NUMERIC_BUBBLE_SIZE)
+                                                       for c in NUMERIC_DECIMAL_COLS]
+                                                      for q in self.numeric_page_questions]).reshape(n_num, len(NUMERIC_DECIMAL_COLS), 2)
+        self.numeric_digit_centers = self._centers([[[self._center(self.numeric_bubble(q, d + 1, v), NUMERIC_BUBBLE_SIZE)
+                                                      for v in range(10)] for d in range(NUMERIC_DIGITS)]
+                                                    for q in self.numeric_page_questions]).reshape(n_num, NUMERIC_DIGITS, 10, 2)
+
+    # --- Millimetre geometry ---
+    def id_bubble(self, col, row):
+        return ID_START_X + (col * ID_GAP_X) + ID_COL_OFFSET, ID_START_Y + (row * ID_GAP_Y)
+
+    def version_bubble(self, row):
+        return VERSION_START_X + VERSION_COL_OFFSET, VERSION_START_Y + (row * ID_GAP_Y)
+
+    def question_origin(self, q):
+        """
+        Top-left corner of question q's row (the number label starts here).
+        """
+        col_idx, row_idx = self._positions[q]
+        grid_width = self.num_cols * self.col_width
+        x_base = (PAGE_WIDTH - grid_width) / 2 + (col_idx * self.col_width)
+        return x_base, ANSWER_START_Y + (row_idx * ROW_HEIGHT)
+
+    def answer_bubble(self, q, choice):
+        x_base, y = self.question_origin(q)
+        return x_base + LABEL_WIDTH + (choice * BUBBLE_SPACING), y + (ROW_HEIGHT - BUBBLE_SIZE) / 2
+
+    def numeric_bubble(self, q, row, col):
+        """
+        Bubble of numeric question q: row 0 is the control row, rows 1..NUMERIC_DIGITS the digits
+        (col = digit value).
+        """
+        x_base, y = self.question_origin(q)
+        return (x_base + NUMERIC_INDENT + (col * NUMERIC_SPACING),
+                y + (row * NUMERIC_ROW_HEIGHT) + (NUMERIC_ROW_HEIGHT - NUMERIC_BUBBLE_SIZE) / 2)
+
+    # --- Pixel geometry ---
+    def to_px(self, mm_x, mm_y):
+        w_target, h_target = self.warp_size
+        return (int(((mm_x - self.active_left) / self.active_w) * w_target),
+                int(((mm_y - self.active_top) / self.active_h) * h_target))
+
+    def _center(self, origin, size):
+        return self.to_px(origin[0] + size / 2, origin[1] + size / 2)
+
+    @staticmethod
+    def _centers(points):
+        arr = np.array(points, dtype=np.intp)
+        arr.setflags(write=False)
+        return arr
+
+@functools.lru_cache(maxsize=64)
+def get_layout(num_questions, mcq_choices=5, numeric_questions=(), page=0):
+    """
+    Cached SheetLayout; numeric_questions must be a sorted tuple to be hashable.
+    """
+    return SheetLayout(num_questions, mcq_choices, numeric_questions, page)
+
+def numeric_questions_from(question_data, num_questions):
+    """
+    Question numbers whose key entry is of type Numeric, as a sorted tuple.
+    """
+    if not question_data:
+        return ()
+    numeric = []
+    for q in range(1, num_questions + 1):
+        q_info = question_data.get(str(q))
+        if isinstance(q_info, dict) and q_info.get("type") == "Numeric":
+            numeric.append(q)
+    return tuple(numeric)
+
+def layout_for(num_questions, mcq_choices=5, question_data=None, page=0):
+    return get_layout(num_questions, mcq_choices, numeric_questions_from(question_data, num_questions), page)
@@ -0,0 +1,151 @@
+import cv2
+import numpy as np
+
+import sheet_header
+import sheet_layout
+
+# --- Synthetic answer sheets ---
+# Rasterizes the geometry create_sheet prints (sheet_layout.py + sheet_header.py) with known
+# marks, and degrades the result like a phone photo. Used by the tests, verify_omr.py and
+# benchmark_omr.py; needs nothing beyond OpenCV and numpy.
+PX_PER_MM = 4
+PRINT_GRAY = 0      # Markers, outlines and question numbers
+LABEL_GRAY = 60     # Letters and digits inside the bubbles
+GRID_LABEL_GRAY = 140 # Numeric grid labels are printed light (see draw_numeric_grid)
+MARK_GRAY = 25      # A pencil mark filled with normal pressure
+LABEL_HEIGHT = 2.0  # mm, cap height of 8 pt text
+
+def numeric_marks(value):
+    """
+    The bubbles a student fills for value: (digits, decimal places, negative).
+    """
+    text = f"{abs(float(value)):.3f}".rstrip("0").rstrip(".")
+    whole, _, fraction = text.partition(".")
+    digits = (whole.lstrip("0") + fraction) or "0"
+    if len(digits) > sheet_layout.NUMERIC_DIGITS:
+        raise ValueError(f"{value} does not fit a {sheet_layout.NUMERIC_DIGITS}-digit grid")
+    return digits, len(fraction), value < 0
+
+def render_sheet(layout, omr_id=None, version_idx=None, answers=None, numeric=None, exam_id=None,
+                 partial=None, px_per_mm=PX_PER_MM, sheet_code=True, labels=True):
+    """
+    Grayscale raster of one page of an answer sheet.
+    answers maps question -> choice index (or a tuple of indices for a double mark), numeric maps
+    question -> value; partial maps question -> 0..1 mark strength for faint or half-erased marks.
+    The sheet code is drawn like create_sheet does, for exam_id (None = no stored exam).
+    """
+    answers, numeric, partial = answers or {}, numeric or {}, partial or {}
+    px = lambda v: int(round(v * px_per_mm))
+    img = np.full((px(sheet_layout.PAGE_HEIGHT), px(sheet_layout.PAGE_WIDTH)), 255, np.uint8)
+
+    def text(label, origin, size, gray):
+        scale = LABEL_HEIGHT * px_per_mm / 22.0 # Hershey simplex caps are 22 units high
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)
+        org = (px(origin[0] + size / 2) - tw // 2, px(origin[1] + size / 2) + th // 2)
+        cv2.putText(img, label, org, cv2.FONT_HERSHEY_SIMPLEX, scale, gray, 1, cv2.LINE_AA)
+
+    def bubble(origin, size, label=None, filled=False, strength=1.0, label_gray=LABEL_GRAY):
+        center = (px(origin[0] + size / 2), px(origin[1] + size / 2))
+        cv2.circle(img, center, px(size / 2), PRINT_GRAY, 1, cv2.LINE_AA)
+        if labels and label is not None:
+            text(label, origin, size, label_gray)
+        if filled:
+            gray = int(255 - (255 - MARK_GRAY) * strength)
+            cv2.circle(img, center, px(size / 2 * 0.9), gray, -1, cv2.LINE_AA)
+
+    # Fiducial markers
+    m, s = sheet_layout.MARGIN, sheet_layout.MARKER_SIZE
+    right = sheet_layout.PAGE_WIDTH - m - s
+    for x, y in [(m, m), (right, m), (m, layout.bottom_y), (right, layout.bottom_y)]:
+        cv2.rectangle(img, (px(x), px(y)), (px(x + s) - 1, px(y + s) - 1), PRINT_GRAY, -1)
+
+    if sheet_code:
+        cell = sheet_header.CELL_SIZE
+        ids = sheet_header.encode_header(exam_id, layout.num_questions, layout.mcq_choices, layout.page)
+        for slot, marker_id in enumerate(ids):
+            mx, my = sheet_header.marker_origin(slot)
+            for r, c in zip(*np.nonzero(sheet_header.marker_cells(marker_id))):
+                cv2.rectangle(img, (px(mx + c * cell), px(my + r * cell)),
+                              (px(mx + (c + 1) * cell) - 1, px(my + (r + 1) * cell) - 1), PRINT_GRAY, -1)
+
+    id_digits = f"{omr_id:03d}" if omr_id is not None else ""
+    for col in range(sheet_layout.ID_DIGITS):
+        for row in range(10):
+            filled = col < len(id_digits) and int(id_digits[col]) == row
+            bubble(layout.id_bubble(col, row), sheet_layout.ID_BUBBLE_SIZE, str(row), filled)
+    for row, letter in enumerate(sheet_layout.VERSION_LETTERS):
+        bubble(layout.version_bubble(row), sheet_layout.ID_BUBBLE_SIZE, letter, row == version_idx)
+
+    letters = sheet_layout.VERSION_LETTERS[:layout.mcq_choices]
+    for q in layout.questions:
+        x_base, y = layout.question_origin(q)
+        if labels:
+            text(f"{q}.", (x_base, y), sheet_layout.ROW_HEIGHT, PRINT_GRAY)
+        strength = partial.get(q, 1.0)
+        if q in layout.numeric_questions:
+            digits, places, negative = numeric_marks(numeric[q]) if q in numeric else ("", 0, False)
+            size = sheet_layout.NUMERIC_BUBBLE_SIZE
+            bubble(layout.numeric_bubble(q, 0, sheet_layout.NUMERIC_SIGN_COL), size, "-", negative, strength, GRID_LABEL_GRAY)
+            for p, col in enumerate(sheet_layout.NUMERIC_DECIMAL_COLS, start=1):
+                bubble(layout.numeric_bubble(q, 0, col), size, str(p), p == places, strength, GRID_LABEL_GRAY)
+            for row in range(sheet_layout.NUMERIC_DIGITS):
+                for digit in range(10):
+                    filled = row < len(digits) and int(digits[row]) == digit
+                    bubble(layout.numeric_bubble(q, row + 1, digit), size, str(digit), filled, strength, GRID_LABEL_GRAY)
+        else:
+            chosen = answers.get(q)
+            chosen = set(chosen) if isinstance(chosen, (tuple, list, set)) else {chosen}
+            for j, letter in enumerate(letters):
+                bubble(layout.answer_bubble(q, j), sheet_layout.BUBBLE_SIZE, letter, j in chosen, strength)
+    return img
+
+# --- Capture conditions ---
+def photograph(sheet, angle=0.0, perspective=0.0, blur=0.0, shadow=0.0, noise=0.0, jpeg_quality=None,
+               background=90, border=0.08, seed=None):
+    """
+    Places a rendered sheet on a darker desk as a camera would see it, returning a BGR image.
+    angle rotates in degrees, perspective moves each corner randomly by up to that fraction of the
+    sheet size, blur is a Gaussian sigma in pixels, shadow darkens one side by up to that fraction,
+    noise is the sensor noise standard deviation and jpeg_quality re-encodes the result.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = sheet.shape[:2]
+    pad_x, pad_y = w * border, h * border
+    corners = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    dst = corners + rng.uniform(-perspective, perspective, (4, 2)) * [w, h]
+
+    # Rotate about the sheet center, then fit the whole outline into the frame
+    theta = np.deg2rad(angle)
+    rot = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    dst = (dst - [w / 2, h / 2]) @ rot.T
+    dst -= dst.min(axis=0) - [pad_x, pad_y]
+    out_w, out_h = np.ceil(dst.max(axis=0) + [pad_x, pad_y]).astype(int)
+    M = cv2.getPerspectiveTransform(corners, dst.astype(np.float32))
+    gray = sheet if sheet.ndim == 2 else cv2.cvtColor(sheet, cv2.COLOR_BGR2GRAY)
+    frame = cv2.warpPerspective(gray, M, (int(out_w), int(out_h)), flags=cv2.INTER_AREA, borderValue=background)
+    frame = frame.astype(np.float32)
+
+    if shadow:
+        # Linear light falloff in a random direction
+        direction = rng.uniform(0, 2 * np.pi)
+        ys, xs = np.mgrid[0:frame.shape[0], 0:frame.shape[1]].astype(np.float32)
+        ramp = xs * np.cos(direction) + ys * np.sin(direction)
+        ramp = (ramp - ramp.min()) / max(float(np.ptp(ramp)), 1.0)
+        frame *= 1.0 - shadow * ramp
+    if blur:
+        frame = cv2.GaussianBlur(frame, (0, 0), blur)
+    if noise:
+        frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+    frame = cv2.cvtColor(np.clip(frame, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+    if jpeg_quality is not None:
+        frame = cv2.imdecode(np.frombuffer(encode_jpeg(frame, jpeg_quality), np.uint8), cv2.IMREAD_COLOR)
+    return frame
+
+def encode_jpeg(image, quality=90):
+    """
+    JPEG bytes of an image, as a phone upload would arrive.
+    """
+    ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("Could not encode image")
+    return buf.tobytes()
@@ -0,0 +1,158 @@
+import contextlib
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+class StageProfiler:
+    """
+    Opt-in instrumentation for process_exam: records wall time (and, with track_memory, the peak
+    bytes allocated through tracemalloc) per named stage, plus free-form notes such as the marker
+    strategy that succeeded. Stages nest: stage("otsu") inside stage("markers") is "markers.otsu".
+    on_stage(name, seconds, peak_bytes) is called as each stage ends, for live hooks.
+    One profiler instruments one process_exam call at a time; process_exam resets it.
+    """
+    def __init__(self, track_memory=False, on_stage=None):
+        self.track_memory = track_memory
+        self.on_stage = on_stage
+        self._started_tracing = False
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.notes = {}
+        self._stack = []
+        self._start = time.perf_counter()
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self._stack:
+            name = f"{self._stack[-1][0]}.{name}"
+        tracing = self.track_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        # [name, start memory, highest memory seen]
+        entry = [name, current, current]
+        self._stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            peak_bytes = None
+            if tracing:
+                entry[2] = max(entry[2], tracemalloc.get_traced_memory()[1])
+                peak_bytes = entry[2] - entry[1]
+                if self._stack:
+                    self._stack[-1][2] = max(self._stack[-1][2], entry[2])
+            # A stage entered twice (e.g. per page) accumulates
+            record = self.stages.setdefault(name, {"ms": 0.0, "bytes": None})
+            record["ms"] += elapsed * 1000
+            if peak_bytes is not None:
+                record["bytes"] = max(record["bytes"] or 0, peak_bytes)
+            if self.on_stage is not None:
+                self.on_stage(name, elapsed, peak_bytes)
+
+    def note(self, key, value):
+        self.notes[key] = value
+
+    def report(self):
+        """
+        Plain-dict summary for the result: {"stages": {name: {"ms", "bytes"}}, "notes", "total_ms"}.
+        Stops tracemalloc if this profiler started it.
+        """
+        report = {
+            "stages": {name: {"ms": round(r["ms"], 3), "bytes": r["bytes"]} for name, r in self.stages.items()},
+            "notes": dict(self.notes),
+            "total_ms": round((time.perf_counter() - self._start) * 1000, 3)
+        }
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return report
+
+class _NullProfiler:
+    """
+    Stand-in when profiling is off: stages cost one no-op context manager.
+    """
+    _null = contextlib.nullcontext()
+
+    def reset(self):
+        pass
+
+    def stage(self, name):
+        return self._null
+
+    def note(self, key, value):
+        pass
+
+    def report(self):
+        return None
+
+NULL_PROFILER = _NullProfiler()
+
+class ProfileStats:
+    """
+    Aggregates process_exam profiles across a session or batch: p50/p95 per stage and how often
+    each note value (e.g. marker strategy) occurred. Safe to share between threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._times = {}
+        self._bytes = {}
+        self._notes = {}
+        self.count = 0
+
+    def add(self, report):
+        if not report:
+            return
+        with self._lock:
+            self.count += 1
+            self._times.setdefault("total", []).append(report["total_ms"])
+            for name, r in report["stages"].items():
+                self._times.setdefault(name, []).append(r["ms"])
+                if r["bytes"] is not None:
+                    self._bytes.setdefault(name, []).append(r["bytes"])
+            for key, value in report["notes"].items():
+                counts = self._notes.setdefault(key, {})
+                counts[value] = counts.get(value, 0) + 1
+
+    def summary(self):
+        """
+        {"stages": {name: {"count", "p50_ms", "p95_ms", "max_ms", "p95_kb"}}, "notes": {key: {value: count}}}
+        """
+        with self._lock:
+            stages = {}
+            for name, times in self._times.items():
+                p50, p95 = np.percentile(times, [50, 95])
+                mem = self._bytes.get(name)
+                stages[name] = {
+                    "count": len(times),
+                    "p50_ms": round(float(p50), 3),
+                    "p95_ms": round(float(p95), 3),
+                    "max_ms": round(float(max(times)), 3),
+                    "p95_kb": round(float(np.percentile(mem, 95)) / 1024, 1) if mem else None
+                }
+            return {"stages": stages, "notes": {k: dict(v) for k, v in self._notes.items()}}
+
+def format_summary(summary):
+    """
+    Text table of ProfileStats.summary(), slowest stages first.
+    """
+    lines = [f"{'stage':<24} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'p95 KB':>9}"]
+    for name, s in sorted(summary["stages"].items(), key=lambda item: -item[1]["p50_ms"]):
+        kb = f"{s['p95_kb']:9.1f}" if s["p95_kb"] is not None else f"{'-':>9}"
+        lines.append(f"{name:<24} {s['count']:>5} {s['p50_ms']:9.2f} {s['p95_ms']:9.2f} {s['max_ms']:9.2f} {kb}")
+    for key, counts in summary["notes"].items():
+        lines.append(f"{key}: " + ", ".join(f"{value} x{n}" for value, n in sorted(counts.items(), key=lambda kv: -kv[1])))
+    return "\n".join(lines)
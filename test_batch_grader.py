@@ -0,0 +1,52 @@
+import os
+
+import batch_grader
+import sheet_layout
+from sheet_renderer import encode_jpeg, render_sheet
+
+LAYOUT = sheet_layout.get_layout(10, 4)
+KEY = {str(q): {"ans": "ABCD"[q % 4], "type": "MCQ"} for q in LAYOUT.questions}
+
+def context():
+    return {"exam_id": 3, "master_id": 3, "exam_name": "Quiz", "class_id": 1, "answer_key": KEY, "mcq_choices": 4,
+            "num_questions": 10, "versions": [], "students": {100 + i: (i + 1, f"student {i}", f"E{i}") for i in range(4)}}
+
+def write_sheets(folder, omr_ids):
+    paths = []
+    for oid in omr_ids:
+        path = os.path.join(folder, f"sheet_{oid}.jpg")
+        with open(path, "wb") as f:
+            f.write(encode_jpeg(render_sheet(LAYOUT, omr_id=oid, answers={q: q % 4 for q in LAYOUT.questions})))
+        paths.append(path)
+    return paths
+
+def test_collect_images_from_folders_and_globs(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("b.jpg", "a.PNG", "notes.txt", "sub/c.jpeg"):
+        (tmp_path / name).write_bytes(b"x")
+    folder = batch_grader.collect_images(str(tmp_path))
+    assert folder == [str(tmp_path / "a.PNG"), str(tmp_path / "b.jpg")]
+    # Overlapping sources are listed once
+    assert batch_grader.collect_images([str(tmp_path / "**" / "*"), str(tmp_path)]) == \
+        sorted(folder + [str(tmp_path / "sub" / "c.jpeg")])
+
+def test_pool_results_match_their_scans_and_failures_stay_per_sheet(tmp_path):
+    paths = write_sheets(str(tmp_path), (100, 101, 102, 199))
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    results = list(batch_grader.iter_processed_sheets(paths + [str(broken)], context(), workers=2))
+
+    # Completion order is the pool's; every result still names the scan it was read from
+    by_path = {r["path"]: r for r in results}
+    assert sorted(by_path) == sorted(paths + [str(broken)])
+    assert [by_path[p]["omr_id"] for p in paths] == [100, 101, 102, 199]
+    assert not by_path[str(broken)]["success"]
+
+    sheets = {r["path"]: batch_grader.grade_sheet(r, context()) for r in results}
+    assert [sheets[p]["row"]["student_id"] for p in paths[:3]] == [1, 2, 3]
+    assert all(sheets[p]["score"] == 10 for p in paths[:3])
+    assert sheets[paths[3]]["row"] is None and "199" in sheets[paths[3]]["error"]
+    assert sheets[str(broken)]["row"] is None and sheets[str(broken)]["error"]
+
+def test_sheets_without_a_stored_exam_need_no_key_lookup():
+    assert batch_grader.lookup_answer_key(None) is None
@@ -0,0 +1,131 @@
+import db_manager
+
+def test_roster_conflicts_against_class_and_file():
+    existing = [("Ada", "E1", 0), ("Bob", "E2", 1)]
+    rows = [
+        {"name": "Cy", "educational_id": "E3", "omr_id": None},
+        {"name": "Ada again", "educational_id": "E1", "omr_id": None},
+        {"name": "Dee", "educational_id": "E4", "omr_id": 1},
+        {"name": "Eve", "educational_id": "E3", "omr_id": 7},
+        {"name": "Fay", "educational_id": "E5", "omr_id": 7},
+    ]
+    conflicts = db_manager.roster_conflicts(existing, rows)
+    # Eve is rejected, so her OMR ID 7 stays free for Fay
+    assert [(c["row"], c["field"], c["value"]) for c in conflicts] == [
+        (1, "educational_id", "E1"), (2, "omr_id", 1), (3, "educational_id", "E3")]
+    assert conflicts[0]["reason"] == "already used by Ada" and conflicts[2]["reason"] == "repeats row 1"
+
+def test_omr_id_swaps_pass_and_clashes_cascade():
+    students = [(1, "Ada", 10), (2, "Bob", 11), (3, "Cy", 12), (4, "Dee", None)]
+    assert db_manager.omr_id_conflicts(students, {1: 11, 2: 10, 4: 13}) == []
+
+    # Dee cannot take Cy's ID; Ada can still take the one Bob frees
+    conflicts = db_manager.omr_id_conflicts(students, {4: 12, 2: 13, 1: 11})
+    assert [(c["student_id"], c["omr_id"]) for c in conflicts] == [(4, 12)]
+    # Cy cannot take Bob's ID, so Ada cannot take the one Cy would have freed
+    conflicts = db_manager.omr_id_conflicts(students, {3: 11, 1: 12})
+    assert {c["student_id"] for c in conflicts} == {3, 1}
+    assert "Bob" in next(c["reason"] for c in conflicts if c["student_id"] == 3)
+
+class FakeSession:
+    """
+    Records each statement and its params; execute answers with the next of results.
+    """
+    def __init__(self, results=()):
+        self.statements = []
+        self.results = list(results)
+        self.commits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.statements.append((str(sql), params or {}))
+        return FakeResult(self.results.pop(0) if self.results else [])
+
+    def commit(self):
+        self.commits += 1
+
+class FakeResult(list):
+    def fetchall(self):
+        return list(self)
+
+class FakeConnection:
+    def __init__(self, results=()):
+        self.session = FakeSession(results)
+
+def _result_row(exam_id, student_id, score):
+    return {"exam_id": exam_id, "student_id": student_id, "total_score": score, "mcq_score": score,
+            "numeric_score": 0.0, "answers": {}, "image_path": None}
+
+def test_save_results_chunks_rows_in_one_transaction(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(db_manager, "get_connection", lambda: conn)
+    assert db_manager.save_results(_result_row(1, sid, 5.0) for sid in range(1200)) == 1200
+
+    statements = conn.session.statements
+    assert [len(params) // 10 for _, params in statements] == [500, 500, 200]
+    assert all("ON CONFLICT (exam_id, student_id) DO UPDATE" in sql for sql, _ in statements)
+    assert statements[1][1]["sid0"] == 500 and statements[2][1]["sid199"] == 1199
+    assert conn.session.commits == 1
+
+def test_save_results_last_row_wins(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(db_manager, "get_connection", lambda: conn)
+    rows = [_result_row(1, 7, 2.0), _result_row(1, 8, 3.0), _result_row(1, 7, 9.0), _result_row(2, 7, 4.0)]
+    assert db_manager.save_results(rows) == 3
+
+    (sql, params), = conn.session.statements
+    assert sql.count("(:eid") == 3
+    saved = {(params[f"eid{j}"], params[f"sid{j}"]): params[f"score{j}"] for j in range(3)}
+    assert saved == {(1, 7): 9.0, (1, 8): 3.0, (2, 7): 4.0}
+
+    # Across chunks the upsert order keeps the later row
+    conn = FakeConnection()
+    assert db_manager.save_results(rows, chunk_size=2) == 4
+    first, second = (params for _, params in conn.session.statements)
+    assert (first["sid0"], first["score0"]) == (7, 2.0) and (second["sid0"], second["score0"]) == (7, 9.0)
+
+def test_save_results_without_rows_skips_the_database(monkeypatch):
+    monkeypatch.setattr(db_manager, "get_connection", lambda: 1 / 0)
+    assert db_manager.save_results([]) == 0
+    assert db_manager.save_results(iter(())) == 0
+
+def test_load_classes_counts_and_groups_students(monkeypatch):
+    conn = FakeConnection([
+        [(1, "9A", 2), (2, "9B", 0)],
+        [(1, 10, "Ada", "E1", 3), (1, 11, "Bob", "E2", None), (5, 12, "Gone", "E3", 4)],
+    ])
+    monkeypatch.setattr(db_manager, "get_connection", lambda: conn)
+    classes = db_manager.load_classes(with_students=True)
+    assert [(c["id"], c["name"], c["student_count"]) for c in classes] == [(1, "9A", 2), (2, "9B", 0)]
+    # Students of a class that is not listed are left out
+    assert classes[0]["students"] == [(10, "Ada", "E1", 3), (11, "Bob", "E2", None)] and classes[1]["students"] == []
+
+    conn = FakeConnection([[(1, "9A", 2)]])
+    assert db_manager.load_classes() == [{"id": 1, "name": "9A", "student_count": 2}] and len(conn.session.statements) == 1
+
+def test_load_class_exams_groups_versions_under_masters(monkeypatch):
+    key = '{"1": {"ans": "A", "type": "MCQ"}}'
+    conn = FakeConnection([[
+        (1, "Midterm", "2026-03-01", key, 4, None),
+        (2, "Quiz", "2026-03-08", None, None, None),
+        (3, "Midterm v2", "2026-03-01", key, 4, 1),
+        (4, "Midterm v1", "2026-03-01", key, 4, 1),
+        (5, "Final v1", "2026-06-01", key, 4, 99),
+        (6, "Midterm v2 copy", "2026-03-01", key, 4, 3),
+    ]])
+    monkeypatch.setattr(db_manager, "get_connection", lambda: conn)
+    loaded = db_manager.load_class_exams.uncached(7)
+    assert conn.session.statements[0][1] == {"cid": 7}
+
+    exams = {e["id"]: e for e in loaded["exams"]}
+    assert list(exams) == [1, 2]
+    assert [v["name"] for v in exams[1]["versions"]] == ["Midterm v1", "Midterm v2"] and exams[2]["versions"] == []
+    assert exams[1]["answer_key"] == {"1": {"ans": "A", "type": "MCQ"}} and exams[1]["mcq_choices"] == 4
+    assert exams[2]["answer_key"] == {} and exams[2]["mcq_choices"] == 5
+    # A missing master, or a version hung under another version, is orphaned
+    assert [e["id"] for e in loaded["orphaned"]] == [5, 6]
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+import live_scanner
+import sheet_layout
+from sheet_renderer import render_sheet
+
+def place(sheet, offset, frame_size=(1280, 960)):
+    """
+    Puts the sheet on a darker desk at a small perspective offset.
+    """
+    h, w = sheet.shape
+    fh, fw = frame_size
+    src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    dst = np.float32([[100, 80], [fw * 0.9, 60], [fw * 0.92, fh - 60], [80, fh - 90]]) + offset
+    M = cv2.getPerspectiveTransform(src, dst.astype(np.float32))
+    frame = cv2.warpPerspective(sheet, M, (fw, fh), borderValue=90)
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+def write_video(path, frames):
+    h, w = frames[0].shape[:2]
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 10, (w, h))
+    for f in frames:
+        writer.write(f)
+    writer.release()
+
+def test_grades_each_sheet_once_from_recorded_video(tmp_path):
+    layout = sheet_layout.get_layout(10, 4)
+    empty = np.full((1280, 960, 3), 90, np.uint8)
+    answers_a = {q: q % 4 for q in range(1, 11)}
+    answers_b = {q: (q + 1) % 4 for q in range(1, 11)}
+    sheet_a = render_sheet(layout, 17, answers=answers_a)
+    sheet_b = render_sheet(layout, 305, answers=answers_b)
+
+    frames = [empty] * 3
+    # Sheet A slides into place, then rests
+    frames += [place(sheet_a, (40 - 20 * i, 0)) for i in range(3)]
+    frames += [place(sheet_a, (0, 0))] * 8
+    frames += [empty] * 3
+    frames += [place(sheet_b, (0, 0))] * 8
+    video = tmp_path / "scan.avi"
+    write_video(video, frames)
+
+    scanner = live_scanner.LiveScanner(num_questions=10, mcq_choices=4, stable_frames=4)
+    results = list(scanner.run(str(video)))
+
+    assert [r["omr_id"] for r in results] == [17, 305]
+    assert results[0]["answers"] == answers_a
+    assert results[1]["answers"] == answers_b
+    assert scanner.results.qsize() == 2
+
+def test_unstable_corners_do_not_trigger_capture():
+    layout = sheet_layout.get_layout(10, 4)
+    sheet = render_sheet(layout, 42)
+    scanner = live_scanner.LiveScanner(num_questions=10, mcq_choices=4, stable_frames=3)
+    for i in range(6):
+        assert scanner.feed(place(sheet, (60 * (i % 2), 0))) is None
+
+def test_parse_source():
+    assert live_scanner.parse_source("0") == 0
+    assert live_scanner.parse_source(" scan.mp4 ") == "scan.mp4"
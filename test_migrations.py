@@ -0,0 +1,60 @@
+import logging
+
+import migrations
+
+def test_migrations_are_ordered_and_pending_from_any_version():
+    versions = [m[0] for m in migrations.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1)) and migrations.LATEST_VERSION == versions[-1]
+    assert [m[0] for m in migrations.pending(0)] == versions
+    assert [m[0] for m in migrations.pending(2)] == versions[2:]
+    assert migrations.pending(migrations.LATEST_VERSION) == []
+    # Sessions no longer run DDL: every CREATE/ALTER lives in a migration
+    assert all(s.lstrip().split()[0] in ("CREATE", "ALTER", "DELETE") for m in migrations.MIGRATIONS for s in m[2])
+
+class FakeResult:
+    def __init__(self, value=None, rowcount=-1):
+        self.value, self.rowcount = value, rowcount
+
+    def scalar(self):
+        return self.value
+
+class FakeSession:
+    """
+    A database at schema version 2 holding three older duplicate results.
+    """
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        sql = str(sql)
+        self.statements.append(sql)
+        if "to_regclass" in sql:
+            return FakeResult("schema_version")
+        if "MAX(version)" in sql:
+            return FakeResult(2)
+        return FakeResult(rowcount=3 if sql.lstrip().startswith("DELETE") else -1)
+
+    def commit(self):
+        pass
+
+class FakeConnection:
+    def __init__(self):
+        self.session = FakeSession()
+
+def test_duplicate_results_are_archived_and_counted(caplog):
+    conn = FakeConnection()
+    with caplog.at_level(logging.WARNING, logger="migrations"):
+        applied = migrations.migrate(conn)
+    assert [v for v, _ in applied] == list(range(3, migrations.LATEST_VERSION + 1))
+
+    statements = [s.lstrip() for s in conn.session.statements]
+    archive = next(i for i, s in enumerate(statements) if "results_duplicates" in s)
+    delete = next(i for i, s in enumerate(statements) if s.startswith("DELETE FROM results"))
+    assert archive < delete
+    assert [r.getMessage() for r in caplog.records] == ["Migration 3 (One result per student and exam) removed 3 rows"]
@@ -0,0 +1,53 @@
+import cv2
+
+import batch_grader
+import omr_engine
+import sheet_layout
+from sheet_renderer import render_sheet
+
+def page_result(page, num_pages=3, omr_id=7, answers=None, path=None):
+    return {
+        "success": True, "preview_image": None, "omr_id": omr_id, "version_idx": 0, "exam_id": 5,
+        "header": None, "page": page, "num_pages": num_pages, "answers": answers or {},
+        "marks": {}, "confidence": 0.9, "needs_review": False, "path": path
+    }
+
+def test_pagination_keeps_single_page_layouts():
+    assert sheet_layout.page_count(45) == 1
+    assert sheet_layout.page_count(150) == 4
+    last = sheet_layout.get_layout(150, 4, (), 3)
+    assert list(last.questions) == list(range(136, 151))
+    # Every page of a long exam uses the same grid as a full single-page sheet
+    middle = sheet_layout.get_layout(150, 4, (), 1)
+    assert (middle.answer_centers == sheet_layout.get_layout(45, 4).answer_centers).all()
+    assert middle.mcq_questions[0] == 46
+
+def test_reads_answers_of_a_later_page():
+    layout = sheet_layout.get_layout(100, 4, (), 1)
+    answers = {q: q % 4 for q in layout.questions}
+    img = render_sheet(layout, 42, answers=answers, exam_id=9)
+    frame = cv2.copyMakeBorder(img, 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=90)
+
+    result = omr_engine.process_exam(frame, preview=False)
+
+    assert (result["page"], result["num_pages"]) == (1, 3)
+    assert result["answers"] == answers
+    assert result["omr_id"] == 42
+
+def test_merge_page_results():
+    merged = omr_engine.merge_page_results([page_result(1, answers={50: 2}), page_result(0, answers={1: 0}), page_result(2)])
+    assert merged["answers"] == {1: 0, 50: 2}
+    assert merged["pages"] == [0, 1, 2] and not merged["needs_review"]
+
+    incomplete = omr_engine.merge_page_results([page_result(0), page_result(2, omr_id=8)])
+    assert incomplete["missing_pages"] == [1]
+    assert incomplete["omr_id"] is None and incomplete["needs_review"]
+
+def test_group_pages_pairs_by_order_and_page_index():
+    results = [page_result(0, path="a1"), page_result(1, path="a2"), page_result(2, path="a3"),
+               page_result(0, path="b1"), page_result(2, path="b3"),
+               {"success": False, "error": "Could not find corner squares.", "path": "x"},
+               page_result(0, path="c1")]
+    sheets = list(batch_grader.group_pages(results))
+    assert [s.get("paths", [s["path"]]) for s in sheets] == [["a1", "a2", "a3"], ["b1", "b3"], ["x"], ["c1"]]
+    assert sheets[1]["missing_pages"] == [1]
@@ -0,0 +1,59 @@
+import batch_grader
+import gift_parser
+import omr_engine
+import scoring
+import sheet_layout
+from sheet_renderer import render_sheet
+
+def test_mcq_only_layout_is_unchanged():
+    layout = sheet_layout.get_layout(30, 5)
+    assert layout.num_cols == 3 and layout.rows_per_col == 10
+    assert layout.question_origin(11) == (layout.question_origin(1)[0] + layout.col_width, sheet_layout.ANSWER_START_Y)
+    assert sheet_layout.paginate(100) == ((1, 45), (46, 90), (91, 100))
+
+def test_numeric_blocks_take_several_rows():
+    numeric = (2, 5)
+    layout = sheet_layout.get_layout(6, 4, numeric)
+    rows = 4 + 2 * sheet_layout.NUMERIC_SLOTS
+    assert layout.rows_per_col == rows and layout.num_cols == 1
+    assert layout.question_origin(3)[1] == layout.question_origin(2)[1] + sheet_layout.NUMERIC_SLOTS * sheet_layout.ROW_HEIGHT
+    assert layout.mcq_questions == (1, 3, 4, 6) and layout.numeric_page_questions == numeric
+    # Every page still fits MAX_ROWS rows and no block is split across columns
+    all_numeric = tuple(range(1, 41, 2))
+    for page in range(sheet_layout.page_count(40, all_numeric)):
+        assert sheet_layout.get_layout(40, 5, all_numeric, page).rows_per_col <= sheet_layout.MAX_ROWS
+
+def test_reads_and_grades_numeric_grids():
+    key = {"1": {"ans": "B", "type": "MCQ"},
+           "2": {"ans": 3.14, "type": "Numeric", "tol": 0.0},
+           "3": {"ans": -42.0, "type": "Numeric", "tol": 0.0},
+           "4": {"ans": 10.0, "type": "Numeric", "tol": 0.5},
+           "5": {"ans": 7.0, "type": "Numeric", "tol": 0.0}}
+    layout = sheet_layout.layout_for(5, 4, key)
+    img = render_sheet(layout, 12, answers={1: 1}, numeric={2: 3.14, 3: -42, 4: 10.4})
+
+    result = omr_engine.process_exam(img, 5, 4, question_data=key, preview=False)
+    assert result["answers"] == {1: 1}
+    assert result["numeric_answers"] == {2: 3.14, 3: -42.0, 4: 10.4}
+    assert result["marks"][5]["status"] == "blank"
+    assert not result["needs_review"]
+
+    score, total, details = batch_grader.grade_answers(result["answers"], key, result["marks"], result["numeric_answers"])
+    assert (score, total) == (4, 5)
+    assert details[4]["student"] == "10.4" and details[4]["is_correct"]
+    assert details[5]["student"] == "N/A" and not details[5]["is_correct"]
+
+def test_decode_numeric_flags_double_digits():
+    paper, ink = 230.0, 40.0
+    digits = [[[paper] * 10 for _ in range(sheet_layout.NUMERIC_DIGITS)]]
+    digits[0][0][5] = ink
+    digits[0][1][2] = digits[0][1][7] = ink
+    read = omr_engine.decode_numeric([paper], [[paper] * 3], digits)[0]
+    assert read["status"] == "multiple" and read["value"] is None
+
+def test_gift_tolerance_is_kept():
+    questions = gift_parser.parse_gift("Pi? {#3.14:0.01}\n\nAnswer? {#42}")
+    assert (questions[0]["ans"], questions[0]["tol"]) == (3.14, 0.01)
+    assert (questions[1]["ans"], questions[1]["tol"]) == (42.0, 0.0)
+    assert scoring.numeric_correct(3.149, questions[0])
+    assert not scoring.numeric_correct(3.16, questions[0])
@@ -0,0 +1,175 @@
+import json
+
+import cv2
+import numpy as np
+
+import batch_grader
+import db_manager
+import omr_engine
+import sheet_layout
+import stage_profiler
+from sheet_renderer import photograph, render_sheet
+
+def test_classify_marks_statuses():
+    intensities = np.array([
+        [220, 40, 218, 221, 219],   # clean single mark
+        [220, 40, 218, 45, 219],    # two deliberate marks
+        [220, 40, 218, 130, 219],   # half-erased second mark
+        [220, 215, 218, 221, 219],  # nothing marked
+        [220, 150, 218, 221, 219],  # faint mark
+    ], dtype=np.float64)
+    min_idx, status, margin, confidence = omr_engine.classify_marks(intensities, 0.92)
+
+    assert list(status) == ["single", "multiple", "ambiguous", "blank", "ambiguous"]
+    assert list(min_idx[:3]) == [1, 1, 1]
+    assert confidence[0] > 0.9 and confidence[3] > 0.9
+    assert confidence[2] == 0.0 and confidence[4] == 0.0
+    assert margin[0] > 0.7 and margin[1] < 0.05
+
+def test_printed_letters_alone_read_as_blank():
+    # Empty bubbles on a printed sheet differ by their letters (here a dark "B")
+    _, status, _, confidence = omr_engine.classify_marks(np.array([[201.0, 179.8, 223.3, 223.6]]), 0.92)
+    assert status[0] == "blank" and confidence[0] == 1.0
+
+def test_classify_marks_single_column():
+    # Version column is classified as one row
+    _, status, _, _ = omr_engine.classify_marks(np.array([[200, 200, 30, 200, 200]]), 0.90)
+    assert status[0] == "single"
+
+def test_preview_is_an_encoded_thumbnail_on_request():
+    layout = sheet_layout.get_layout(10, 4)
+    img = render_sheet(layout, omr_id=3, answers={1: 0, 2: 3})
+    assert omr_engine.process_exam(img)["preview_image"] is None
+
+    for preview, magic in ((True, b"\xff\xd8"), ("webp", b"RIFF")):
+        for sampling in ("warp", "projected"):
+            result = omr_engine.process_exam(img, preview=preview, sampling=sampling)
+            data = result["preview_image"]
+            assert isinstance(data, bytes) and data.startswith(magic) and len(data) < 150_000
+            thumb = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            assert max(thumb.shape[:2]) <= omr_engine.PREVIEW_MAX_DIM
+
+    failed = omr_engine.process_exam(np.full((600, 400), 200, np.uint8), preview=True)
+    assert not failed["success"] and failed["debug_image"].startswith(b"\xff\xd8")
+
+def test_stored_intensities_redecide_without_images():
+    layout = sheet_layout.get_layout(12, 4, (5,))
+    key = {"5": {"ans": 0.0, "type": "Numeric"}}
+    sheets = [render_sheet(layout, omr_id=100 + i, version_idx=i % 5, answers={q: (q + i) % 4 for q in layout.mcq_questions},
+                           numeric={5: -2.5 - i}, partial={1: 0.5}) for i in range(3)]
+    results = [omr_engine.process_exam(img, 12, 4, question_data=key) for img in sheets]
+    blobs = [r["intensities"] for r in results]
+    assert all(isinstance(b, bytes) and len(b) < 400 for b in blobs)
+
+    stored = omr_engine.unpack_intensities(blobs[0])
+    assert stored["mcq_questions"] == list(layout.mcq_questions) and stored["numeric_questions"] == [5]
+    assert np.allclose(stored["answers"], [results[0]["marks"][q]["intensities"] for q in layout.mcq_questions], atol=0.5)
+
+    for r, d in zip(results, omr_engine.redecide(blobs)):
+        assert (d["omr_id"], d["version_idx"], d["answers"], d["numeric_answers"]) == \
+               (r["omr_id"], r["version_idx"], r["answers"], r["numeric_answers"])
+    # A stricter ratio drops the faint first answer on every sheet in one pass
+    strict = omr_engine.redecide(blobs, answer_ratio=0.6)
+    assert all(1 not in d["answers"] and 2 in d["answers"] for d in strict)
+
+    merged = omr_engine.unpack_intensities(omr_engine.merge_intensities(blobs[:2]))
+    assert len(merged["answers"]) == 2 * len(layout.mcq_questions) and merged["numeric_questions"] == [5, 5]
+
+def test_redecide_exam_rescores_stored_results(monkeypatch):
+    layout = sheet_layout.get_layout(12, 4)
+    key = {str(q): {"ans": "ABCD"[(q + 1) % 4], "type": "MCQ"} for q in layout.questions}
+    results = [omr_engine.process_exam(render_sheet(layout, omr_id=100 + i, answers={q: (q + 1) % 4 for q in layout.questions},
+                                                    partial={1: 0.5}), 12, 4) for i in range(3)]
+    # Saved by a stricter classifier that missed the faint answer to question 1
+    rows = []
+    for i, d in enumerate(omr_engine.redecide([r["intensities"] for r in results], answer_ratio=0.6)):
+        score, _, details = batch_grader.grade_answers(d["answers"], key, d["marks"], d["numeric_answers"])
+        rows.append((i + 1, 7, f"student {i}", score, json.dumps(details), json.dumps(key), 0.0))
+    written = []
+    monkeypatch.setattr(db_manager, "get_results_for_regrade", lambda exam_id: rows)
+    monkeypatch.setattr(db_manager, "get_result_intensities", lambda exam_id: [(i + 1, 7, r["intensities"]) for i, r in enumerate(results)])
+    monkeypatch.setattr(db_manager, "update_result_scores", written.extend)
+
+    assert [(c["old"], c["new"]) for c in batch_grader.redecide_exam(7, save=False)] == [(11.0, 12.0)] * 3 and not written
+    batch_grader.redecide_exam(7)
+    assert [u["total_score"] for u in written] == [12.0] * 3 and written[0]["answers"][1]["student"] == "C"
+    # The same ratio as when saved changes nothing
+    assert batch_grader.redecide_exam(7, save=False, answer_ratio=0.6) == []
+
+def _marker_centers(layout, px_per_mm=4):
+    c = sheet_layout.MARGIN + sheet_layout.MARKER_SIZE / 2
+    right = sheet_layout.PAGE_WIDTH - c
+    bottom = layout.bottom_y + sheet_layout.MARKER_SIZE / 2
+    return np.array([[c, c], [right, c], [right, bottom], [c, bottom]]) * px_per_mm
+
+def test_marker_quad_ignores_look_alike_squares():
+    corners = [(1600, [80, 80]), (1600, [760, 80]), (1600, [760, 1100]), (1600, [80, 1100])]
+    # Sheet code squares and filled bubbles near the top left are square and similar in size
+    look_alikes = [(830, [140 + 40 * i, 200]) for i in range(4)] + [(700, [400, 600])]
+    quad = omr_engine.select_marker_quad(look_alikes + corners)
+    assert sorted(c[1] for c in quad) == sorted(c[1] for c in corners)
+    assert omr_engine.select_marker_quad(look_alikes) is None
+
+def test_coarse_markers_are_refined_at_full_resolution():
+    layout = sheet_layout.get_layout(10, 4)
+    img = render_sheet(layout, omr_id=3, answers={1: 0}, exam_id=42)
+    expected = _marker_centers(layout)
+    corners = omr_engine.find_markers_coarse_to_fine(img)
+    assert np.abs(corners - expected).max() < 2
+    # Even from a very small coarse copy, the refined corners land on the markers
+    coarse = omr_engine.find_markers_coarse_to_fine(img, coarse_max_dim=200)
+    assert np.abs(coarse - expected).max() < 2
+
+def test_markers_fall_back_to_exhaustive_search(monkeypatch):
+    layout = sheet_layout.get_layout(10, 4)
+    img = render_sheet(layout, omr_id=3, answers={1: 0, 2: 3}, exam_id=42)
+    profiler = stage_profiler.StageProfiler()
+    monkeypatch.setattr(omr_engine, "find_markers_coarse_to_fine", lambda image, **kw: None)
+    result = omr_engine.process_exam(img, 10, 4, profiler=profiler)
+    assert result["success"] and result["omr_id"] == 3 and result["answers"][1] == 0 and result["answers"][2] == 3
+    assert result["profile"]["notes"]["marker_strategy"].startswith("exhaustive.")
+    assert "markers.exhaustive" in result["profile"]["stages"]
+
+def test_vectorized_sampling_matches_per_bubble_sampling():
+    layout = sheet_layout.get_layout(30, 5, (7, 12))
+    answers = {q: q % 5 for q in layout.mcq_questions}
+    img = render_sheet(layout, omr_id=321, version_idx=2, answers=answers, numeric={7: 3.25, 12: -41.0}, partial={3: 0.5})
+    gray = omr_engine.to_gray(photograph(img, angle=4, perspective=0.04, blur=1.0, noise=3, jpeg_quality=90, seed=2))
+    corners = omr_engine.find_markers_coarse_to_fine(gray)
+    M = cv2.getPerspectiveTransform(corners.astype("float32"), layout.dst_corners)
+    warped = cv2.warpPerspective(gray, M, layout.warp_size)
+    w, h = layout.warp_size
+    # Radii as process_exam uses them, plus centers within search_r of every edge, where both clip
+    edges = [[0, 0], [2, h - 1], [w - 1, 3], [w - 3, h - 2], [w // 2, 1], [4, h // 2], [w - 1, h - 1]]
+    for centers, search_r, sample_r in ((layout.id_centers, 5, 5), (layout.version_centers, 5, 5),
+                                        (layout.answer_centers, 5, 6), (layout.numeric_digit_centers, 1, 7),
+                                        (edges, 6, 5), (edges, 1, 7)):
+        got, found = omr_engine.sample_bubbles(warped, centers, search_r, sample_r)
+        for i, (x, y) in enumerate(np.asarray(centers, dtype=int).reshape(-1, 2)):
+            expected, expected_found = omr_engine.sample_bubble_hybrid(warped, x, y, search_r, sample_r)
+            assert np.isclose(got[i], expected) and tuple(found[i]) == expected_found
+
+def test_projected_sampling_matches_the_warp():
+    layout = sheet_layout.get_layout(30, 5, (7, 12))
+    answers = {q: q % 5 for q in layout.mcq_questions}
+    img = render_sheet(layout, omr_id=321, version_idx=2, answers=answers, numeric={7: 3.25, 12: -41.0}, partial={3: 0.5})
+    gray = omr_engine.to_gray(photograph(img, angle=6, perspective=0.05, blur=1.0, noise=3, jpeg_quality=90, seed=4))
+    corners = omr_engine.find_markers_coarse_to_fine(gray)
+    M = cv2.getPerspectiveTransform(corners.astype("float32"), layout.dst_corners)
+    warped = cv2.warpPerspective(gray, M, layout.warp_size)
+    w, h = layout.warp_size
+    # Radii as process_exam uses them, plus points whose windows cross the warp's edges
+    for centers, search_r, sample_r in ((layout.id_centers, 5, 5), (layout.version_centers, 5, 5),
+                                        (layout.answer_centers, 5, 6), (layout.numeric_digit_centers, 1, 7),
+                                        ([[0, 0], [3, 5], [w - 1, h - 2], [w - 4, 10]], 6, 5)):
+        expected, expected_found = omr_engine.sample_bubbles(warped, centers, search_r, sample_r)
+        got, found = omr_engine.sample_bubbles_projected(gray, M, centers, layout.warp_size, search_r, sample_r)
+        # Both interpolate at 1/32 px, so single pixels can round one grey level apart
+        assert np.abs(got - expected).max() < 0.1 and np.array_equal(found, expected_found)
+
+    warp, projected = (omr_engine.process_exam(gray, 30, 5, question_data={"7": {"type": "Numeric"}, "12": {"type": "Numeric"}},
+                                               sampling=sampling) for sampling in ("warp", "projected"))
+    for key in ("omr_id", "version_idx", "answers", "numeric_answers", "needs_review"):
+        assert warp[key] == projected[key]
+    assert [m["status"] for m in warp["marks"].values()] == [m["status"] for m in projected["marks"].values()]
+    assert warp["answers"] == answers and warp["numeric_answers"] == {7: 3.25, 12: -41.0} and warp["marks"][3]["status"] == "ambiguous"
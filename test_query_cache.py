@@ -0,0 +1,47 @@
+import query_cache
+
+def test_reads_are_cached_until_a_write_to_their_table():
+    cache = query_cache.QueryCache(max_entries=3)
+    loads = []
+    @cache.cached("students")
+    def roster(class_id):
+        loads.append(class_id)
+        return [[class_id, "Ada"]]
+    @cache.cached("exams")
+    def exams(class_id):
+        loads.append(("exams", class_id))
+        return []
+
+    assert roster(1) == roster(1) == [[1, "Ada"]] and exams(1) == []
+    roster(1).append("changed by a caller")
+    assert roster(1) == [[1, "Ada"]] and loads == [1, ("exams", 1)]
+    cache.invalidate(["students"])
+    roster(1); exams(1)
+    assert loads == [1, ("exams", 1), 1]
+
+    # Least recently used goes first
+    cache.clear()
+    del loads[:]
+    roster(1); roster(2); roster(3); roster(1); roster(4)
+    assert len(cache) == 3 and loads == [1, 2, 3, 4]
+    roster(1); roster(2)
+    assert loads == [1, 2, 3, 4, 2]
+
+def test_read_racing_a_write_is_not_stored():
+    cache = query_cache.QueryCache()
+    generation = cache._generation
+    cache.invalidate(["classes"])
+    assert not cache.put(("classes", (), ()), ("classes",), [[1, "old"]], generation)
+    assert cache.get(("classes", (), ())) == (False, None)
+
+def test_other_processes_writes_arrive_through_versions():
+    versions = {"classes": 1, "exams": 1}
+    cache = query_cache.QueryCache(sync_interval=0, load_versions=lambda: dict(versions))
+    loads = []
+    classes = cache.cached("classes")(lambda: loads.append("classes") or ["A"])
+    exams = cache.cached("exams")(lambda: loads.append("exams") or [])
+    classes(); exams(); classes(); exams()
+    assert loads == ["classes", "exams"]
+    versions["exams"] += 1
+    classes(); exams()
+    assert loads == ["classes", "exams", "exams"]
@@ -0,0 +1,68 @@
+import os
+
+import cv2
+import numpy as np
+
+import omr_engine
+import scan_archive
+import sheet_layout
+from sheet_renderer import encode_jpeg, render_sheet
+
+def test_archive_deduplicates_by_content(tmp_path):
+    data = encode_jpeg(np.full((40, 30, 3), 200, np.uint8))
+    crop = np.full((300, 400), 220, np.uint8)
+    first = scan_archive.archive_scan(data, crop, root=tmp_path)
+    again = scan_archive.archive_scan(data, crop, root=tmp_path)
+
+    assert first == again
+    digest = first["sha256"]
+    assert first["original"] == f"originals/{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+    assert first["crop"].startswith(f"crops/{digest[:2]}/{digest[2:4]}/{digest}.")
+    assert scan_archive.load_scan(first["original"], tmp_path) == data
+    assert scan_archive.original_key(first["crop"], tmp_path) == first["original"]
+    assert sum(len(files) for _, _, files in os.walk(tmp_path)) == 2
+    assert scan_archive.is_archive_key(first["crop"]) and scan_archive.is_archive_key(first["original"])
+    # Results saved before the archive point at plain file names
+    assert not scan_archive.is_archive_key("scan.jpg") and not scan_archive.is_archive_key("/data/batch/crops.jpg")
+
+def test_archived_crop_rereads(tmp_path):
+    layout = sheet_layout.get_layout(20, 4)
+    answers = {q: q % 4 for q in layout.questions}
+    data = encode_jpeg(render_sheet(layout, omr_id=77, answers=answers))
+    for sampling in ("warp", "projected"):
+        result = omr_engine.process_exam(data, 20, 4, sampling=sampling, crop=True)
+        scan_archive.archive_result(result, data, tmp_path)
+        assert "answer_crop" not in result
+
+        crop = cv2.imdecode(np.frombuffer(scan_archive.load_scan(result["scan_key"], tmp_path), np.uint8), cv2.IMREAD_GRAYSCALE)
+        assert crop.shape[1] == int(layout.warp_size[0] * scan_archive.CROP_SCALE)
+        # The darkest bubble of the first answer row is the marked one
+        top = max(0, int(layout.id_centers[:, :, 1].min()) - omr_engine.CROP_PAD)
+        x, y = ((layout.answer_centers[0] - [0, top]) * scan_archive.CROP_SCALE).T
+        row = [crop[int(cy) - 3:int(cy) + 4, int(cx) - 3:int(cx) + 4].mean() for cx, cy in zip(x, y)]
+        assert int(np.argmin(row)) == answers[1]
+    assert scan_archive.split_keys(scan_archive.join_keys([result["scan_key"], None, "crops/x"])) == [result["scan_key"], "crops/x"]
+
+def test_unsaved_scans_are_staged_on_disk(tmp_path):
+    layout = sheet_layout.get_layout(10, 4)
+    data = encode_jpeg(render_sheet(layout, omr_id=5, answers={1: 2}))
+    staging, root = tmp_path / "staging", tmp_path / "archive"
+    result = scan_archive.stage_result(omr_engine.process_exam(data, 10, 4, crop=True), data, staging)
+    # Only file names stay with the result
+    assert "answer_crop" not in result and set(result["staged"]) == {"original", "crop"}
+    assert len(os.listdir(staging)) == 2
+
+    key = scan_archive.commit_staged(result["staged"], root, staging)
+    assert key.startswith("crops/") and os.listdir(staging) == []
+    assert scan_archive.load_scan(scan_archive.original_key(key, root), root) == data
+    assert scan_archive.commit_staged(result["staged"], root, staging) is None
+
+    discarded = scan_archive.stage_result(omr_engine.process_exam(data, 10, 4, crop=True), data, staging)
+    scan_archive.discard_staged(discarded["staged"], staging)
+    assert os.listdir(staging) == []
+    # Scans left behind are purged by age
+    scan_archive.stage_result(omr_engine.process_exam(data, 10, 4), data, staging)
+    scan_archive.purge_staged(staging, max_age=60)
+    assert len(os.listdir(staging)) == 1
+    scan_archive.purge_staged(staging, max_age=-1)
+    assert os.listdir(staging) == []
@@ -0,0 +1,67 @@
+import numpy as np
+
+import batch_grader
+import omr_engine
+import scan_dedup
+import sheet_layout
+from sheet_renderer import encode_jpeg, photograph, render_sheet
+
+def test_second_photo_of_a_sheet_is_a_duplicate():
+    layout = sheet_layout.get_layout(30, 5)
+    rng = np.random.default_rng(3)
+    sheets = [render_sheet(layout, omr_id=200 + i, version_idx=0, answers={q: int(rng.integers(0, 5)) for q in layout.questions})
+              for i in range(4)]
+    first = [omr_engine.process_exam(encode_jpeg(img), 30, 5) for img in sheets]
+    index = scan_dedup.DuplicateIndex((i + 1, r["scan_hash"], r["answer_hash"]) for i, r in enumerate(first))
+    assert len(index) == 4
+
+    for i, img in enumerate(sheets):
+        again = omr_engine.process_exam(photograph(img, angle=5, perspective=0.03, shadow=0.3, noise=5, jpeg_quality=70, seed=i),
+                                        30, 5)
+        assert omr_engine.hash_distance(again["scan_hash"], first[i]["scan_hash"]) <= omr_engine.SCAN_HASH_DISTANCE
+        assert index.find(again["scan_hash"], again["answer_hash"]) == (i + 1, "answers")
+        # A misread answer still matches on the marks
+        assert index.find(again["scan_hash"], None) == (i + 1, "scan")
+    for a in range(4):
+        for b in range(a):
+            assert omr_engine.hash_distance(first[a]["scan_hash"], first[b]["scan_hash"]) > 2 * omr_engine.SCAN_HASH_DISTANCE
+
+def test_band_lookup_finds_every_near_hash():
+    rng = np.random.default_rng(0)
+    stored = [int(h) for h in rng.integers(-2**63, 2**63 - 1, 500, dtype=np.int64)]
+    index = scan_dedup.DuplicateIndex((i, h, None) for i, h in enumerate(stored))
+    for i, h in enumerate(stored[:50]):
+        flips = rng.choice(64, omr_engine.SCAN_HASH_DISTANCE, replace=False)
+        near = (h & 0xFFFFFFFFFFFFFFFF) ^ sum(1 << int(b) for b in flips)
+        near = near - (1 << 64) if near >= 1 << 63 else near
+        assert index.find(near, None) == (i, "scan")
+    assert index.find(stored[0] ^ 0xFFFF, None) is None
+
+def test_same_answers_from_different_students_are_not_duplicates():
+    layout = sheet_layout.get_layout(20, 5)
+    answers = {q: q % 5 for q in layout.questions}
+    reads = {oid: omr_engine.process_exam(encode_jpeg(render_sheet(layout, omr_id=oid, version_idx=0, answers=answers)), 20, 5)
+             for oid in (12, 13, 112)}
+    index = scan_dedup.DuplicateIndex([(1, reads[12]["scan_hash"], reads[12]["answer_hash"], 12)])
+    for oid in (13, 112):
+        assert reads[oid]["omr_id"] == oid
+        assert index.find(reads[oid]["scan_hash"], reads[oid]["answer_hash"], oid) is None
+    # An unread ID still matches on the marks
+    assert index.find(reads[12]["scan_hash"], None, None) == (1, "scan")
+
+def test_batch_keeps_repeated_sheets_out_of_the_save():
+    index = scan_dedup.DuplicateIndex([(41, 123, 999, 7)])
+    def sheet(scan_hash, answer_hash, omr_id=7):
+        return {"row": {"scan_hash": scan_hash, "answer_hash": answer_hash}, "omr_id": omr_id,
+                "needs_review": False, "error": None}
+
+    stored = batch_grader.flag_duplicate(sheet(-5, 999), index, "a.jpg")
+    assert stored["row"] is None and stored["duplicate_of"] == 41 and "result 41" in stored["error"]
+    new = batch_grader.flag_duplicate(sheet(2**40 - 1, 7), index, "b.jpg")
+    assert new["row"] is not None and "duplicate_of" not in new
+    # Nearly the same marks: saved, but flagged for review
+    fed_twice = batch_grader.flag_duplicate(sheet(2**40 - 2, 8), index, "c.jpg")
+    assert fed_twice["row"] is not None and fed_twice["needs_review"]
+    assert fed_twice["duplicate_of"] == "b.jpg" and "same marks" in fed_twice["warning"]
+    other_student = batch_grader.flag_duplicate(sheet(2**40 - 4, 9, omr_id=8), index, "d.jpg")
+    assert "duplicate_of" not in other_student and not other_student["needs_review"]
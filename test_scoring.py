@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+
+import batch_grader
+import scoring
+
+KEY = {"1": "B",
+       "2": {"ans": "A", "type": "MCQ"},
+       "3": {"ans": "D", "type": "MCQ", "points": 2, "credit": {"C": 0.5}},
+       "4": {"ans": 3.14, "type": "Numeric", "tol": 0.01}}
+
+def test_grade_one_sheet():
+    marks = {2: {"status": "multiple"}}
+    score, total, details = batch_grader.grade_answers({1: 1, 3: 2}, KEY, marks, {4: 3.149})
+    assert (score, total) == (1 + 1 + 1, 5)
+    assert [details[q]["student"] for q in (1, 2, 3, 4)] == ["B", "Multi", "C", "3.149"]
+    assert [details[q]["is_correct"] for q in (1, 2, 3, 4)] == [True, False, False, True]
+    assert details[3]["points"] == 1.0 and details[3]["correct"] == "D"
+
+def test_score_answer_matrix_with_penalty():
+    key = scoring.compile_key(KEY, penalty=0.25)
+    sheets = [({1: 1, 2: 0, 3: 3}, {}, {4: 3.14}),  # all right
+              ({1: 0, 2: 0, 3: 0}, {}, {4: 3.2}),   # wrong answers lose a quarter of their points
+              ({}, {1: {"status": "multiple"}}, {})] # blank and double marks lose nothing
+    codes, values = key.encode(sheets)
+    assert codes.tolist()[2] == [scoring.MULTIPLE, scoring.BLANK, scoring.BLANK, scoring.BLANK]
+
+    earned, correct = key.score(codes, values)
+    assert earned.sum(axis=1).tolist() == [5.0, 1 - 0.25 - 0.5 - 0.25, 0.0]
+    assert correct[1].tolist() == [False, True, False, False]
+    mcq, numeric = key.split_score(earned)
+    assert mcq.tolist() == [4.0, 0.25, 0.0] and numeric.tolist() == [1.0, -0.25, 0.0]
+
+def test_compiled_key_is_cached_and_frozen():
+    key = scoring.compile_key(dict(KEY))
+    assert scoring.compile_key(dict(KEY)) is key
+    assert not key.credit.flags.writeable
+    # Single-sheet grading agrees with the matrix path
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, scoring.BLANK + 2, size=(50, 4)).astype(np.int8)
+    values = np.where(rng.random((50, 4)) < 0.5, 3.14, np.nan)
+    earned, _ = key.score(codes, values)
+    for s in range(50):
+        answers = {q: int(c) for q, c in zip(key.questions, codes[s]) if c < scoring.BLANK}
+        marks = {q: {"status": "multiple"} for q, c in zip(key.questions, codes[s]) if c == scoring.MULTIPLE}
+        numeric = {4: 3.14} if not np.isnan(values[s, 3]) else {}
+        assert key.grade(answers, marks, numeric)[0] == earned[s].sum()
+
+def test_rescore_stored_results_after_key_fix():
+    rng = np.random.default_rng(1)
+    old_key = {str(q): {"ans": "A", "type": "MCQ"} for q in range(1, 46)}
+    old_key["45"] = {"ans": 2.5, "type": "Numeric", "tol": 0.0}
+    rows = []
+    for i in range(500):
+        answers = {q: int(rng.integers(4)) for q in range(1, 45)}
+        score, _, details = batch_grader.grade_answers(answers, old_key, {}, {45: 2.55})
+        rows.append((i + 1, 7, f"student {i}", score, json.dumps(details)))
+    def regrade_rows(key):
+        return [r + (json.dumps(key), 0.0) for r in rows]
+
+    assert batch_grader.rescore_results(regrade_rows(old_key)) == ([], [])
+
+    new_key = dict(old_key, **{"1": {"ans": "B", "type": "MCQ"}, "45": {"ans": 2.5, "type": "Numeric", "tol": 0.1}})
+    updates, changes = batch_grader.rescore_results(regrade_rows(new_key))
+
+    assert len(updates) == 500
+    changed = {c["result_id"]: c["new"] - c["old"] for c in changes}
+    for result_id, _, _, _, answers_json in rows:
+        first = json.loads(answers_json)["1"]["student"]
+        delta = (first == "B") - (first == "A") + 1
+        assert changed.get(result_id, 0) == delta
+    assert updates[0]["numeric_score"] == 1.0 and updates[0]["answers"][45]["student"] == "2.55"
+
+def test_rescore_keeps_hand_graded_numeric_points():
+    key = {"1": {"ans": "A", "type": "MCQ"}, "2": {"ans": "B", "type": "MCQ"},
+           "3": {"ans": 2.5, "type": "Numeric", "tol": 0.0}}
+    # Saved before numeric grids were read: the teacher entered 1 point for question 3
+    legacy = {"1": {"student": "A", "correct": "A", "is_correct": True, "type": "MCQ"},
+              "2": {"student": "C", "correct": "B", "is_correct": False, "type": "MCQ"},
+              "3": {"student": "Num", "correct": 2.5, "is_correct": False, "type": "Numeric"}}
+    row = (1, 7, "Ada", 2.0, json.dumps(legacy))
+
+    updates, changes = batch_grader.rescore_results([row + (json.dumps(dict(key, **{"3": dict(key["3"], tol=0.1)})), 1.0)])
+    assert changes == [] and updates[0]["total_score"] == 2.0 and updates[0]["numeric_score"] == 1.0
+    assert updates[0]["answers"][3]["student"] == "Num"
+    # A key fix still re-scores the multiple-choice part
+    _, changes = batch_grader.rescore_results([row + (json.dumps(dict(key, **{"2": {"ans": "C", "type": "MCQ"}})), 1.0)])
+    assert changes[0]["new"] == 3.0
@@ -0,0 +1,132 @@
+import cv2
+
+import batch_grader
+import omr_engine
+import sheet_header
+import sheet_layout
+from sheet_renderer import PX_PER_MM, photograph, render_sheet
+
+def test_encode_decode_round_trip():
+    ids = sheet_header.encode_header(4711, 150, 4, page=2)
+    expected = {"exam_id": 4711, "num_questions": 150, "mcq_choices": 4, "page": 2}
+    assert len(set(ids)) == sheet_header.HEADER_MARKERS
+    assert sheet_header.decode_header(ids) == expected
+    assert sheet_header.decode_header(list(reversed(ids)) + [999]) == expected
+
+def test_sheet_without_exam_id():
+    header = sheet_header.decode_header(sheet_header.encode_header(None, 20, 5))
+    assert header == {"exam_id": None, "num_questions": 20, "mcq_choices": 5, "page": 0}
+
+def test_decode_rejects_incomplete_or_corrupt_codes():
+    ids = sheet_header.encode_header(4711, 45, 4)
+    assert sheet_header.decode_header(ids[:-1]) is None
+    corrupt = list(ids)
+    corrupt[0] = (corrupt[0] + 1) % sheet_header.SLOT_RANGE
+    assert sheet_header.decode_header(corrupt) is None
+
+def test_sheet_code_overrides_layout_arguments():
+    layout = sheet_layout.get_layout(12, 4)
+    answers = {q: q % 4 for q in range(1, 13)}
+    img = render_sheet(layout, 123, answers=answers, exam_id=77)
+    frame = cv2.copyMakeBorder(img, 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=90)
+
+    requested = []
+    def resolver(exam_id):
+        requested.append(exam_id)
+        return None
+    # Deliberately wrong layout arguments: the sheet code wins
+    result = omr_engine.process_exam(frame, num_questions=40, mcq_choices=5, preview=False, key_resolver=resolver)
+
+    assert result["exam_id"] == 77 and requested == [77]
+    assert result["header"]["num_questions"] == 12
+    assert result["omr_id"] == 123
+    assert result["answers"] == answers
+
+def test_sheet_code_picks_the_version_key():
+    context = {
+        "exam_id": 10, "exam_name": "Quiz (Master)", "answer_key": {},
+        "versions": [(11, "Quiz (Version A)", {"1": "A"}), (12, "Quiz (Version B)", {"1": "B"})]
+    }
+    # The code wins over a contradicting version bubble
+    assert batch_grader.resolve_version_key(context, 0, exam_id=12) == (12, {"1": "B"}, "Quiz (Version B)")
+    assert batch_grader.resolve_version_key(context, 0) == (11, {"1": "A"}, "Quiz (Version A)")
+    assert batch_grader.resolve_version_key(context, None, exam_id=99) is None
+
+def test_reads_a_late_page_of_an_exam_with_numeric_grids():
+    key = {str(q): {"ans": 1.5, "type": "Numeric", "tol": 0.0} if q % 2 else {"ans": "B", "type": "MCQ"}
+           for q in range(1, 51)}
+    layout = sheet_layout.layout_for(50, 4, key, page=2)
+    assert (layout.first_question, layout.last_question) == (43, 50)
+    # Page 2 is past 45 questions only when counting the numeric grids
+    assert sheet_header.decode_header(sheet_header.encode_header(31, 50, 4, page=2))["page"] == 2
+
+    answers = {q: q % 4 for q in layout.mcq_questions}
+    numeric = {q: float(q) for q in layout.numeric_page_questions}
+    img = render_sheet(layout, 17, answers=answers, numeric=numeric, exam_id=31)
+    frame = cv2.copyMakeBorder(img, 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=90)
+    result = omr_engine.process_exam(frame, preview=False, key_resolver=lambda exam_id: key)
+
+    assert result["success"] and result["page"] == 2
+    assert result["answers"] == answers and result["numeric_answers"] == numeric
+
+def test_unreadable_sheet_code_fails_instead_of_using_defaults():
+    layout = sheet_layout.get_layout(12, 4)
+    img = render_sheet(layout, 5, answers={1: 0}, exam_id=77)
+    # Cover one marker of the code
+    x, y = sheet_header.marker_origin(0)
+    size = sheet_header.MARKER_CELLS * sheet_header.CELL_SIZE
+    img[int((y - 1) * PX_PER_MM):int((y + size + 1) * PX_PER_MM), int((x - 1) * PX_PER_MM):int((x + size + 1) * PX_PER_MM)] = 255
+    result = omr_engine.process_exam(img, 12, 4, preview=False)
+
+    assert not result["success"] and "sheet code" in result["error"]
+
+def test_fast_detector_reads_rendered_sheets(monkeypatch):
+    calls = []
+    get_detector = sheet_header.get_detector
+    monkeypatch.setattr(sheet_header, "get_detector", lambda thorough=False: calls.append(thorough) or get_detector(thorough))
+    # Phone photos give the code area about 8 px/mm once it is cut out and downscaled;
+    # low-resolution scans (the 4 px/mm of the other tests) may need the thorough detector
+    for num_questions, mcq_choices, px_per_mm in ((10, 4, 6), (30, 3, 8), (45, 5, 12)):
+        layout = sheet_layout.get_layout(num_questions, mcq_choices)
+        for exam_id in (None, 4711):
+            img = render_sheet(layout, 7, answers={1: 0}, exam_id=exam_id, px_per_mm=px_per_mm)
+            for frame in (img, photograph(img, angle=4, perspective=0.03, blur=1.0, noise=3, jpeg_quality=80, seed=1)):
+                gray = omr_engine.to_gray(frame)
+                header = sheet_header.detect_header(gray, omr_engine.find_markers_coarse_to_fine(gray))
+                assert header == {"exam_id": exam_id, "num_questions": num_questions, "mcq_choices": mcq_choices, "page": 0}
+    # The thorough detector was never needed
+    assert calls and not any(calls)
+
+def test_thorough_detector_retries_unread_codes(monkeypatch):
+    blind = cv2.aruco.ArucoDetector(sheet_header._dictionary(), cv2.aruco.DetectorParameters())
+    blind.setDetectorParameters(_params(minMarkerPerimeterRate=3.9))
+    calls = []
+    get_detector = sheet_header.get_detector
+    monkeypatch.setattr(sheet_header, "get_detector",
+                        lambda thorough=False: calls.append(thorough) or (get_detector(True) if thorough else blind))
+    layout = sheet_layout.get_layout(20, 4)
+    img = render_sheet(layout, 7, answers={1: 0}, exam_id=31)
+    corners = omr_engine.find_markers_coarse_to_fine(img)
+    assert sheet_header.detect_header(img, corners)["exam_id"] == 31 and calls == [False, True]
+
+    # Sheets printed without a code leave the area blank: no second search
+    del calls[:]
+    img = render_sheet(layout, 7, answers={1: 0}, sheet_code=False)
+    assert sheet_header.detect_header(img, omr_engine.find_markers_coarse_to_fine(img)) is None and calls == [False]
+
+def _params(**values):
+    params = cv2.aruco.DetectorParameters()
+    for name, value in values.items():
+        setattr(params, name, value)
+    return params
+
+def test_sheet_code_error_counts_numeric_pages():
+    assert sheet_header.sheet_code_error(500) is None
+    numeric = {q: {"ans": 1.0, "type": "Numeric"} for q in range(1, 501)}
+    error = sheet_header.sheet_code_error(500, numeric)
+    assert error and f"at most {sheet_header.MAX_PAGES}" in error
+    # The longest all-numeric exam that fits still encodes its last page
+    longest = max(n for n in range(1, 500) if sheet_header.sheet_code_error(n, {str(q): numeric[q] for q in range(1, n + 1)}) is None)
+    last_page = sheet_layout.page_count(longest, range(1, longest + 1)) - 1
+    assert sheet_header.encode_header(None, longest, 4, page=last_page)
+    assert sheet_header.sheet_code_error(512) is not None
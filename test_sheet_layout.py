@@ -0,0 +1,32 @@
+import numpy as np
+
+import sheet_layout
+
+def hard_coded_centers(num_questions, mcq_choices):
+    # The reader's coordinates before SheetLayout existed (the generator drew the same mm values)
+    num_cols = 1 if num_questions <= 12 else 2 if num_questions <= 24 else 3
+    questions_per_col = (num_questions + num_cols - 1) // num_cols
+    active_w_mm, active_h_mm = 170, (115 + questions_per_col * 10 + 10 + 5) - 20
+    w_target = 1000
+    h_target = int(w_target * (active_h_mm / active_w_mm))
+    def to_px(mm_x, mm_y):
+        return int(((mm_x - 20) / active_w_mm) * w_target), int(((mm_y - 20) / active_h_mm) * h_target)
+
+    ids = [to_px(140 + c * 10 + 12 + 2.75, 30 + r * 8 + 2.75) for c in range(3) for r in range(10)]
+    versions = [to_px(110 + 7 + 2.75, 40 + r * 8 + 2.75) for r in range(5)]
+    col_width = 80 if num_cols == 1 else 75 if num_cols == 2 else 60
+    x_base = (210 - num_cols * col_width) / 2
+    answers = [to_px(x_base + c * col_width + 15 + j * 9 + 3.25, 115 + q * 10 + (10 - 6.5) / 2 + 3.25)
+               for c in range(num_cols)
+               for q in range(min(questions_per_col, num_questions - c * questions_per_col))
+               for j in range(mcq_choices)]
+    return (w_target, h_target), ids, versions, answers
+
+def test_default_layouts_keep_the_old_bubble_centers():
+    for num_questions, mcq_choices in ((5, 4), (12, 5), (20, 5), (24, 3), (30, 5), (45, 5)):
+        layout = sheet_layout.get_layout(num_questions, mcq_choices)
+        warp_size, ids, versions, answers = hard_coded_centers(num_questions, mcq_choices)
+        assert tuple(layout.warp_size) == warp_size
+        assert np.array_equal(np.reshape(layout.id_centers, (-1, 2)), ids)
+        assert np.array_equal(np.reshape(layout.version_centers, (-1, 2)), versions)
+        assert np.array_equal(np.reshape(layout.answer_centers, (-1, 2)), answers)
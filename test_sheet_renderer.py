@@ -0,0 +1,37 @@
+import pytest
+
+import benchmark_omr
+import omr_engine
+import sheet_layout
+import sheet_renderer
+
+def test_numeric_marks():
+    assert sheet_renderer.numeric_marks(3.14) == ("314", 2, False)
+    assert sheet_renderer.numeric_marks(-42) == ("42", 0, True)
+    assert sheet_renderer.numeric_marks(0.05) == ("05", 2, False)
+    with pytest.raises(ValueError):
+        sheet_renderer.numeric_marks(12345)
+
+def test_photographed_sheet_reads_back():
+    layout = sheet_layout.get_layout(20, 5)
+    answers = {q: (q * 3) % 5 for q in layout.questions}
+    img = sheet_renderer.render_sheet(layout, omr_id=251, version_idx=3, answers=answers, exam_id=8, px_per_mm=6)
+    photo = sheet_renderer.photograph(img, angle=5, perspective=0.03, blur=1.0, shadow=0.4, noise=5, jpeg_quality=80, seed=1)
+
+    result = omr_engine.process_exam(sheet_renderer.encode_jpeg(photo), preview=False)
+
+    assert (result["exam_id"], result["omr_id"], result["version_idx"]) == (8, 251, 3)
+    assert result["answers"] == answers
+
+def test_double_and_faint_marks_are_flagged():
+    layout = sheet_layout.get_layout(10, 4)
+    img = sheet_renderer.render_sheet(layout, omr_id=5, answers={1: (0, 2), 2: 1}, partial={2: 0.45})
+    result = omr_engine.process_exam(img, preview=False)
+    assert result["marks"][1]["status"] == "multiple" and 1 not in result["answers"]
+    assert result["answers"][2] == 1 and result["needs_review"]
+
+def test_benchmark_config_smoke():
+    r = benchmark_omr.run_config(10, 4, 2, "phone", px_per_mm=5)
+    assert r["failed"] == 0 and r["answer_accuracy"] == 1.0
+    assert r["sheets_per_sec"] > 0 and r["peak_mb"] > 0
+    assert all(r["median_ms"][stage] is not None for stage in benchmark_omr.STAGES)
@@ -0,0 +1,47 @@
+import omr_engine
+import sheet_layout
+import sheet_renderer
+import stage_profiler
+
+def test_nested_stages_accumulate():
+    calls = []
+    profiler = stage_profiler.StageProfiler(track_memory=True, on_stage=lambda name, s, b: calls.append(name))
+    for _ in range(2):
+        with profiler.stage("outer"):
+            with profiler.stage("inner"):
+                data = bytearray(200_000)
+    profiler.note("strategy", "otsu")
+    report = profiler.report()
+
+    assert calls == ["outer.inner", "outer"] * 2
+    assert set(report["stages"]) == {"outer", "outer.inner"}
+    assert report["stages"]["outer"]["ms"] >= report["stages"]["outer.inner"]["ms"]
+    assert report["stages"]["outer"]["bytes"] >= 200_000 and len(data) == 200_000
+    assert report["notes"] == {"strategy": "otsu"}
+
+def test_process_exam_profile():
+    layout = sheet_layout.get_layout(10, 4)
+    img = sheet_renderer.render_sheet(layout, omr_id=12, answers={1: 2})
+
+    assert omr_engine.process_exam(img, preview=False)["profile"] is None
+
+    result = omr_engine.process_exam(img, preview=False, profiler=stage_profiler.StageProfiler())
+    assert result["success"]
+    stages = result["profile"]["stages"]
+    for name in ("decode", "markers", "header", "warp", "id", "version", "answers"):
+        assert name in stages
+    assert result["profile"]["notes"]["marker_strategy"]
+
+def test_profile_stats_percentiles():
+    stats = stage_profiler.ProfileStats()
+    for ms in range(1, 101):
+        stats.add({"stages": {"warp": {"ms": float(ms), "bytes": None}}, "notes": {"marker_strategy": "coarse"}, "total_ms": 2.0 * ms})
+    stats.add(None)
+    summary = stats.summary()
+
+    assert stats.count == 100
+    assert summary["stages"]["warp"]["p50_ms"] == 50.5
+    assert summary["stages"]["warp"]["p95_ms"] == 95.05
+    assert summary["stages"]["total"]["max_ms"] == 200.0
+    assert summary["notes"] == {"marker_strategy": {"coarse": 100}}
+    assert "warp" in stage_profiler.format_summary(summary)
@@ -1,60 +1,57 @@
-import cv2
 import numpy as np
+
 import omr_engine
-import pages.sheet_generator_utils as gen # Wait, I wrote generator in the page file. I should extract it or mock it.
-# I'll just draw a simple mock sheet here to test the CV logic directly.
+import sheet_layout
+import sheet_renderer
+
+# Quick end-to-end check of the engine on synthetic sheets: every case is rendered with the
+# sheet_layout geometry the PDF generator prints, photographed and read back.
+# For throughput and accuracy numbers use benchmark_omr.py.
+CASES = [
+    # (num_questions, mcq_choices, numeric questions, capture conditions)
+    (10, 4, (), {}),
+    (20, 5, (), {"angle": 4, "perspective": 0.03, "blur": 1.0, "shadow": 0.3, "noise": 4, "jpeg_quality": 85}),
+    (45, 5, (), {"angle": -3, "perspective": 0.02, "blur": 1.5, "noise": 6, "jpeg_quality": 70}),
+    (24, 4, (3, 12), {"angle": 2, "perspective": 0.02, "blur": 1.0, "jpeg_quality": 85}),
+    (100, 3, (), {"perspective": 0.02, "jpeg_quality": 85}),
+]
+
+def verify_case(num_questions, mcq_choices, numeric_questions, conditions, seed=0):
+    """
+    Renders every page of one sheet, reads them back and compares with what was filled in.
+    Returns a list of mismatch descriptions (empty when the sheet read correctly).
+    """
+    rng = np.random.default_rng(seed)
+    question_data = {str(q): {"ans": 0.0, "type": "Numeric"} for q in numeric_questions}
+    omr_id = int(rng.integers(1000))
+    answers = {q: int(rng.integers(mcq_choices)) for q in range(1, num_questions + 1) if q not in numeric_questions}
+    numeric = {q: round(float(rng.uniform(-99, 99)), 1) for q in numeric_questions}
+
+    photos = []
+    for page in range(sheet_layout.page_count(num_questions, numeric_questions)):
+        layout = sheet_layout.get_layout(num_questions, mcq_choices, numeric_questions, page)
+        img = sheet_renderer.render_sheet(layout, omr_id=omr_id, answers=answers, numeric=numeric, px_per_mm=6)
+        photos.append(sheet_renderer.encode_jpeg(sheet_renderer.photograph(img, seed=seed + page, **conditions)))
+    result = omr_engine.process_pages(photos, question_data=question_data, preview=False)
 
-def create_mock_sheet():
-    # Create a white image
-    width, height = 840, 1188 # ~A4 at low dpi
-    img = np.ones((height, width, 3), dtype=np.uint8) * 255
-    
-    # Draw Markers (Top-Left, Top-Right, Bot-Left, Bot-Right)
-    # My engine looks for 4 contours that are approx rectangular
-    margin = 40
-    size = 40
-    color = (0, 0, 0)
-    thickness = -1 # Fill
-    
-    cv2.rectangle(img, (margin, margin), (margin+size, margin+size), color, thickness)
-    cv2.rectangle(img, (width-margin-size, margin), (width-margin, margin+size), color, thickness)
-    cv2.rectangle(img, (margin, height-margin-size), (margin+size, height-margin), color, thickness)
-    cv2.rectangle(img, (width-margin-size, height-margin-size), (width-margin, height-margin), color, thickness)
-    
-    # We need to ensure Perspective Transform works.
-    
-    # Draw ID Bubbles (Region 1)
-    # Logic in engine: 
-    # Resizing target: 1130 x 1600
-    # ID Region: x1, y1 = to_px(130, 25) -> (130/210)*1130, (25/297)*1600
-    # This implies the drawn image must roughly match the aspect ratio and relative positions.
-    
-    # Let's trust the engine's `to_px` logic and try to draw at those relative percent coordinates on our 840x1188 image.
-    
-    def rel(x_mm, y_mm):
-        return int((x_mm / 210.0) * width), int((y_mm / 297.0) * height)
-        
-    # ID Grid (Start 130mm, 25mm)
-    # Let's fill ID '10234'
-    # Col 0 (0-9): '1' (Row 1)
-    # Col 1: '0' (Row 0)
-    # Col 2: '2' (Row 2)
-    # Col 3: '3' (Row 3)
-    # Col 4: '4' (Row 4)
-    
-    id_start_x, id_start_y = rel(130, 25)
-    
-    # The Grid in engine is stepped by row * 5mm, col * 8mm (approx)
-    # Let's draw bubbles for ID "12345"
-    # Wait, my engine code logic for ID: `process_exam` calls `get_answers_from_roi` on `roi_id`.
-    # `get_answers_from_roi` expects rows to be questions. 
-    # It finds contours.
-    
-    # Actually, simpler Verification:
-    # Just run the app. Drawing a mock sheet perfectly to match the specific millimeter-based ROI cropping in `omr_engine` 
-    # is error-prone without using the actual PDF generator.
-    
-    pass
+    if not result["success"]:
+        return [result["error"]]
+    problems = []
+    if result["omr_id"] != omr_id:
+        problems.append(f"OMR ID {result['omr_id']} != {omr_id}")
+    wrong = [q for q, a in answers.items() if result["answers"].get(q) != a]
+    if wrong:
+        problems.append(f"wrong answers for questions {wrong}")
+    wrong = [q for q, v in numeric.items() if result["numeric_answers"].get(q) != v]
+    if wrong:
+        problems.append(f"wrong numeric answers for questions {wrong}")
+    return problems
 
 if __name__ == "__main__":
-    print("Verification script placeholder. Please run the Streamlit app to verify.")
+    failures = 0
+    for i, (num_questions, mcq_choices, numeric_questions, conditions) in enumerate(CASES):
+        problems = verify_case(num_questions, mcq_choices, numeric_questions, conditions, seed=i)
+        failures += bool(problems)
+        label = f"{num_questions} questions, {mcq_choices} choices" + (f", numeric {numeric_questions}" if numeric_questions else "")
+        print(f"{'FAIL' if problems else 'PASS'}  {label}" + (": " + "; ".join(problems) if problems else ""))
+    raise SystemExit(1 if failures else 0)